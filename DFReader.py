@@ -21,6 +21,7 @@ import platform
 import struct
 import sys
 from . import mavutil
+from . import mavindex
 
 try:
     long        # Python 2 has long
@@ -50,6 +51,20 @@ FORMAT_TO_STRUCT = {
     "Q": ("Q", None, long),  # Backward compat
     }
 
+# numpy equivalents of the struct formats above, used by to_arrays()
+STRUCT_TO_NUMPY = {
+    "b": "i1",
+    "B": "u1",
+    "h": "<i2",
+    "H": "<u2",
+    "i": "<i4",
+    "I": "<u4",
+    "f": "<f4",
+    "d": "<f8",
+    "q": "<i8",
+    "Q": "<u8",
+    }
+
 def u_ord(c):
 	return ord(c) if sys.version_info.major < 3 else c
 
@@ -98,6 +113,27 @@ class DFFormat(object):
             if self.msg_fmts[i] == 'a':
                 self.a_indexes.append(i)
 
+    def get_dtype(self):
+        '''return a numpy structured dtype matching msg_struct'''
+        import numpy
+        names = []
+        formats = []
+        for i in range(len(self.msg_fmts)):
+            c = self.msg_fmts[i]
+            s = FORMAT_TO_STRUCT[c][0]
+            if c == 'a':
+                # 'a' fields are arrays of 32 int16 values
+                formats.append(('<i2', (32,)))
+            elif s.endswith('s'):
+                formats.append('S' + s[:-1])
+            else:
+                formats.append(STRUCT_TO_NUMPY[s])
+            if i < len(self.columns) and self.columns[i] not in names:
+                names.append(self.columns[i])
+            else:
+                names.append('_field%u' % i)
+        return numpy.dtype({'names': names, 'formats': formats})
+
     def __str__(self):
         return ("DFFormat(%s,%s,%s,%s)" %
                 (self.type, self.name, self.format, self.columns))
@@ -105,6 +141,8 @@ class DFFormat(object):
 
 def to_string(s):
     '''desperate attempt to convert a string regardless of what garbage we get'''
+    if sys.version_info.major >= 3 and isinstance(s, bytes):
+        return s.decode('utf-8', 'ignore')
     try:
         s2 = s.encode('utf-8', 'ignore')
         x = u"%s" % s2
@@ -245,6 +283,12 @@ class DFReaderClock(object):
     def rewind_event(self):
         pass
 
+    def message_timestamps(self, fmt, columns):
+        '''return a numpy array of timestamps for all messages of a
+        type given their columns, or None if this clock needs to see
+        the messages in log order'''
+        return None
+
 
 class DFReaderClock_usec(DFReaderClock):
     '''DFReaderClock_usec - use microsecond timestamps from messages'''
@@ -287,6 +331,11 @@ class DFReaderClock_usec(DFReaderClock):
             m._timestamp = self.timestamp
         self.timestamp = m._timestamp
 
+    def message_timestamps(self, fmt, columns):
+        if len(fmt.columns) > 0 and fmt.columns[0] == 'TimeUS':
+            return self.timebase + columns['TimeUS']*0.000001
+        return None
+
 
 class DFReaderClock_msec(DFReaderClock):
     '''DFReaderClock_msec - a format where many messages have TimeMS in
@@ -306,6 +355,13 @@ class DFReaderClock_msec(DFReaderClock):
             m._timestamp = self.timestamp
         self.timestamp = m._timestamp
 
+    def message_timestamps(self, fmt, columns):
+        if len(fmt.columns) > 0 and fmt.columns[0] == 'TimeMS':
+            return self.timebase + columns['TimeMS']*0.001
+        if fmt.name in ['GPS', 'GPS2'] and 'T' in columns:
+            return self.timebase + columns['T']*0.001
+        return None
+
 
 class DFReaderClock_px4(DFReaderClock):
     '''DFReaderClock_px4 - a format where a starting time is explicitly
@@ -588,6 +644,8 @@ class DFReader(object):
                 type = set([type])
             elif isinstance(type, list):
                 type = set(type)
+        if condition is not None:
+            condition = mavutil.compile_expression(condition)
         while True:
             if type is not None:
                 self.skip_to_type(type)
@@ -600,6 +658,40 @@ class DFReader(object):
                 continue
             return m
 
+    def iter_messages(self, types=None, condition=None, start=None, end=None):
+        '''generator yielding the messages that match the given types
+        and condition, so loops over recv_match() can be written as a
+        for loop or chained with other generators. types can be a
+        string or a list or set of strings, other types are skipped
+        using the log index without being decoded. start and end bound
+        the message _timestamp; earlier messages are still read so
+        self.messages stays current, and the first message after end
+        stops the iteration'''
+        if types is not None and not isinstance(types, set):
+            if not isinstance(types, list):
+                types = [types]
+            types = set(types)
+        if condition is not None:
+            condition = mavutil.compile_expression(condition)
+        recv_msg = self.recv_msg
+        skip_to_type = self.skip_to_type
+        evaluate_condition = mavutil.evaluate_condition
+        while True:
+            if types is not None:
+                skip_to_type(types)
+            m = recv_msg()
+            if m is None:
+                return
+            if types is not None and not m.get_type() in types:
+                continue
+            if start is not None and m._timestamp < start:
+                continue
+            if end is not None and m._timestamp > end:
+                return
+            if condition is not None and not evaluate_condition(condition, self.messages):
+                continue
+            yield m
+
     def check_condition(self, condition):
         '''check if a condition is true'''
         return mavutil.evaluate_condition(condition, self.messages)
@@ -618,11 +710,7 @@ class DFReader(object):
         if self._flightmodes is None:
             self._rewind()
             self._flightmodes = []
-            types = set(['MODE'])
-            while True:
-                m = self.recv_match(type=types)
-                if m is None:
-                    break
+            for m in self.iter_messages(types=set(['MODE'])):
                 tstamp = m._timestamp
                 if self.flightmode == fmode:
                     continue
@@ -640,9 +728,11 @@ class DFReader(object):
 
 class DFReader_binary(DFReader):
     '''parse a binary dataflash file'''
-    def __init__(self, filename, zero_time_base=False, progress_callback=None):
+    def __init__(self, filename, zero_time_base=False, progress_callback=None, use_index=False):
         DFReader.__init__(self)
         # read the whole file into memory for simplicity
+        self.filename = filename
+        self.use_index = use_index
         self.filehandle = open(filename, 'rb')
         self.filehandle.seek(0, 2)
         self.data_len = self.filehandle.tell()
@@ -684,6 +774,8 @@ class DFReader_binary(DFReader):
 
     def init_arrays(self, progress_callback=None):
         '''initialise arrays for fast recv_match()'''
+        if self.use_index and self.load_index():
+            return
         self.offsets = []
         self.counts = []
         self._count = 0
@@ -742,6 +834,51 @@ class DFReader_binary(DFReader):
         for i in range(256):
             self._count += self.counts[i]
         self.offset = 0
+        if self.use_index:
+            self.save_index()
+
+    def save_index(self):
+        '''save the arrays from init_arrays() to a sidecar index file'''
+        formats = []
+        for mtype in sorted(self.formats.keys()):
+            fmt = self.formats[mtype]
+            formats.append([fmt.type, fmt.name, fmt.len, fmt.format, ','.join(fmt.columns)])
+        offsets = {}
+        for mtype in range(256):
+            if self.counts[mtype] != 0:
+                offsets[mtype] = self.offsets[mtype]
+        info = {'formats': formats,
+                'names': sorted(self.id_to_name.items())}
+        mavindex.save_index(self.filename, 'DFReader_binary', info, offsets)
+
+    def load_index(self):
+        '''load the arrays for init_arrays() from a sidecar index file,
+        returning False if there is no valid index'''
+        index = mavindex.load_index(self.filename, 'DFReader_binary')
+        if index is None:
+            return False
+        (info, offsets) = index
+        for (mtype, name, flen, format, columns) in info['formats']:
+            if not mtype in self.formats:
+                self.formats[mtype] = DFFormat(mtype, name, flen, format, columns)
+        self.name_to_id = {}
+        self.id_to_name = {}
+        for (mtype, name) in info['names']:
+            self.name_to_id[name] = mtype
+            self.id_to_name[mtype] = name
+        self.offsets = []
+        self.counts = []
+        for i in range(256):
+            self.offsets.append(offsets.get(i, []))
+            self.counts.append(len(self.offsets[i]))
+        self._count = sum(self.counts)
+        # init_arrays() parses the first message of each type, which
+        # fills in self.messages, the parameters and the flight mode
+        for ofs in sorted([o[0] for o in self.offsets if len(o) > 0]):
+            self.offset = ofs
+            self._parse_next()
+        self.offset = 0
+        return True
 
     def last_timestamp(self):
         '''get the last timestamp in the log'''
@@ -766,6 +903,67 @@ class DFReader_binary(DFReader):
         return m._timestamp
 
 
+    def to_arrays(self, type, apply_multiplier=True):
+        '''return all messages of the given type as a dictionary of numpy
+        arrays, one per column, plus a '_timestamp' array. String columns
+        are returned as bytes and 'a' columns as (N,32) int16 arrays.
+        Returns None if the type is not in the log'''
+        import numpy
+        if type not in self.name_to_id:
+            return None
+        mtype = self.name_to_id[type]
+        fmt = self.formats[mtype]
+        dtype = fmt.get_dtype()
+        mlen = dtype.itemsize
+
+        # gather the message bodies straight out of the mmap, skipping a
+        # message truncated by the end of the log
+        offsets = numpy.array(self.offsets[mtype], dtype=numpy.int64) + 3
+        offsets = offsets[offsets + mlen <= self.data_len]
+        data = numpy.frombuffer(self.data_map, dtype=numpy.uint8)
+        records = numpy.empty(len(offsets), dtype=dtype)
+        raw = records.view(numpy.uint8).reshape(len(offsets), mlen)
+        body = numpy.arange(mlen, dtype=numpy.int64)
+        chunk = 65536
+        for i in range(0, len(offsets), chunk):
+            ofs = offsets[i:i+chunk]
+            raw[i:i+len(ofs)] = data[ofs[:, None] + body]
+
+        columns = {}
+        for i in range(len(fmt.msg_fmts)):
+            name = dtype.names[i]
+            v = records[name]
+            mul = fmt.msg_mults[i]
+            if mul is not None and apply_multiplier:
+                v = v * mul
+            columns[name] = v
+
+        timestamps = None
+        if self.clock is not None:
+            timestamps = self.clock.message_timestamps(fmt, columns)
+        if timestamps is None:
+            timestamps = self._message_timestamps(type, offsets - 3)
+        columns['_timestamp'] = timestamps
+        return columns
+
+    def _message_timestamps(self, type, offsets):
+        '''timestamps for messages at the given offsets, found by parsing
+        the log in order as recv_match() would. This rewinds the log'''
+        import numpy
+        self._rewind()
+        stamps = {}
+        types = set([type])
+        while True:
+            self.skip_to_type(types)
+            ofs = self.offset
+            m = self.recv_msg()
+            if m is None:
+                break
+            if m.get_type() == type:
+                stamps[ofs] = m._timestamp
+        self._rewind()
+        return numpy.array([stamps.get(ofs, numpy.nan) for ofs in offsets])
+
     def skip_to_type(self, type):
         '''skip fwd to next msg matching given type set'''
 
@@ -181,7 +181,7 @@ def convert_file(mavlink_file, pcap_file):
         # peek for the next SOF
         try:
             cc = mavutil.x25crc(data[1:6+payload_len])
-            cc.accumulate(chr(MAVLINK_MESSAGE_CRCS[header['msgid']]))
+            cc.accumulate(bytearray([MAVLINK_MESSAGE_CRCS[header['msgid']]]))
             x25_crc = cc.crc
             if x25_crc != pkt_crc:
                 crc_flag = 0x1
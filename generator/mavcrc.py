@@ -1,5 +1,19 @@
 '''MAVLink X25 CRC code'''
 from builtins import object
+from builtins import range
+
+
+def _crc_table():
+    '''build the table for the byte-at-a-time CRC. The update for a byte
+    only depends on the low byte of the accumulator xored with the
+    input byte, so it can be looked up'''
+    table = []
+    for i in range(256):
+        tmp = (i ^ (i<<4)) & 0xFF
+        table.append((tmp<<8) ^ (tmp<<3) ^ (tmp>>4))
+    return tuple(table)
+
+crc_table = _crc_table()
 
 
 class x25crc(object):
@@ -14,17 +28,36 @@ class x25crc(object):
 
     def accumulate(self, buf):
         '''add in some more bytes'''
+        if isinstance(buf, str):
+            self.accumulate_str(buf)
+            return
         accum = self.crc
+        table = crc_table
         for b in buf:
-            tmp = b ^ (accum & 0xff)
-            tmp = (tmp ^ (tmp<<4)) & 0xFF
-            accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
+            accum = (accum>>8) ^ table[(accum ^ b) & 0xFF]
         self.crc = accum
 
     def accumulate_str(self, buf):
         '''add in some more bytes'''
-        accum = self.crc
-        import array
-        bytes = array.array('B')
-        bytes.fromstring(buf)
-        self.accumulate(bytes)
+        if not isinstance(buf, (bytes, bytearray)):
+            buf = buf.encode('utf-8')
+        self.accumulate(bytearray(buf))
+
+
+def x25crc_frames(buf, frames):
+    '''check the CRCs of many frames held in one buffer. buf must be a
+    bytearray (or other buffer that iterates as integers). frames is a
+    list of (start, end, crc_extra) tuples, where buf[start:end] is
+    covered by the CRC, crc_extra is an extra byte to fold in after it
+    (or None) and the CRC itself is stored little endian at
+    buf[end:end+2]. Returns a list of booleans, one per frame'''
+    table = crc_table
+    ret = []
+    for (start, end, crc_extra) in frames:
+        accum = 0xffff
+        for b in buf[start:end]:
+            accum = (accum>>8) ^ table[(accum ^ b) & 0xFF]
+        if crc_extra is not None:
+            accum = (accum>>8) ^ table[(accum ^ crc_extra) & 0xFF]
+        ret.append(accum == (buf[end] | (buf[end+1]<<8)))
+    return ret
@@ -26,6 +26,8 @@ DEFAULT_LANGUAGE = 'Python'
 DEFAULT_ERROR_LIMIT = 200
 DEFAULT_VALIDATE = True
 DEFAULT_STRICT_UNITS = False
+DEFAULT_SLOTS = False
+DEFAULT_LAZY = False
 
 MAXIMUM_INCLUDE_FILE_NESTING = 5
 
@@ -164,7 +166,8 @@ def mavgen(opts, args):
     opts.language = opts.language.lower()
     if opts.language == 'python':
         from . import mavgen_python
-        mavgen_python.generate(opts.output, xml)
+        mavgen_python.generate(opts.output, xml, slots=getattr(opts, 'slots', DEFAULT_SLOTS),
+                               lazy=getattr(opts, 'lazy', DEFAULT_LAZY))
     elif opts.language == 'c':
         from . import mavgen_c
         mavgen_c.generate(opts.output, xml)
@@ -203,16 +206,18 @@ def mavgen(opts, args):
 
 # build all the dialects in the dialects subpackage
 class Opts(object):
-    def __init__(self, output, wire_protocol=DEFAULT_WIRE_PROTOCOL, language=DEFAULT_LANGUAGE, validate=DEFAULT_VALIDATE, error_limit=DEFAULT_ERROR_LIMIT, strict_units=DEFAULT_STRICT_UNITS):
+    def __init__(self, output, wire_protocol=DEFAULT_WIRE_PROTOCOL, language=DEFAULT_LANGUAGE, validate=DEFAULT_VALIDATE, error_limit=DEFAULT_ERROR_LIMIT, strict_units=DEFAULT_STRICT_UNITS, slots=DEFAULT_SLOTS, lazy=DEFAULT_LAZY):
         self.wire_protocol = wire_protocol
         self.error_limit = error_limit
         self.language = language
         self.output = output
         self.validate = validate
         self.strict_units = strict_units
+        self.slots = slots
+        self.lazy = lazy
 
 
-def mavgen_python_dialect(dialect, wire_protocol):
+def mavgen_python_dialect(dialect, wire_protocol, lazy=DEFAULT_LAZY):
     '''generate the python code on the fly for a MAVLink dialect'''
     dialects = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'dialects')
     mdef = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'message_definitions')
@@ -231,7 +236,7 @@ def mavgen_python_dialect(dialect, wire_protocol):
         xml = os.path.join(dialects, 'v20', dialect + '.xml')
         if not os.path.exists(xml):
             xml = os.path.join(mdef, 'v1.0', dialect + '.xml')
-    opts = Opts(py, wire_protocol)
+    opts = Opts(py, wire_protocol, lazy=lazy)
 
     # Python 2 to 3 compatibility
     try:
@@ -10,14 +10,49 @@ from __future__ import print_function
 from builtins import range
 
 import os
+import struct
 import textwrap
 from . import mavtemplate
 
+# Python 2 to 3 compatibility
+try:
+    import StringIO as io
+except ImportError:
+    import io
+
 t = mavtemplate.MAVTemplate()
 
+# attributes of the generated message classes. A field with one of
+# these names must live in the instance __dict__ to hide the class
+# attribute, so it can't be given a slot
+message_class_attributes = set([
+    'id', 'name', 'fieldnames', 'ordered_fieldnames', 'fieldtypes', 'format',
+    'native_format', 'orders', 'lengths', 'array_lengths', 'crc_extra', 'unpacker',
+    'dtype_fields', 'get_dtype',
+    'format_attr', 'get_msgbuf', 'get_header', 'get_payload', 'get_crc',
+    'get_fieldnames', 'get_type', 'get_msgId', 'get_srcSystem', 'get_srcComponent',
+    'get_seq', 'get_signed', 'get_link_id', 'to_dict', 'to_json', 'sign_packet', 'pack',
+    'pack_into', 'tuple_header', 'get_tuple_type', 'to_tuple'])
+
+
+def slots_line(indent, names):
+    '''return a __slots__ declaration for a generated class'''
+    return "%s__slots__ = [%s]\n\n" % (indent, ", ".join(["'%s'" % n for n in names]))
 
-def generate_preamble(outf, msgs, basename, args, xml):
+
+def generate_preamble(outf, msgs, basename, args, xml, slots=False):
     print("Generating preamble")
+    if slots:
+        header_slots = slots_line("    ", ['mlen', 'seq', 'srcSystem', 'srcComponent', 'msgId',
+                                            'incompat_flags', 'compat_flags'])
+        # the internal attributes, plus those that mavutil sets on received messages
+        message_slots = slots_line("    ", ['_header', '_payload', '_msgbuf', '_crc', '_fieldnames',
+                                             '_type', '_signed', '_link_id', '_lazy_header',
+                                             '_lazy_payload', '_posted', '_timestamp', '_link'])
+    else:
+        header_slots = ''
+        message_slots = ''
+
     t.write(outf, """
 '''
 MAVLink protocol implementation (auto-generated by mavgen.py)
@@ -29,9 +64,9 @@ Note: this file has been auto-generated. DO NOT EDIT
 from __future__ import print_function
 from builtins import range
 from builtins import object
-import struct, array, time, json, os, sys, platform
+import struct, array, time, json, os, sys, platform, collections
 
-from ...generator.mavcrc import x25crc
+from ...generator.mavcrc import x25crc, x25crc_frames
 import hashlib
 
 WIRE_PROTOCOL_VERSION = '${WIRE_PROTOCOL_VERSION}'
@@ -50,15 +85,16 @@ native_supported = platform.system() != 'Windows' # Not yet supported on other d
 native_force = 'MAVNATIVE_FORCE' in os.environ # Will force use of native code regardless of what client app wants
 native_testing = 'MAVNATIVE_TESTING' in os.environ # Will force both native and legacy code to be used and their results compared
 
-if native_supported and float(WIRE_PROTOCOL_VERSION) <= 1:
+if native_supported:
     try:
         import mavnative
-    except ImportError:
-        print('ERROR LOADING MAVNATIVE - falling back to python implementation')
+        # not the mavnative source directory found as a namespace package
+        mavnative.NativeConnection
+    except (ImportError, AttributeError):
+        # only MAVLink1 users have always been told about this
+        if float(WIRE_PROTOCOL_VERSION) <= 1 or native_force or native_testing:
+            print('ERROR LOADING MAVNATIVE - falling back to python implementation')
         native_supported = False
-else:
-    # mavnative isn't supported for MAVLink2 yet
-    native_supported = False
 
 # some base types from mavlink_types.h
 MAVLINK_TYPE_CHAR     = 0
@@ -76,6 +112,9 @@ MAVLINK_TYPE_DOUBLE   = 10
 
 class MAVLink_header(object):
     '''MAVLink message header'''
+${HEADER_SLOTS}    packer_v1 = struct.Struct('<BBBBBB')
+    packer_v2 = struct.Struct('<BBBBBBBHB')
+
     def __init__(self, msgId, incompat_flags=0, compat_flags=0, mlen=0, seq=0, srcSystem=0, srcComponent=0):
         self.mlen = mlen
         self.seq = seq
@@ -87,15 +126,20 @@ class MAVLink_header(object):
 
     def pack(self, force_mavlink1=False):
         if WIRE_PROTOCOL_VERSION == '2.0' and not force_mavlink1:
-            return struct.pack('<BBBBBBBHB', ${PROTOCOL_MARKER}, self.mlen,
-                               self.incompat_flags, self.compat_flags,
-                               self.seq, self.srcSystem, self.srcComponent,
-                               self.msgId&0xFFFF, self.msgId>>16)
-        return struct.pack('<BBBBBB', PROTOCOL_MARKER_V1, self.mlen, self.seq,
-                           self.srcSystem, self.srcComponent, self.msgId)
+            return self.packer_v2.pack(${PROTOCOL_MARKER}, self.mlen,
+                                       self.incompat_flags, self.compat_flags,
+                                       self.seq, self.srcSystem, self.srcComponent,
+                                       self.msgId&0xFFFF, self.msgId>>16)
+        return self.packer_v1.pack(PROTOCOL_MARKER_V1, self.mlen, self.seq,
+                                   self.srcSystem, self.srcComponent, self.msgId)
 
 class MAVLink_message(object):
     '''base MAVLink message class'''
+${MESSAGE_SLOTS}    # names of the header values at the start of a message tuple, like
+    # the mavpackettype of to_dict() so they can't clash with a field
+    tuple_header = ['mavmsgid', 'mavsysid', 'mavcompid', 'mavseq']
+    _tuple_type = None
+
     def __init__(self, msgId, name):
         self._header     = MAVLink_header(msgId)
         self._payload    = None
@@ -106,6 +150,51 @@ class MAVLink_message(object):
         self._signed     = False
         self._link_id    = None
 
+    def __getattr__(self, attr):
+        '''decode the header or fields of a lazily decoded message on first access'''
+        getattribute = object.__getattribute__
+        try:
+            if attr == '_header':
+                header = getattribute(self, '_lazy_header')
+                del self._lazy_header
+                self._header = MAVLink_header(*header)
+                return self._header
+            if attr in getattribute(self, '_fieldnames'):
+                payload = getattribute(self, '_lazy_payload')
+                del self._lazy_payload
+                for (name, value) in zip(self._fieldnames, self._unpack_fields(payload)):
+                    setattr(self, name, value)
+                return getattribute(self, attr)
+        except AttributeError:
+            pass
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, attr))
+
+    @classmethod
+    def get_dtype(cls):
+        '''return a numpy structured dtype matching the packed payload,
+        with the fields in wire order'''
+        import numpy
+        return numpy.dtype(cls.dtype_fields)
+
+    @classmethod
+    def get_tuple_type(cls):
+        '''return the namedtuple type for the message as a tuple, made on
+        first use. It has the tuple_header values then the fields'''
+        if cls._tuple_type is None:
+            cls._tuple_type = collections.namedtuple(cls.name, cls.tuple_header + cls.fieldnames)
+        return cls._tuple_type
+
+    def to_tuple(self, named=False):
+        '''return the message id, source system, source component and
+        sequence number followed by the fields, as a namedtuple from
+        get_tuple_type() if named is True. This is what
+        MAVLink.decode_tuple() gives'''
+        t = (self._header.msgId, self._header.srcSystem, self._header.srcComponent,
+             self._header.seq) + tuple([getattr(self, a) for a in self._fieldnames])
+        if named:
+            return self.get_tuple_type()._make(t)
+        return t
+
     def format_attr(self, field):
         '''override field getter'''
         raw_attr = getattr(self,field)
@@ -199,47 +288,116 @@ class MAVLink_message(object):
         return json.dumps(self.to_dict())
 
     def sign_packet(self, mav):
-        h = hashlib.new('sha256')
+        h = mav.signing.keyed_hash()
         self._msgbuf += struct.pack('<BQ', mav.signing.link_id, mav.signing.timestamp)[:7]
-        h.update(mav.signing.secret_key)
         h.update(self._msgbuf)
         sig = h.digest()[:6]
         self._msgbuf += sig
         mav.signing.timestamp += 1
 
-    def pack(self, mav, crc_extra, payload, force_mavlink1=False):
-        plen = len(payload)
+    def _pack_frame(self, mav, buf, offset, hlen, crc_extra, plen, force_mavlink1):
+        '''fill in the header, CRC and signature of a frame in buf whose
+        payload has already been packed at offset+hlen. Returns the frame
+        length, the payload length and incompat flags used in the header
+        and the CRC'''
+        end = offset + hlen + plen
         if WIRE_PROTOCOL_VERSION != '1.0' and not force_mavlink1:
             # in MAVLink2 we can strip trailing zeros off payloads. This allows for simple
             # variable length arrays and smaller packets
-            while plen > 1 and payload[plen-1] == chr(0):
+            while plen > 1 and buf[end-1] == 0:
                 plen -= 1
-        self._payload = payload[:plen]
+                end -= 1
         incompat_flags = 0
         if mav.signing.sign_outgoing:
             incompat_flags |= MAVLINK_IFLAG_SIGNED
+        msgId = self._header.msgId
+        if hlen == 10:
+            MAVLink_header.packer_v2.pack_into(buf, offset, ${PROTOCOL_MARKER}, plen,
+                                               incompat_flags, 0,
+                                               mav.seq, mav.srcSystem, mav.srcComponent,
+                                               msgId&0xFFFF, msgId>>16)
+        else:
+            MAVLink_header.packer_v1.pack_into(buf, offset, PROTOCOL_MARKER_V1, plen, mav.seq,
+                                               mav.srcSystem, mav.srcComponent, msgId)
+        if ${crc_extra}: # using CRC extra
+            # the extra byte goes where the CRC is about to be written
+            buf[end] = crc_extra
+            crc = x25crc(buf[offset+1:end+1])
+        else:
+            crc = x25crc(buf[offset+1:end])
+        struct.pack_into('<H', buf, end, crc.crc)
+        end += 2
+        if mav.signing.sign_outgoing and not force_mavlink1:
+            buf[end:end+7] = struct.pack('<BQ', mav.signing.link_id, mav.signing.timestamp)[:7]
+            h = mav.signing.keyed_hash()
+            h.update(buf[offset:end+7])
+            buf[end+7:end+13] = h.digest()[:6]
+            end += 13
+            mav.signing.timestamp += 1
+        return (end - offset, plen, incompat_flags, crc.crc)
+
+    def pack(self, mav, crc_extra, payload, force_mavlink1=False):
+        if WIRE_PROTOCOL_VERSION == '2.0' and not force_mavlink1:
+            hlen = 10
+        else:
+            hlen = 6
+        buf = bytearray(hlen + len(payload) + 2 + MAVLINK_SIGNATURE_BLOCK_LEN)
+        buf[hlen:hlen+len(payload)] = payload
+        (flen, plen, incompat_flags, self._crc) = self._pack_frame(mav, buf, 0, hlen, crc_extra,
+                                                                    len(payload), force_mavlink1)
+        self._payload = bytes(buf[hlen:hlen+plen])
         self._header  = MAVLink_header(self._header.msgId,
                                        incompat_flags=incompat_flags, compat_flags=0,
-                                       mlen=len(self._payload), seq=mav.seq,
+                                       mlen=plen, seq=mav.seq,
                                        srcSystem=mav.srcSystem, srcComponent=mav.srcComponent)
-        self._msgbuf = self._header.pack(force_mavlink1=force_mavlink1) + self._payload
-        crc = x25crc(self._msgbuf[1:])
-        if ${crc_extra}: # using CRC extra
-            crc.accumulate_str(struct.pack('B', crc_extra))
-        self._crc = crc.crc
-        self._msgbuf += struct.pack('<H', self._crc)
-        if mav.signing.sign_outgoing and not force_mavlink1:
-            self.sign_packet(mav)
+        self._msgbuf = bytes(buf[:flen])
         return self._msgbuf
 
+    def pack_into(self, mav, buf, offset=0, force_mavlink1=False):
+        '''pack the message as a complete frame into buf, a bytearray,
+        starting at offset. This gives the same frame as pack(), but
+        nothing is allocated for it and it is not kept on the message.
+        buf needs room for the header, the full payload, the CRC and a
+        signature. Returns the length of the frame'''
+        if WIRE_PROTOCOL_VERSION == '2.0' and not force_mavlink1:
+            hlen = 10
+        else:
+            hlen = 6
+        self._pack_payload_into(buf, offset + hlen)
+        cls = self.__class__
+        return self._pack_frame(mav, buf, offset, hlen, cls.crc_extra, cls.unpacker.size,
+                                force_mavlink1)[0]
+
+    def _set_frame(self, msgbuf):
+        '''set the header, payload, CRC and frame of the message from a
+        frame packed by pack_into(), as pack() would have set them'''
+        if ord(msgbuf[:1]) == PROTOCOL_MARKER_V1:
+            (magic, mlen, seq, srcSystem, srcComponent, msgId) = MAVLink_header.packer_v1.unpack_from(msgbuf)
+            hlen = 6
+            incompat_flags = 0
+        else:
+            (magic, mlen, incompat_flags, compat_flags, seq, srcSystem,
+             srcComponent, msgIdlow, msgIdhigh) = MAVLink_header.packer_v2.unpack_from(msgbuf)
+            hlen = 10
+        self._header = MAVLink_header(self._header.msgId,
+                                      incompat_flags=incompat_flags, compat_flags=0,
+                                      mlen=mlen, seq=seq,
+                                      srcSystem=srcSystem, srcComponent=srcComponent)
+        self._payload = msgbuf[hlen:hlen+mlen]
+        (self._crc,) = struct.unpack_from('<H', msgbuf, hlen+mlen)
+        self._msgbuf = msgbuf
+
 """, {'FILELIST': ",".join(args),
       'PROTOCOL_MARKER': xml.protocol_marker,
       'DIALECT': os.path.splitext(os.path.basename(basename))[0],
       'crc_extra': xml.crc_extra,
+      'sort_fields': xml.sort_fields,
+      'HEADER_SLOTS': header_slots,
+      'MESSAGE_SLOTS': message_slots,
       'WIRE_PROTOCOL_VERSION': xml.wire_protocol_version})
 
 
-def generate_enums(outf, enums):
+def generate_enums(outf, enums, lazy=False):
     print("Generating enums")
     outf.write('''
 # enums
@@ -249,23 +407,41 @@ class EnumEntry(object):
         self.name = name
         self.description = description
         self.param = {}
-
-enums = {}
 ''')
     wrapper = textwrap.TextWrapper(initial_indent="", subsequent_indent="                        # ")
+    if lazy:
+        # the enum values are plain constants, but the enums table is
+        # only built when the module enums attribute is first used
+        for e in enums:
+            outf.write("\n# %s\n" % e.name)
+            for entry in e.entry:
+                outf.write("%s = %u # %s\n" % (entry.name, entry.value, wrapper.fill(entry.description)))
+        outf.write('''
+def _define_enums():
+    \'\'\'build the enums table\'\'\'
+    enums = {}
+''')
+        indent = "    "
+    else:
+        outf.write("\nenums = {}\n")
+        indent = ""
     for e in enums:
-        outf.write("\n# %s\n" % e.name)
-        outf.write("enums['%s'] = {}\n" % e.name)
+        if not lazy:
+            outf.write("\n# %s\n" % e.name)
+        outf.write("%senums['%s'] = {}\n" % (indent, e.name))
         for entry in e.entry:
-            outf.write("%s = %u # %s\n" % (entry.name, entry.value, wrapper.fill(entry.description)))
-            outf.write("enums['%s'][%d] = EnumEntry('%s', '''%s''')\n" % (e.name,
-                                                                          int(entry.value), entry.name,
-                                                                          entry.description))
+            if not lazy:
+                outf.write("%s = %u # %s\n" % (entry.name, entry.value, wrapper.fill(entry.description)))
+            outf.write("%senums['%s'][%d] = EnumEntry('%s', \'\'\'%s\'\'\')\n" % (indent, e.name,
+                                                                              int(entry.value), entry.name,
+                                                                              entry.description))
             for param in entry.param:
-                outf.write("enums['%s'][%d].param[%d] = '''%s'''\n" % (e.name,
+                outf.write("%senums['%s'][%d].param[%d] = \'\'\'%s\'\'\'\n" % (indent, e.name,
                                                                        int(entry.value),
                                                                        int(param.index),
                                                                        param.description))
+    if lazy:
+        outf.write("    return enums\n")
 
 
 def generate_message_ids(outf, msgs):
@@ -276,68 +452,153 @@ def generate_message_ids(outf, msgs):
         outf.write("MAVLINK_MSG_ID_%s = %u\n" % (m.name.upper(), m.id))
 
 
-def generate_classes(outf, msgs):
+def message_slots(m):
+    '''return the __slots__ declaration for a message class. Fields named
+    like a class attribute go in a __dict__'''
+    names = [f for f in m.fieldnames if f not in message_class_attributes]
+    if len(names) != len(m.fieldnames):
+        names.append('__dict__')
+    return slots_line("    ", names)
+
+
+def generate_classes(outf, msgs, slots=False, lazy=False):
     print("Generating class definitions")
-    wrapper = textwrap.TextWrapper(initial_indent="        ", subsequent_indent="        ")
     for m in msgs:
-        classname = "MAVLink_%s_message" % m.name.lower()
-        fieldname_str = ", ".join(["'%s'" % s for s in m.fieldnames])
-        ordered_fieldname_str = ", ".join(["'%s'" % s for s in m.ordered_fieldnames])
-
-        fieldtypes_str = ", ".join(["'%s'" % s for s in m.fieldtypes])
-        outf.write("""
+        if not lazy:
+            generate_class(outf, m, slots)
+            continue
+        # wrap the class in a function that defines it on first use
+        classf = io.StringIO()
+        generate_class(classf, m, slots)
+        outf.write("\n\ndef _define_%s():" % m.name.lower())
+        for line in classf.getvalue().split("\n"):
+            if line:
+                outf.write("    %s" % line)
+            outf.write("\n")
+        outf.write("    return MAVLink_%s_message\n" % m.name.lower())
+
+
+def generate_class(outf, m, slots):
+    '''generate the class for one message'''
+    wrapper = textwrap.TextWrapper(initial_indent="    ", subsequent_indent="    ")
+    classname = "MAVLink_%s_message" % m.name.lower()
+    fieldname_str = ", ".join(["'%s'" % s for s in m.fieldnames])
+    ordered_fieldname_str = ", ".join(["'%s'" % s for s in m.ordered_fieldnames])
+
+    fieldtypes_str = ", ".join(["'%s'" % s for s in m.fieldtypes])
+    outf.write("""
 class %s(MAVLink_message):
-        '''
+    '''
 %s
-        '''
-        id = MAVLINK_MSG_ID_%s
-        name = '%s'
-        fieldnames = [%s]
-        ordered_fieldnames = [%s]
-        fieldtypes = [%s]
-        format = '%s'
-        native_format = bytearray('%s', 'ascii')
-        orders = %s
-        lengths = %s
-        array_lengths = %s
-        crc_extra = %s
-        unpacker = struct.Struct('%s')
-
-        def __init__(self""" % (classname, wrapper.fill(m.description.strip()),
-            m.name.upper(),
-            m.name.upper(),
-            fieldname_str,
-            ordered_fieldname_str,
-            fieldtypes_str,
-            m.fmtstr,
-            m.native_fmtstr,
-            m.order_map,
-            m.len_map,
-            m.array_len_map,
-            m.crc_extra,
-            m.fmtstr))
-        for i in range(len(m.fields)):
-                fname = m.fieldnames[i]
-                if m.extensions_start is not None and i >= m.extensions_start:
-                        fdefault = m.fielddefaults[i]
-                        outf.write(", %s=%s" % (fname, fdefault))
-                else:
-                        outf.write(", %s" % fname)
-        outf.write("):\n")
-        outf.write("                MAVLink_message.__init__(self, %s.id, %s.name)\n" % (classname, classname))
-        outf.write("                self._fieldnames = %s.fieldnames\n" % (classname))
-        for f in m.fields:
-                outf.write("                self.%s = %s\n" % (f.name, f.name))
-        outf.write("""
-        def pack(self, mav, force_mavlink1=False):
-                return MAVLink_message.pack(self, mav, %u, struct.pack('%s'""" % (m.crc_extra, m.fmtstr))
-        for field in m.ordered_fields:
-                if (field.type != "char" and field.array_length > 1):
-                        for i in range(field.array_length):
-                                outf.write(", self.{0:s}[{1:d}]".format(field.name, i))
-                else:
-                        outf.write(", self.{0:s}".format(field.name))
-        outf.write("), force_mavlink1=force_mavlink1)\n")
+    '''
+    id = MAVLINK_MSG_ID_%s
+    name = '%s'
+    fieldnames = [%s]
+    ordered_fieldnames = [%s]
+    fieldtypes = [%s]
+    format = '%s'
+    native_format = bytearray('%s', 'ascii')
+    orders = %s
+    lengths = %s
+    array_lengths = %s
+    crc_extra = %s
+    unpacker = struct.Struct('%s')
+    dtype_fields = [%s]
+
+%s    def __init__(self""" % (classname, wrapper.fill(m.description.strip()),
+        m.name.upper(),
+        m.name.upper(),
+        fieldname_str,
+        ordered_fieldname_str,
+        fieldtypes_str,
+        m.fmtstr,
+        m.native_fmtstr,
+        m.order_map,
+        m.len_map,
+        m.array_len_map,
+        m.crc_extra,
+        m.fmtstr,
+        ", ".join(m.dtype_fields),
+        message_slots(m) if slots else ''))
+    for i in range(len(m.fields)):
+            fname = m.fieldnames[i]
+            if m.extensions_start is not None and i >= m.extensions_start:
+                    fdefault = m.fielddefaults[i]
+                    outf.write(", %s=%s" % (fname, fdefault))
+            else:
+                    outf.write(", %s" % fname)
+    outf.write("):\n")
+    outf.write("        MAVLink_message.__init__(self, %s.id, %s.name)\n" % (classname, classname))
+    outf.write("        self._fieldnames = %s.fieldnames\n" % (classname))
+    for f in m.fields:
+            outf.write("        self.%s = %s\n" % (f.name, f.name))
+    values = unpack_field_values(m)
+    size = struct.calcsize(m.fmtstr)
+    outf.write("""
+    @classmethod
+    def _unpack_fields(cls, mbuf):
+        t = cls.unpacker.unpack_from(mbuf)
+        return [%s]
+
+    @classmethod
+    def _decode(cls, mbuf, header):
+        if len(mbuf) < %u:
+            mbuf = bytes(mbuf).ljust(%u, b'\\0')
+        t = cls.unpacker.unpack_from(mbuf)
+        m = cls.__new__(cls)
+        m._header = header
+        m._fieldnames = cls.fieldnames
+        m._type = cls.name
+        m._link_id = None
+""" % (", ".join(values), size, size))
+    for (f, value) in zip(m.fields, values):
+            outf.write("        m.%s = %s\n" % (f.name, value))
+    outf.write("""        return m
+
+    @classmethod
+    def _decode_tuple(cls, mbuf, msgId, srcSystem, srcComponent, seq):
+        if len(mbuf) < %u:
+            mbuf = bytes(mbuf).ljust(%u, b'\\0')
+        t = cls.unpacker.unpack_from(mbuf)
+        return (msgId, srcSystem, srcComponent, seq, %s)
+""" % (size, size, ", ".join(values)))
+    pack_args = ""
+    for field in m.ordered_fields:
+            if (field.type != "char" and field.array_length > 1):
+                    for i in range(field.array_length):
+                            pack_args += ", self.{0:s}[{1:d}]".format(field.name, i)
+            else:
+                    pack_args += ", self.{0:s}".format(field.name)
+    outf.write("""
+    def pack(self, mav, force_mavlink1=False):
+        return MAVLink_message.pack(self, mav, %u, %s.unpacker.pack(%s), force_mavlink1=force_mavlink1)
+
+    def _pack_payload_into(self, buf, offset):
+        %s.unpacker.pack_into(buf, offset%s)
+""" % (m.crc_extra, classname, pack_args[2:], classname, pack_args))
+
+
+def unpack_field_values(m):
+    '''python expressions for the value of each field of a message, in
+    fieldnames order, taken from the tuple t returned by its unpacker'''
+    offsets = {}
+    ofs = 0
+    for f in m.ordered_fields:
+        offsets[f.name] = ofs
+        if f.type != 'char' and f.array_length > 1:
+            ofs += f.array_length
+        else:
+            ofs += 1
+    values = []
+    for f in m.fields:
+        i = offsets[f.name]
+        if f.type == 'char':
+            values.append("decode_string(t[%u])" % i)
+        elif f.array_length > 1:
+            values.append("list(t[%u:%u])" % (i, i + f.array_length))
+        else:
+            values.append("t[%u]" % i)
+    return values
 
 
 def native_mavfmt(field):
@@ -383,6 +644,28 @@ def mavfmt(field):
     return map[field.type]
 
 
+def numpy_dtype_field(field, endian):
+    '''work out the numpy structured dtype entry for a field'''
+    map = {
+        'float': 'f4',
+        'double': 'f8',
+        'int8_t': 'i1',
+        'uint8_t': 'u1',
+        'uint8_t_mavlink_version': 'u1',
+        'int16_t': 'i2',
+        'uint16_t': 'u2',
+        'int32_t': 'i4',
+        'uint32_t': 'u4',
+        'int64_t': 'i8',
+        'uint64_t': 'u8',
+        }
+    if field.type == 'char':
+        return "('%s', 'S%u')" % (field.name, max(field.array_length, 1))
+    if field.array_length:
+        return "('%s', '%s%s', (%u,))" % (field.name, endian, map[field.type], field.array_length)
+    return "('%s', '%s%s')" % (field.name, endian, map[field.type])
+
+
 def mavdefault(field):
     '''returns default value for field (as string) for mavlink2 extensions'''
     if field.type == 'char':
@@ -394,14 +677,97 @@ def mavdefault(field):
     return "[" + ",".join([default_value] * field.array_length) + "]"
 
 
-def generate_mavlink_class(outf, msgs, xml):
-    print("Generating MAVLink class")
+def generate_lazy_map(outf, msgs):
+    '''generate the mavlink_map and module __getattr__ for a dialect
+    with lazily defined message classes'''
+    outf.write('''
+
+class MAVLink_message_map(dict):
+    \'\'\'map from message id to message class, defining each class the
+    first time it is looked up. It behaves as though all the classes
+    are present\'\'\'
+    def __init__(self, factories):
+        dict.__init__(self)
+        self.factories = factories
+
+    def __missing__(self, msgId):
+        cls = self.factories[msgId]()
+        cls.__qualname__ = cls.__name__
+        globals()[cls.__name__] = cls
+        self[msgId] = cls
+        return cls
+
+    def load_all(self):
+        \'\'\'define all the message classes\'\'\'
+        for msgId in self.factories:
+            self[msgId]
+
+    def __contains__(self, msgId):
+        return msgId in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+    def get(self, msgId, default=None):
+        if msgId in self.factories:
+            return self[msgId]
+        return default
+
+    def keys(self):
+        return self.factories.keys()
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
 
-    outf.write("\n\nmavlink_map = {\n")
+mavlink_map = MAVLink_message_map({
+''')
     for m in msgs:
-        outf.write("        MAVLINK_MSG_ID_%s : MAVLink_%s_message,\n" % (
+        outf.write("        MAVLINK_MSG_ID_%s : _define_%s,\n" % (
             m.name.upper(), m.name.lower()))
-    outf.write("}\n\n")
+    outf.write("})\n\nmavlink_class_ids = {\n")
+    for m in msgs:
+        outf.write("        'MAVLink_%s_message' : MAVLINK_MSG_ID_%s,\n" % (
+            m.name.lower(), m.name.upper()))
+    outf.write('''}
+
+def __getattr__(name):
+    \'\'\'define message classes and the enums table on first use\'\'\'
+    if name == 'enums':
+        global enums
+        enums = _define_enums()
+        return enums
+    if name in mavlink_class_ids:
+        return mavlink_map[mavlink_class_ids[name]]
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+''')
+
+
+def generate_mavlink_class(outf, msgs, xml, lazy=False):
+    print("Generating MAVLink class")
+
+    if lazy:
+        generate_lazy_map(outf, msgs)
+    else:
+        outf.write("\n\nmavlink_map = {\n")
+        for m in msgs:
+            outf.write("        MAVLINK_MSG_ID_%s : MAVLink_%s_message,\n" % (
+                m.name.upper(), m.name.lower()))
+        outf.write("}\n\n")
+    outf.write("# message types that can be lazily decoded. Fields that share a name\n")
+    outf.write("# with a class attribute (such as id) hide it, so those are always\n")
+    outf.write("# decoded in full\n")
+    outf.write("lazy_decode_ids = set(mavlink_map.keys()) - set([%s])\n\n" % ", ".join(
+        ["MAVLINK_MSG_ID_%s" % m.name.upper() for m in msgs
+         if set(m.fieldnames) & message_class_attributes]))
 
     t.write(outf, """
 class MAVError(Exception):
@@ -420,15 +786,27 @@ class MAVString(str):
                 return self[:]
             return self[0:i]
 
+if sys.version_info.major >= 3:
+    def decode_string(s):
+        '''decode a NUL terminated char field from the wire'''
+        return s.decode('utf-8').split('\\x00', 1)[0]
+else:
+    def decode_string(s):
+        '''decode a NUL terminated char field from the wire'''
+        return s.split('\\x00', 1)[0]
+
 class MAVLink_bad_data(MAVLink_message):
         '''
-        a piece of bad data in a mavlink stream
+        a piece of bad data in a mavlink stream. offset is the position
+        of the data in the stream, counting from the first byte received,
+        if it is known
         '''
-        def __init__(self, data, reason):
+        def __init__(self, data, reason, offset=None):
                 MAVLink_message.__init__(self, MAVLINK_MSG_ID_BAD_DATA, 'BAD_DATA')
                 self._fieldnames = ['data', 'reason']
                 self.data = data
                 self.reason = reason
+                self.offset = offset
                 self._msgbuf = data
 
         def __str__(self):
@@ -444,11 +822,33 @@ class MAVLinkSigning(object):
         self.sign_outgoing = False
         self.allow_unsigned_callback = None
         self.stream_timestamps = {}
+        self.max_streams = 256
         self.sig_count = 0
         self.badsig_count = 0
         self.goodsig_count = 0
         self.unsigned_count = 0
         self.reject_count = 0
+        self.hash_key = None
+        self.keyed_sha256 = None
+
+    def keyed_hash(self):
+        '''return a sha256 hash that has already been fed the secret key.
+        The keyed state is kept between calls and copied, so the key is
+        only hashed again when it changes'''
+        if self.keyed_sha256 is None or self.hash_key != self.secret_key:
+            self.hash_key = bytes(self.secret_key)
+            self.keyed_sha256 = hashlib.new('sha256')
+            self.keyed_sha256.update(self.hash_key)
+        return self.keyed_sha256.copy()
+
+    def add_stream(self, stream_key, timestamp):
+        '''record the last timestamp of a signed stream. At most
+        max_streams are kept, forgetting the one that has been quiet
+        longest to make room'''
+        stream_timestamps = self.stream_timestamps
+        if not stream_key in stream_timestamps and len(stream_timestamps) >= self.max_streams:
+            del stream_timestamps[min(stream_timestamps, key=stream_timestamps.get)]
+        stream_timestamps[stream_key] = timestamp
 
 class MAVLink(object):
         '''MAVLink protocol handling class'''
@@ -463,11 +863,19 @@ class MAVLink(object):
                 self.send_callback = None
                 self.send_callback_args = None
                 self.send_callback_kwargs = None
+                self.filter_callback = None
+                self.filter_callback_args = None
+                self.filter_callback_kwargs = None
+                self.message_callbacks = {}
+                self.msgid_filter = None
                 self.buf = bytearray()
                 self.buf_index = 0
+                self.pack_buf = bytearray()
                 self.expected_length = HEADER_LEN_V1+2
                 self.have_prefix_error = False
                 self.robust_parsing = False
+                self.crc_resync = False
+                self.lazy_decode = False
                 self.protocol_marker = ${protocol_marker}
                 self.little_endian = ${little_endian}
                 self.crc_extra = ${crc_extra}
@@ -477,10 +885,13 @@ class MAVLink(object):
                 self.total_packets_received = 0
                 self.total_bytes_received = 0
                 self.total_receive_errors = 0
+                self.total_packets_filtered = 0
                 self.startup_time = time.time()
                 self.signing = MAVLinkSigning()
                 if native_supported and (use_native or native_testing or native_force):
                     print("NOTE: mavnative is currently beta-test code")
+                    if hasattr(mavlink_map, 'load_all'):
+                        mavlink_map.load_all()
                     self.native = mavnative.NativeConnection(MAVLink_message, mavlink_map)
                 else:
                     self.native = None
@@ -502,6 +913,62 @@ class MAVLink(object):
             self.send_callback_args = args
             self.send_callback_kwargs = kwargs
 
+        def __message_type_names(self, types):
+            '''convert a type name or id, or a list of them, to a list of type names'''
+            if not isinstance(types, (list, tuple, set)):
+                types = [types]
+            ret = []
+            for t in types:
+                if isinstance(t, int):
+                    if not t in mavlink_map:
+                        raise MAVError('unknown MAVLink message ID %u' % t)
+                    t = mavlink_map[t].name
+                ret.append(t)
+            return ret
+
+        def add_message_callback(self, types, callback, *args, **kwargs):
+            '''add a callback for messages of the given types (a type name or
+            id, a list of them, or '*' for all messages). It is called as
+            callback(msg, *args, **kwargs), after the set_callback() callback'''
+            for t in self.__message_type_names(types):
+                callbacks = self.message_callbacks.get(t, ())
+                self.message_callbacks[t] = callbacks + ((callback, args, kwargs),)
+
+        def remove_message_callback(self, types, callback):
+            '''remove a callback added with add_message_callback()'''
+            for t in self.__message_type_names(types):
+                callbacks = tuple([c for c in self.message_callbacks.get(t, ()) if c[0] != callback])
+                if callbacks:
+                    self.message_callbacks[t] = callbacks
+                elif t in self.message_callbacks:
+                    del self.message_callbacks[t]
+
+        def set_filter_callback(self, callback, *args, **kwargs):
+            '''set a callback for frames dropped by the message id filter. It
+            is called as callback(msgId, seq, srcSystem, srcComponent, *args, **kwargs)'''
+            self.filter_callback = callback
+            self.filter_callback_args = args
+            self.filter_callback_kwargs = kwargs
+
+        def set_msgid_filter(self, msgids):
+            '''only decode messages with the given ids or type names. Frames
+            of other types are dropped once their CRC has been checked,
+            without checking the signature or unpacking the payload, and
+            the filter callback is called for them. None decodes all
+            messages. The native parser does not filter'''
+            if msgids is None:
+                self.msgid_filter = None
+                return
+            name_to_id = dict([(v.name, k) for (k, v) in mavlink_map.items()])
+            msgid_filter = set()
+            for m in msgids:
+                if not isinstance(m, int):
+                    if not m in name_to_id:
+                        raise MAVError('unknown MAVLink message type %s' % m)
+                    m = name_to_id[m]
+                msgid_filter.add(m)
+            self.msgid_filter = msgid_filter
+
         def send(self, mavmsg, force_mavlink1=False):
                 '''send a MAVLink message'''
                 buf = mavmsg.pack(self, force_mavlink1=force_mavlink1)
@@ -512,6 +979,53 @@ class MAVLink(object):
                 if self.send_callback:
                     self.send_callback(mavmsg, *self.send_callback_args, **self.send_callback_kwargs)
 
+        def encode_batch(self, msgs, force_mavlink1=False):
+                '''pack a list of messages back to back, as if each had been
+                passed to send() in turn, so the sequence number advances and
+                messages are signed if signing is on. The frames are packed
+                with pack_into() into a buffer reused between calls rather
+                than one buffer per message, and are not kept on the
+                messages. Returns the frames as one bytes object'''
+                return self.__pack_batch(msgs, force_mavlink1, None)
+
+        def __pack_batch(self, msgs, force_mavlink1, ends):
+                '''pack messages into pack_buf, appending the end offset of
+                each frame to ends if it is not None'''
+                size = 0
+                for m in msgs:
+                    size += m.__class__.unpacker.size + HEADER_LEN_V2 + 2 + MAVLINK_SIGNATURE_BLOCK_LEN
+                buf = self.pack_buf
+                if len(buf) < size:
+                    buf.extend(bytearray(size - len(buf)))
+                ofs = 0
+                for m in msgs:
+                    ofs += m.pack_into(self, buf, ofs, force_mavlink1=force_mavlink1)
+                    self.seq = (self.seq + 1) % 256
+                    if ends is not None:
+                        ends.append(ofs)
+                return memoryview(buf)[:ofs].tobytes()
+
+        def send_many(self, msgs, force_mavlink1=False):
+                '''send a list of messages with a single write, packing them
+                with encode_batch(). If there is a send callback it is called
+                for each message in turn after the write, with the header,
+                payload and frame of the message set as send() would have
+                set them'''
+                if self.send_callback:
+                    ends = []
+                else:
+                    ends = None
+                buf = self.__pack_batch(msgs, force_mavlink1, ends)
+                self.file.write(buf)
+                self.total_packets_sent += len(msgs)
+                self.total_bytes_sent += len(buf)
+                if self.send_callback:
+                    start = 0
+                    for (m, end) in zip(msgs, ends):
+                        m._set_frame(buf[start:end])
+                        start = end
+                        self.send_callback(m, *self.send_callback_args, **self.send_callback_kwargs)
+
         def buf_len(self):
             return len(self.buf) - self.buf_index
 
@@ -529,12 +1043,41 @@ class MAVLink(object):
         def __parse_char_native(self, c):
             '''this method exists only to see in profiling results'''
             m = self.native.parse_chars(c)
+            if m is not None and (self.signing.secret_key is not None or
+                                  (m._header.incompat_flags & MAVLINK_IFLAG_SIGNED)):
+                m = self.__native_signing(m, c)
+            return m
+
+        def __native_signing(self, m, c):
+            '''make the signing checks decode() makes on a message from the
+            native parser, which doesn't check signatures. c is the buffer
+            the message was parsed from'''
+            if m._header.incompat_flags & MAVLINK_IFLAG_SIGNED:
+                signature_len = MAVLINK_SIGNATURE_BLOCK_LEN
+            else:
+                signature_len = 0
+            try:
+                m._signed = self.__check_signing(m._msgbuf, m.get_msgId(), m.get_srcSystem(),
+                                                 m.get_srcComponent(), signature_len)
+            except MAVError as reason:
+                if not self.robust_parsing:
+                    raise
+                self.total_receive_errors += 1
+                offset = self.total_bytes_received - len(c) - len(m._msgbuf)
+                return MAVLink_bad_data(m._msgbuf, reason.message, offset)
+            if m._signed:
+                m._link_id = m._msgbuf[-13]
             return m
 
         def __callbacks(self, msg):
             '''this method exists only to make profiling results easier to read'''
             if self.callback:
                 self.callback(msg, *self.callback_args, **self.callback_kwargs)
+            if self.message_callbacks:
+                for (callback, args, kwargs) in self.message_callbacks.get(msg.get_type(), ()):
+                    callback(msg, *args, **kwargs)
+                for (callback, args, kwargs) in self.message_callbacks.get('*', ()):
+                    callback(msg, *args, **kwargs)
 
         def parse_char(self, c):
             '''input some data bytes, possibly returning a new message'''
@@ -545,15 +1088,27 @@ class MAVLink(object):
             if self.native:
                 if native_testing:
                     self.test_buf.extend(c)
-                    m = self.__parse_char_native(self.test_buf)
+                    # a signature can only be checked once, as the timestamp
+                    # is then old, so that is left to the legacy parser
+                    m = self.native.parse_chars(self.test_buf)
                     m2 = self.__parse_char_legacy()
+                    if m is not None and isinstance(m2, MAVLink_bad_data) and m2.reason == 'Invalid signature':
+                        m = m2
                     if m2 != m:
                         print("Native: %s\\nLegacy: %s\\n" % (m, m2))
                         raise Exception('Native vs. Legacy mismatch')
+                    if m is not None:
+                        m._signed = m2._signed
+                        m._link_id = m2._link_id
                 else:
                     m = self.__parse_char_native(self.buf)
             else:
                 m = self.__parse_char_legacy()
+                if self.buf_index >= 65536:
+                    # reading ahead can keep the buffer from ever emptying,
+                    # so drop what has been parsed now and then
+                    del self.buf[:self.buf_index]
+                    self.buf_index = 0
 
             if m is not None:
                 self.total_packets_received += 1
@@ -569,53 +1124,89 @@ class MAVLink(object):
 
         def __parse_char_legacy(self):
             '''input some data bytes, possibly returning a new message (uses no native code)'''
-            header_len = HEADER_LEN_V1
-            if self.buf_len() >= 1 and self.buf[self.buf_index] == PROTOCOL_MARKER_V2:
-                header_len = HEADER_LEN_V2
-
-            if self.buf_len() >= 1 and self.buf[self.buf_index] != PROTOCOL_MARKER_V1 and self.buf[self.buf_index] != PROTOCOL_MARKER_V2:
-                magic = self.buf[self.buf_index]
-                self.buf_index += 1
-                if self.robust_parsing:
-                    m = MAVLink_bad_data(bytearray([magic]), 'Bad prefix')
-                    self.expected_length = header_len+2
+            while True:
+                header_len = HEADER_LEN_V1
+                if self.buf_len() >= 1 and self.buf[self.buf_index] == PROTOCOL_MARKER_V2:
+                    header_len = HEADER_LEN_V2
+
+                if self.buf_len() >= 1 and self.buf[self.buf_index] != PROTOCOL_MARKER_V1 and self.buf[self.buf_index] != PROTOCOL_MARKER_V2:
+                    magic = self.buf[self.buf_index]
+                    if self.robust_parsing:
+                        # skip the whole run of garbage up to the next marker
+                        start = self.buf_index
+                        self.buf_index = self.__next_marker(self.buf, start+1, len(self.buf))
+                        m = self.__bad_data(start, self.buf_index, 'Bad prefix')
+                        self.expected_length = header_len+2
+                        return m
+                    self.buf_index += 1
+                    if self.have_prefix_error:
+                        return None
+                    self.have_prefix_error = True
                     self.total_receive_errors += 1
-                    return m
-                if self.have_prefix_error:
-                    return None
-                self.have_prefix_error = True
-                self.total_receive_errors += 1
-                raise MAVError("invalid MAVLink prefix '%s'" % magic)
-            self.have_prefix_error = False
-            if self.buf_len() >= 3:
-                sbuf = self.buf[self.buf_index:3+self.buf_index]
-                if sys.version_info.major < 3:
-                    sbuf = str(sbuf)
-                (magic, self.expected_length, incompat_flags) = self.mav20_h3_unpacker.unpack(sbuf)
-                if magic == PROTOCOL_MARKER_V2 and (incompat_flags & MAVLINK_IFLAG_SIGNED):
-                        self.expected_length += MAVLINK_SIGNATURE_BLOCK_LEN
-                self.expected_length += header_len + 2
-            if self.expected_length >= (header_len+2) and self.buf_len() >= self.expected_length:
-                mbuf = array.array('B', self.buf[self.buf_index:self.buf_index+self.expected_length])
-                self.buf_index += self.expected_length
-                self.expected_length = header_len+2
-                if self.robust_parsing:
-                    try:
+                    raise MAVError("invalid MAVLink prefix '%s'" % magic)
+                self.have_prefix_error = False
+                if self.buf_len() >= 3:
+                    sbuf = self.buf[self.buf_index:3+self.buf_index]
+                    if sys.version_info.major < 3:
+                        sbuf = str(sbuf)
+                    (magic, self.expected_length, incompat_flags) = self.mav20_h3_unpacker.unpack(sbuf)
+                    if magic == PROTOCOL_MARKER_V2 and (incompat_flags & MAVLINK_IFLAG_SIGNED):
+                            self.expected_length += MAVLINK_SIGNATURE_BLOCK_LEN
+                    self.expected_length += header_len + 2
+                if self.expected_length >= (header_len+2) and self.buf_len() >= self.expected_length:
+                    mbuf = array.array('B', self.buf[self.buf_index:self.buf_index+self.expected_length])
+                    self.buf_index += self.expected_length
+                    self.expected_length = header_len+2
+                    if self.robust_parsing:
+                        try:
+                            if magic == PROTOCOL_MARKER_V2 and (incompat_flags & ~MAVLINK_IFLAG_SIGNED) != 0:
+                                raise MAVError('invalid incompat_flags 0x%x 0x%x %u' % (incompat_flags, magic, self.expected_length))
+                            m = self.decode(mbuf)
+                        except MAVError as reason:
+                            start = self.buf_index - len(mbuf)
+                            if self.crc_resync and not self.__frame_crc_ok(mbuf):
+                                # probably not a real frame. Look for one inside it
+                                self.buf_index = self.__next_marker(self.buf, start+1, len(self.buf))
+                                return self.__bad_data(start, self.buf_index, reason.message)
+                            m = MAVLink_bad_data(mbuf, reason.message, self.__stream_offset(start))
+                            self.total_receive_errors += 1
+                    else:
                         if magic == PROTOCOL_MARKER_V2 and (incompat_flags & ~MAVLINK_IFLAG_SIGNED) != 0:
                             raise MAVError('invalid incompat_flags 0x%x 0x%x %u' % (incompat_flags, magic, self.expected_length))
                         m = self.decode(mbuf)
-                    except MAVError as reason:
-                        m = MAVLink_bad_data(mbuf, reason.message)
-                        self.total_receive_errors += 1
-                else:
-                    if magic == PROTOCOL_MARKER_V2 and (incompat_flags & ~MAVLINK_IFLAG_SIGNED) != 0:
-                        raise MAVError('invalid incompat_flags 0x%x 0x%x %u' % (incompat_flags, magic, self.expected_length))
-                    m = self.decode(mbuf)
-                return m
-            return None
+                    if m is not None:
+                        return m
+                    # the frame was dropped by the message id filter, go on to the next one
+                    continue
+                return None
 
         def parse_buffer(self, s):
             '''input some data bytes, possibly returning a list of new messages'''
+            if self.native or sys.version_info.major < 3:
+                return self.__parse_buffer_legacy(s)
+            self.buf.extend(s)
+            self.total_bytes_received += len(s)
+            ret = self.__parse_frames(None)
+            if len(ret) == 0:
+                return None
+            return ret
+
+        def parse_tuples(self, s, named=False):
+            '''input some data bytes, returning a (possibly empty) list of
+            the messages in them as tuples from decode_tuple(). No message
+            objects are made, so callbacks are not called. Bad data is
+            dropped, though still counted in total_receive_errors. The
+            native parser, and python2, only make message objects, so with
+            them the messages are converted and callbacks are called'''
+            if self.native or sys.version_info.major < 3:
+                ret = self.__parse_buffer_legacy(s) or []
+                return [m.to_tuple(named) for m in ret if not isinstance(m, MAVLink_bad_data)]
+            self.buf.extend(s)
+            self.total_bytes_received += len(s)
+            return self.__parse_frames(named)
+
+        def __parse_buffer_legacy(self, s):
+            '''input some data bytes, possibly returning a list of new messages (one parse_char() call per message)'''
             m = self.parse_char(s)
             if m is None:
                 return None
@@ -627,10 +1218,215 @@ class MAVLink(object):
                 ret.append(m)
             return ret
 
+        def __parse_frames(self, tuples):
+            '''decode all complete frames in the buffer, working on a memoryview
+            of it so that frames are not copied until a message is created.
+            If tuples is not None they are decoded as tuples'''
+            ret = []
+            buf = self.buf
+            buf_len = len(buf)
+            i = self.buf_index
+            mv = memoryview(buf)
+            try:
+                while i < buf_len:
+                    magic = buf[i]
+                    if magic == PROTOCOL_MARKER_V2:
+                        header_len = HEADER_LEN_V2
+                    elif magic == PROTOCOL_MARKER_V1:
+                        header_len = HEADER_LEN_V1
+                    else:
+                        if self.robust_parsing:
+                            # skip the whole run of garbage up to the next marker
+                            start = i
+                            i = self.__next_marker(buf, i+1, buf_len)
+                            m = self.__bad_data(start, i, 'Bad prefix')
+                        else:
+                            i += 1
+                            if self.have_prefix_error:
+                                break
+                            self.have_prefix_error = True
+                            self.total_receive_errors += 1
+                            raise MAVError("invalid MAVLink prefix '%s'" % magic)
+                    if magic == PROTOCOL_MARKER_V1 or magic == PROTOCOL_MARKER_V2:
+                        self.have_prefix_error = False
+                        if buf_len - i < 3:
+                            self.expected_length = header_len + 2
+                            break
+                        incompat_flags = buf[i+2]
+                        frame_len = buf[i+1] + header_len + 2
+                        if magic == PROTOCOL_MARKER_V2 and (incompat_flags & MAVLINK_IFLAG_SIGNED):
+                            frame_len += MAVLINK_SIGNATURE_BLOCK_LEN
+                        if buf_len - i < frame_len:
+                            self.expected_length = frame_len
+                            break
+                        frame = mv[i:i+frame_len]
+                        start = i
+                        i += frame_len
+                        self.expected_length = header_len + 2
+                        try:
+                            if magic == PROTOCOL_MARKER_V2 and (incompat_flags & ~MAVLINK_IFLAG_SIGNED) != 0:
+                                raise MAVError('invalid incompat_flags 0x%x 0x%x %u' % (incompat_flags, magic, frame_len))
+                            m = self.__decode(frame, tuples)
+                        except MAVError as reason:
+                            if not self.robust_parsing:
+                                raise
+                            if self.crc_resync and not self.__frame_crc_ok(frame):
+                                # probably not a real frame. Look for one inside it
+                                i = self.__next_marker(buf, start+1, buf_len)
+                                m = self.__bad_data(start, i, reason.message)
+                            else:
+                                m = MAVLink_bad_data(bytearray(frame), reason.message, self.__stream_offset(start))
+                                self.total_receive_errors += 1
+                        finally:
+                            frame.release()
+                        if m is None:
+                            # dropped by the message id filter
+                            continue
+                    if tuples is not None and isinstance(m, MAVLink_bad_data):
+                        # the bytes have been counted in total_receive_errors
+                        continue
+                    self.total_packets_received += 1
+                    if tuples is None:
+                        self.__callbacks(m)
+                    ret.append(m)
+            finally:
+                mv.release()
+                # compact the buffer, dropping the frames we have consumed
+                if i >= buf_len:
+                    self.buf = bytearray()
+                else:
+                    del buf[:i]
+                self.buf_index = 0
+            return ret
+
+        def __next_marker(self, buf, start, end):
+            '''return the index of the first byte in buf[start:end] that
+            could start a frame, or end if there is none'''
+            i = buf.find(b'\\xfe', start, end)
+            if i == -1:
+                i = end
+            j = buf.find(b'\\xfd', start, i)
+            if j == -1:
+                return i
+            return j
+
+        def __stream_offset(self, i):
+            '''position in the received stream of self.buf[i]'''
+            return self.total_bytes_received - (len(self.buf) - i)
+
+        def __bad_data(self, start, end, reason):
+            '''make a single BAD_DATA message for self.buf[start:end]. Each
+            byte counts as a receive error'''
+            self.total_receive_errors += end - start
+            return MAVLink_bad_data(self.buf[start:end], reason, self.__stream_offset(start))
+
+        def __frame_crc_ok(self, msgbuf):
+            '''check the CRC of a complete frame. Frames of unknown message
+            types can't be checked, so count as bad'''
+            signature_len = 0
+            if msgbuf[0] == PROTOCOL_MARKER_V2:
+                msgId = msgbuf[7] | (msgbuf[8]<<8) | (msgbuf[9]<<16)
+                if msgbuf[2] & MAVLINK_IFLAG_SIGNED:
+                    signature_len = MAVLINK_SIGNATURE_BLOCK_LEN
+            else:
+                msgId = msgbuf[5]
+            if not msgId in mavlink_map:
+                return False
+            end = len(msgbuf) - (2 + signature_len)
+            crc = x25crc(msgbuf[1:end])
+            if ${crc_extra}: # using CRC extra
+                crc.accumulate((mavlink_map[msgId].crc_extra,))
+            return crc.crc == msgbuf[end] | (msgbuf[end+1]<<8)
+
+        def check_frames(self, msgbufs):
+            '''check the CRCs of a list of complete frames in one pass,
+            returning a list of booleans. Signatures are not checked'''
+            buf = bytearray()
+            frames = []
+            valid = [False] * len(msgbufs)
+            for i in range(len(msgbufs)):
+                start = len(buf)
+                buf += msgbufs[i]
+                if len(buf) - start < HEADER_LEN_V1 + 2:
+                    continue
+                if buf[start] == PROTOCOL_MARKER_V2:
+                    if len(buf) - start < HEADER_LEN_V2 + 2:
+                        continue
+                    end = start + HEADER_LEN_V2 + buf[start+1]
+                    msgId = buf[start+7] | (buf[start+8]<<8) | (buf[start+9]<<16)
+                else:
+                    end = start + HEADER_LEN_V1 + buf[start+1]
+                    msgId = buf[start+5]
+                if end + 2 > len(buf) or not msgId in mavlink_map:
+                    continue
+                crc_extra = None
+                if ${crc_extra}: # using CRC extra
+                    crc_extra = mavlink_map[msgId].crc_extra
+                frames.append((i, (start+1, end, crc_extra)))
+            results = x25crc_frames(buf, [f[1] for f in frames])
+            for (f, ok) in zip(frames, results):
+                valid[f[0]] = ok
+            return valid
+
+        def decode_array(self, msgbufs, check_crc=True):
+            '''decode a list of complete frames of one message type into a
+            numpy record array with one row per frame, using the dtype from
+            the message class get_dtype(). Frames that fail the CRC check are
+            left out unless check_crc is False. Signatures are not checked.
+            Returns None if there are no frames'''
+            import numpy
+            if check_crc:
+                valid = self.check_frames(msgbufs)
+                msgbufs = [m for (m, ok) in zip(msgbufs, valid) if ok]
+            if len(msgbufs) == 0:
+                return None
+            type = None
+            for i in range(len(msgbufs)):
+                msgbuf = msgbufs[i]
+                header = bytearray(msgbuf[:HEADER_LEN_V2])
+                if header[0] == PROTOCOL_MARKER_V2:
+                    headerlen = HEADER_LEN_V2
+                    msgId = header[7] | (header[8]<<8) | (header[9]<<16)
+                else:
+                    headerlen = HEADER_LEN_V1
+                    msgId = header[5]
+                if type is None:
+                    if not msgId in mavlink_map:
+                        raise MAVError('unknown MAVLink message ID %s' % str(msgId))
+                    type = mavlink_map[msgId]
+                    csize = type.unpacker.size
+                    # payloads are zero padded to the full size, as MAVLink2 trims trailing zeros
+                    out = bytearray(csize * len(msgbufs))
+                elif msgId != type.id:
+                    raise MAVError('decode_array needs frames of one type, got msgId %u and %u' % (type.id, msgId))
+                plen = min(header[1], csize)
+                out[i*csize:i*csize+plen] = msgbuf[headerlen:headerlen+plen]
+            return numpy.frombuffer(out, dtype=type.get_dtype()).view(numpy.recarray)
+
         def check_signature(self, msgbuf, srcSystem, srcComponent):
             '''check signature on incoming message'''
+            return self.__check_signature(msgbuf, srcSystem, srcComponent, self.signing.keyed_hash())
+
+        def check_signatures(self, msgbufs):
+            '''check the signatures of a list of complete signed MAVLink2
+            frames, in order, as check_signature() would for each. The
+            keyed hash state is only looked up once. Returns a list of
+            booleans, one per frame'''
+            keyed = self.signing.keyed_hash()
+            ret = []
+            for msgbuf in msgbufs:
+                if len(msgbuf) < HEADER_LEN_V2 + 2 + MAVLINK_SIGNATURE_BLOCK_LEN or \
+                   msgbuf[0] != PROTOCOL_MARKER_V2 or not (msgbuf[2] & MAVLINK_IFLAG_SIGNED):
+                    ret.append(False)
+                    continue
+                ret.append(self.__check_signature(msgbuf, msgbuf[5], msgbuf[6], keyed))
+            return ret
+
+        def __check_signature(self, msgbuf, srcSystem, srcComponent, keyed):
+            '''check the signature of a frame, keyed is a hash that has been
+            fed the secret key and may be copied'''
             if isinstance(msgbuf, array.array):
-                msgbuf = msgbuf.tostring()
+                msgbuf = bytearray(msgbuf)
             timestamp_buf = msgbuf[-12:-6]
             link_id = msgbuf[-13]
             (tlow, thigh) = self.mav_sign_unpacker.unpack(timestamp_buf)
@@ -649,25 +1445,72 @@ class MAVLink(object):
                 if timestamp + 6000*1000 < self.signing.timestamp:
                     # print('bad new stream ', timestamp/(100.0*1000*60*60*24*365), self.signing.timestamp/(100.0*1000*60*60*24*365))
                     return False
-                self.signing.stream_timestamps[stream_key] = timestamp
-                # print('new stream')
 
-            h = hashlib.new('sha256')
-            h.update(self.signing.secret_key)
+            h = keyed.copy()
             h.update(msgbuf[:-6])
-            sig1 = str(h.digest())[:6]
-            sig2 = str(msgbuf)[-6:]
-            if sig1 != sig2:
+            if h.digest()[:6] != bytes(msgbuf[-6:]):
                 # print('sig mismatch')
                 return False
 
+            # only streams with a good signature are remembered, so
+            # garbage can't fill the table
+            self.signing.add_stream(stream_key, timestamp)
+
             # the timestamp we next send with is the max of the received timestamp and
             # our current timestamp
             self.signing.timestamp = max(self.signing.timestamp, timestamp)
             return True
 
+        def __check_signing(self, msgbuf, msgId, srcSystem, srcComponent, signature_len):
+                '''check the signature of a frame if signing is set up,
+                returning True if it was good. Raises MAVError if the frame
+                is not accepted'''
+                sig_ok = False
+                if signature_len == MAVLINK_SIGNATURE_BLOCK_LEN:
+                    self.signing.sig_count += 1
+                if self.signing.secret_key is not None:
+                    accept_signature = False
+                    if signature_len == MAVLINK_SIGNATURE_BLOCK_LEN:
+                        sig_ok = self.check_signature(msgbuf, srcSystem, srcComponent)
+                        accept_signature = sig_ok
+                        if sig_ok:
+                            self.signing.goodsig_count += 1
+                        else:
+                            self.signing.badsig_count += 1
+                        if not accept_signature and self.signing.allow_unsigned_callback is not None:
+                            accept_signature = self.signing.allow_unsigned_callback(self, msgId)
+                            if accept_signature:
+                                self.signing.unsigned_count += 1
+                            else:
+                                self.signing.reject_count += 1
+                    elif self.signing.allow_unsigned_callback is not None:
+                        accept_signature = self.signing.allow_unsigned_callback(self, msgId)
+                        if accept_signature:
+                            self.signing.unsigned_count += 1
+                        else:
+                            self.signing.reject_count += 1
+                    if not accept_signature:
+                        raise MAVError('Invalid signature')
+                return sig_ok
+
         def decode(self, msgbuf):
-                '''decode a buffer as a MAVLink message'''
+                '''decode a buffer as a MAVLink message. Returns None if the
+                message id filter drops the message'''
+                return self.__decode(msgbuf, None)
+
+        def decode_tuple(self, msgbuf, named=False):
+                '''decode a buffer as a tuple of the message id, source
+                system, source component and sequence number followed by
+                the fields, a namedtuple from the message class
+                get_tuple_type() if named is True. This makes the same
+                checks as decode() but no message object, so is quicker
+                for consumers that only want the values. Returns None if
+                the message id filter drops the message'''
+                return self.__decode(msgbuf, named)
+
+        def __decode(self, msgbuf, tuples):
+                '''decode a frame as a message, or as a tuple if tuples is
+                not None, named if it is True'''
                 # decode the header
                 if msgbuf[0] != PROTOCOL_MARKER_V1:
                     headerlen = 10
@@ -702,8 +1545,6 @@ class MAVLink(object):
                 # decode the payload
                 type = mavlink_map[mapkey]
                 fmt = type.format
-                order_map = type.orders
-                len_map = type.lengths
                 crc_extra = type.crc_extra
 
                 # decode the checksum
@@ -711,100 +1552,65 @@ class MAVLink(object):
                     crc, = self.mav_csum_unpacker.unpack(msgbuf[-(2+signature_len):][:2])
                 except struct.error as emsg:
                     raise MAVError('Unable to unpack MAVLink CRC: %s' % emsg)
-                crcbuf = msgbuf[1:-(2+signature_len)]
+                crc2 = x25crc(msgbuf[1:-(2+signature_len)])
                 if ${crc_extra}: # using CRC extra
-                    crcbuf.append(crc_extra)
-                crc2 = x25crc(crcbuf)
+                    crc2.accumulate((crc_extra,))
                 if crc != crc2.crc:
                     raise MAVError('invalid MAVLink CRC in msgID %u 0x%04x should be 0x%04x' % (msgId, crc, crc2.crc))
 
-                sig_ok = False
-                if signature_len == MAVLINK_SIGNATURE_BLOCK_LEN:
-                    self.signing.sig_count += 1
-                if self.signing.secret_key is not None:
-                    accept_signature = False
-                    if signature_len == MAVLINK_SIGNATURE_BLOCK_LEN:
-                        sig_ok = self.check_signature(msgbuf, srcSystem, srcComponent)
-                        accept_signature = sig_ok
-                        if sig_ok:
-                            self.signing.goodsig_count += 1
-                        else:
-                            self.signing.badsig_count += 1
-                        if not accept_signature and self.signing.allow_unsigned_callback is not None:
-                            accept_signature = self.signing.allow_unsigned_callback(self, msgId)
-                            if accept_signature:
-                                self.signing.unsigned_count += 1
-                            else:
-                                self.signing.reject_count += 1
-                    elif self.signing.allow_unsigned_callback is not None:
-                        accept_signature = self.signing.allow_unsigned_callback(self, msgId)
-                        if accept_signature:
-                            self.signing.unsigned_count += 1
-                        else:
-                            self.signing.reject_count += 1
-                    if not accept_signature:
-                        raise MAVError('Invalid signature')
+                if self.msgid_filter is not None and not msgId in self.msgid_filter:
+                    self.total_packets_filtered += 1
+                    if self.filter_callback:
+                        self.filter_callback(msgId, seq, srcSystem, srcComponent,
+                                             *self.filter_callback_args, **self.filter_callback_kwargs)
+                    return None
+
+                sig_ok = self.__check_signing(msgbuf, msgId, srcSystem, srcComponent, signature_len)
 
-                csize = type.unpacker.size
                 mbuf = msgbuf[headerlen:-(2+signature_len)]
-                if len(mbuf) < csize:
-                    # zero pad to give right size
-                    mbuf.extend([0]*(csize - len(mbuf)))
-                if len(mbuf) < csize:
-                    raise MAVError('Bad message of type %s length %u needs %s' % (
-                        type, len(mbuf), csize))
-                mbuf = mbuf[:csize]
-                try:
-                    t = type.unpacker.unpack(mbuf)
-                except struct.error as emsg:
-                    raise MAVError('Unable to unpack MAVLink payload type=%s fmt=%s payloadLength=%u: %s' % (
-                        type, fmt, len(mbuf), emsg))
-
-                tlist = list(t)
-                # handle sorted fields
-                if ${sort_fields}:
-                    t = tlist[:]
-                    if sum(len_map) == len(len_map):
-                        # message has no arrays in it
-                        for i in range(0, len(tlist)):
-                            tlist[i] = t[order_map[i]]
-                    else:
-                        # message has some arrays
-                        tlist = []
-                        for i in range(0, len(order_map)):
-                            order = order_map[i]
-                            L = len_map[order]
-                            tip = sum(len_map[:order])
-                            field = t[tip]
-                            if L == 1 or isinstance(field, str):
-                                tlist.append(field)
-                            else:
-                                tlist.append(t[tip:(tip + L)])
-
-                # terminate any strings
-                for i in range(0, len(tlist)):
-                    if type.fieldtypes[i] == 'char':
-                        if sys.version_info.major >= 3:
-                            tlist[i] = tlist[i].decode('utf-8')
-                        tlist[i] = str(MAVString(tlist[i]))
-                t = tuple(tlist)
-                # construct the message object
-                try:
-                    m = type(*t)
-                except Exception as emsg:
-                    raise MAVError('Unable to instantiate MAVLink message of type %s : %s' % (type, emsg))
+                if tuples is not None:
+                    try:
+                        t = type._decode_tuple(mbuf, msgId, srcSystem, srcComponent, seq)
+                    except struct.error as emsg:
+                        raise MAVError('Unable to unpack MAVLink payload type=%s fmt=%s payloadLength=%u: %s' % (
+                            type, fmt, len(mbuf), emsg))
+                    if tuples:
+                        return type.get_tuple_type()._make(t)
+                    return t
+                if self.lazy_decode and mapkey in lazy_decode_ids:
+                    # keep the payload, decoding fields on first access
+                    csize = type.unpacker.size
+                    if len(mbuf) < csize:
+                        # zero pad to give right size
+                        mbuf = bytes(mbuf).ljust(csize, b'\\0')
+                    m = type.__new__(type)
+                    m._fieldnames = type.fieldnames
+                    m._type = type.name
+                    m._link_id = None
+                    m._lazy_payload = bytes(mbuf[:csize])
+                    m._lazy_header = (msgId, incompat_flags, compat_flags, mlen, seq, srcSystem, srcComponent)
+                else:
+                    # each message class has its own decoder, generated by mavgen
+                    header = MAVLink_header(msgId, incompat_flags, compat_flags, mlen, seq, srcSystem, srcComponent)
+                    try:
+                        m = type._decode(mbuf, header)
+                    except struct.error as emsg:
+                        raise MAVError('Unable to unpack MAVLink payload type=%s fmt=%s payloadLength=%u: %s' % (
+                            type, fmt, len(mbuf), emsg))
                 m._signed = sig_ok
                 if m._signed:
                     m._link_id = msgbuf[-13]
+                if isinstance(msgbuf, memoryview):
+                    # frames from parse_buffer() are views of the receive buffer
+                    msgbuf = bytearray(msgbuf)
                 m._msgbuf = msgbuf
                 m._payload = msgbuf[6:-(2+signature_len)]
                 m._crc = crc
-                m._header = MAVLink_header(msgId, incompat_flags, compat_flags, mlen, seq, srcSystem, srcComponent)
                 return m
 """, xml)
 
 
-def generate_methods(outf, msgs):
+def generate_methods(outf, msgs, lazy=False):
     print("Generating methods")
 
     def field_descriptions(fields):
@@ -837,7 +1643,12 @@ def generate_methods(outf, msgs):
                 selffieldnames += '%s, ' % f.name
         selffieldnames = selffieldnames[:-2]
 
+        if lazy:
+            classname = 'mavlink_map[MAVLINK_MSG_ID_%s]' % m.name.upper()
+        else:
+            classname = 'MAVLink_%s_message' % m.name.lower()
         sub = {'NAMELOWER': m.name.lower(),
+               'CLASSNAME': classname,
                'SELFFIELDNAMES': selffieldnames,
                'COMMENT': comment,
                'FIELDNAMES': ", ".join(m.fieldnames)}
@@ -847,7 +1658,7 @@ def generate_methods(outf, msgs):
                 '''
                 ${COMMENT}
                 '''
-                return MAVLink_${NAMELOWER}_message(${FIELDNAMES})
+                return ${CLASSNAME}(${FIELDNAMES})
 
 """, sub)
 
@@ -861,8 +1672,13 @@ def generate_methods(outf, msgs):
 """, sub)
 
 
-def generate(basename, xml):
-    '''generate complete python implementation'''
+def generate(basename, xml, slots=False, lazy=False):
+    '''generate complete python implementation. If slots is True the
+    message classes are generated with __slots__, which makes
+    messages smaller but means arbitrary attributes can't be added
+    to them. If lazy is True the message classes and the enums table
+    are only defined when first used, which needs python 3.7 or later
+    for the module __getattr__'''
     if basename.endswith('.py'):
         filename = basename
     else:
@@ -883,8 +1699,10 @@ def generate(basename, xml):
         else:
             m.fmtstr = '>'
         m.native_fmtstr = m.fmtstr
+        m.dtype_fields = []
         for f in m.ordered_fields:
             m.fmtstr += mavfmt(f)
+            m.dtype_fields.append(numpy_dtype_field(f, m.fmtstr[0]))
             m.fielddefaults.append(mavdefault(f))
             m.native_fmtstr += native_mavfmt(f)
         m.order_map = [0] * len(m.fieldnames)
@@ -899,11 +1717,11 @@ def generate(basename, xml):
 
     print("Generating %s" % filename)
     outf = open(filename, "w")
-    generate_preamble(outf, msgs, basename, filelist, xml[0])
-    generate_enums(outf, enums)
+    generate_preamble(outf, msgs, basename, filelist, xml[0], slots=slots)
+    generate_enums(outf, enums, lazy=lazy)
     generate_message_ids(outf, msgs)
-    generate_classes(outf, msgs)
-    generate_mavlink_class(outf, msgs, xml[0])
-    generate_methods(outf, msgs)
+    generate_classes(outf, msgs, slots=slots, lazy=lazy)
+    generate_mavlink_class(outf, msgs, xml[0], lazy=lazy)
+    generate_methods(outf, msgs, lazy=lazy)
     outf.close()
     print("Generated %s OK" % filename)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+'''
+asyncio MAVLink connections
+
+These keep the message parsing and state tracking of mavutil.mavfile,
+but are driven by an asyncio event loop instead of polling, so one
+thread can serve many links. Requires python 3.5 or later.
+
+    conn = await mavasync.mavlink_connection('udpin:0.0.0.0:14550')
+    await conn.wait_heartbeat()
+    conn.mav.request_data_stream_send(conn.target_system, conn.target_component, 0, 4, 1)
+    async for msg in conn:
+        print(msg)
+
+Released under GNU GPL version 3 or later
+'''
+
+import asyncio
+import collections
+import socket
+import struct
+import time
+
+from pymavlink import mavutil
+
+
+class mavasync(mavutil.mavfile):
+    '''a MAVLink connection driven by an asyncio transport. Received
+    messages go through post_message() and message hooks as they
+    arrive, then queue for recv_msg(), recv_match() and async
+    iteration. Sends through self.mav don't block. Up to max_queue
+    messages are queued, after which the oldest are dropped and
+    counted in queue_dropped'''
+    def __init__(self, address, source_system=255, source_component=0, input=True,
+                 use_native=mavutil.default_native, max_queue=1000):
+        mavutil.mavfile.__init__(self, None, address, source_system=source_system,
+                                 source_component=source_component, input=input, use_native=use_native)
+        self.transport = None
+        self.peer = None
+        self.server = None
+        self.receivers = []
+        self.listening = False
+        self.queue = collections.deque()
+        self.max_queue = max_queue
+        self.queue_dropped = 0
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def data_received(self, data):
+        '''parse data from the transport and queue the messages in it'''
+        if self.first_byte:
+            self.auto_mavlink_version(data)
+        if self.logfile_raw:
+            self.logfile_raw.write(data)
+        msgs = self.mav.parse_buffer(data)
+        if msgs is None:
+            return
+        for msg in msgs:
+            if self.logfile and msg.get_type() != 'BAD_DATA':
+                usec = int(time.time() * 1.0e6) & ~3
+                self.logfile.write(struct.pack('>Q', usec) + msg.get_msgbuf())
+            self.post_message(msg)
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.queue_dropped += 1
+            self.queue.append(msg)
+        self._ready.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.portdead = False
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.portdead = True
+
+    def write(self, buf):
+        '''queue data for sending, dropping it if there is no transport yet'''
+        if self.transport is None or self.transport.is_closing():
+            return
+        if hasattr(self.transport, 'sendto'):
+            if self.peer is not None:
+                self.transport.sendto(buf, self.peer)
+            elif self.transport.get_extra_info('peername') is not None:
+                self.transport.sendto(buf)
+            return
+        self.transport.write(buf)
+
+    def close(self):
+        self._closed = True
+        if self.server is not None:
+            self.server.close()
+        for t in self.receivers + [self.transport]:
+            if t is not None:
+                t.close()
+        self._ready.set()
+
+    def recv(self, n=None):
+        raise RuntimeError('use await recv_msg() on an asyncio connection')
+
+    async def recv_msg(self):
+        '''wait for the next received message, returning None once the
+        connection is closed and no messages are left'''
+        while len(self.queue) == 0:
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self.queue.popleft()
+
+    async def recv_match(self, condition=None, type=None, blocking=True, timeout=None):
+        '''wait for the next message that matches the given condition. type
+        can be a string or a list of strings. Returns None on timeout, or if
+        the connection is closed. blocking is accepted for compatibility
+        with mavfile.recv_match(); without it only queued messages are
+        looked at'''
+        if type is not None and not isinstance(type, list) and not isinstance(type, set):
+            type = [type]
+        if condition is not None:
+            condition = mavutil.compile_expression(condition)
+        loop = asyncio.get_event_loop()
+        if timeout is not None:
+            deadline = loop.time() + timeout
+        while True:
+            if not blocking and len(self.queue) == 0:
+                return None
+            if timeout is None:
+                m = await self.recv_msg()
+            else:
+                try:
+                    m = await asyncio.wait_for(self.recv_msg(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return None
+            if m is None:
+                return None
+            if type is not None and not m.get_type() in type:
+                continue
+            if not mavutil.evaluate_condition(condition, self.messages):
+                continue
+            return m
+
+    async def wait_heartbeat(self, blocking=True, timeout=None):
+        '''wait for a heartbeat so we know the target system IDs'''
+        return await self.recv_match(type='HEARTBEAT', blocking=blocking, timeout=timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        m = await self.recv_msg()
+        if m is None:
+            raise StopAsyncIteration
+        return m
+
+
+class _StreamProtocol(asyncio.Protocol):
+    '''feeds a stream transport to a connection'''
+    def __init__(self, conn):
+        self.conn = conn
+        self.transport = None
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # a listening connection talks to its latest client
+        self.transport = transport
+        self.conn.connection_made(transport)
+
+    def data_received(self, data):
+        self.conn.data_received(data)
+
+    def connection_lost(self, exc):
+        if self.conn.transport is not self.transport:
+            return
+        self.conn.connection_lost(exc)
+        if not self.conn.listening:
+            self.conn.close()
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    '''feeds a datagram transport to a connection. A listening connection
+    replies to the last address it heard from, and a broadcast one locks
+    on to the first address it hears from'''
+    def __init__(self, conn, listen=False, broadcast=False, myport=None):
+        self.conn = conn
+        self.listen = listen
+        self.broadcast = broadcast
+        self.myport = myport
+
+    def connection_made(self, transport):
+        if self.myport is not None:
+            # only receives, sends go through another socket
+            self.conn.receivers.append(transport)
+        else:
+            self.conn.connection_made(transport)
+
+    def datagram_received(self, data, addr):
+        if self.myport is not None and addr[1] == self.myport:
+            # data from ourselves, discard
+            return
+        if self.listen or self.broadcast:
+            self.conn.peer = addr
+            self.broadcast = False
+        self.conn.data_received(data)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        if self.myport is None:
+            self.conn.connection_lost(exc)
+
+
+def _host_port(device, kind):
+    a = device.split(':')
+    if len(a) != 2:
+        raise ValueError("%s ports must be specified as host:port" % kind)
+    return (a[0], int(a[1]))
+
+async def mavlink_connection(device, baud=115200, source_system=255, source_component=0,
+                             dialect=None, use_native=mavutil.default_native, max_queue=1000):
+    '''open an asyncio MAVLink connection. device takes the same tcp:,
+    tcpin:, udpin:, udpout:, udpbcast:, udp: and mcast: forms as
+    mavutil.mavlink_connection(), or a serial device name'''
+    if dialect is not None:
+        mavutil.set_dialect(dialect)
+    loop = asyncio.get_event_loop()
+
+    def make(input=True):
+        return mavasync(device, source_system=source_system, source_component=source_component,
+                        input=input, use_native=use_native, max_queue=max_queue)
+
+    if device.startswith('tcp:'):
+        conn = make()
+        await loop.create_connection(lambda: _StreamProtocol(conn), *_host_port(device[4:], 'TCP'))
+        return conn
+    if device.startswith('tcpin:'):
+        conn = make()
+        conn.listening = True
+        (host, port) = _host_port(device[6:], 'TCP')
+        conn.server = await loop.create_server(lambda: _StreamProtocol(conn), host, port,
+                                               reuse_address=True)
+        return conn
+    if device.startswith('udpout:') or device.startswith('udpbcast:'):
+        broadcast = device.startswith('udpbcast:')
+        conn = make(input=False)
+        addr = _host_port(device.split(':', 1)[1], 'UDP')
+        if broadcast:
+            # send to the broadcast address until something replies, then
+            # lock on to its address
+            conn.peer = addr
+            await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conn, broadcast=True),
+                                                local_addr=('0.0.0.0', 0), allow_broadcast=True)
+        else:
+            await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conn), remote_addr=addr)
+        return conn
+    if device.startswith('udpin:') or device.startswith('udp:'):
+        conn = make()
+        addr = _host_port(device.split(':', 1)[1], 'UDP')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(addr)
+        await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conn, listen=True), sock=sock)
+        return conn
+    if device.startswith('mcast:'):
+        a = device[6:].split(':')
+        mcast_ip = "239.255.145.50"
+        mcast_port = 14550
+        if len(a) == 1 and len(a[0]) > 0:
+            mcast_port = int(a[0])
+        elif len(a) > 1:
+            mcast_ip = a[0]
+            mcast_port = int(a[1])
+        conn = make(input=False)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((mcast_ip, mcast_port))
+        mreq = struct.pack("4sl", socket.inet_aton(mcast_ip), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        # a separate sending socket, so its port can be used to spot our own packets
+        (out, protocol) = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conn),
+                                                              remote_addr=(mcast_ip, mcast_port))
+        myport = out.get_extra_info('sockname')[1]
+        await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conn, myport=myport), sock=sock)
+        return conn
+    return await _serial_connection(make(), device, baud)
+
+async def _serial_connection(conn, device, baud):
+    '''drive a serial port from the event loop with add_reader(). This
+    needs a selector event loop, so isn't available on Windows'''
+    import serial
+    port = serial.Serial(device, baudrate=baud, timeout=0, dsrdtr=False, rtscts=False, xonxoff=False)
+    loop = asyncio.get_event_loop()
+
+    class SerialTransport(asyncio.Transport):
+        '''just enough of a transport for mavasync.write() and close()'''
+        def __init__(self):
+            asyncio.Transport.__init__(self)
+            self.closing = False
+
+        def write(self, buf):
+            port.write(buf)
+
+        def is_closing(self):
+            return self.closing
+
+        def close(self):
+            if not self.closing:
+                self.closing = True
+                loop.remove_reader(port.fileno())
+                port.close()
+                conn.connection_lost(None)
+
+    def readable():
+        try:
+            data = port.read(max(port.in_waiting, 1))
+        except serial.SerialException:
+            conn.close()
+            return
+        if data:
+            conn.data_received(data)
+
+    conn.connection_made(SerialTransport())
+    loop.add_reader(port.fileno(), readable)
+    return conn
@@ -6,7 +6,9 @@ Copyright Andrew Tridgell 2011
 Released under GNU GPL version 3 or later
 '''
 
+import ast
 import os
+import sys
 
 # these imports allow for mavgraph and mavlogdump to use maths expressions more easily
 from math import *
@@ -23,12 +25,337 @@ if home is not None:
         mavuser = imp.load_source('pymavlink.mavuser', extra)
         from pymavlink.mavuser import *
 
+try:
+    import __builtin__ as _builtins_module
+except ImportError:
+    import builtins as _builtins_module
+_builtins = set(dir(_builtins_module))
+
+# numpy equivalents of maths functions, with their number of arguments,
+# used when evaluating over whole columns
+_vector_functions = {
+    'abs': ('absolute', 1), 'acos': ('arccos', 1), 'asin': ('arcsin', 1),
+    'atan': ('arctan', 1), 'atan2': ('arctan2', 2), 'ceil': ('ceil', 1),
+    'cos': ('cos', 1), 'cosh': ('cosh', 1), 'degrees': ('degrees', 1),
+    'exp': ('exp', 1), 'fabs': ('fabs', 1), 'floor': ('floor', 1),
+    'hypot': ('hypot', 2), 'log': ('log', 1), 'log10': ('log10', 1),
+    'pow': ('power', 2), 'radians': ('radians', 1), 'sin': ('sin', 1),
+    'sinh': ('sinh', 1), 'sqrt': ('sqrt', 1), 'tan': ('tan', 1),
+    'tanh': ('tanh', 1)}
+
+# mavextra functions that are plain arithmetic, so work on arrays as they are
+_vector_extra = set(['kmh'])
+_vector_globals = None
+
+# maximum number of compiled expressions kept by compile_expression()
+_cache_size = 1000
+_cache = {}
+
+def _constant(node):
+    '''return (True, value) if an AST node is a numeric constant'''
+    # older pythons parse numbers as Num, newer ones as Constant
+    name = node.__class__.__name__
+    if name == 'Constant':
+        value = node.value
+    elif name == 'Num':
+        value = node.n
+    else:
+        return (False, None)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return (False, None)
+    return (True, value)
+
+def _make_constant(value, node):
+    '''make a constant AST node to replace node'''
+    if hasattr(ast, 'Constant'):
+        ret = ast.Constant(value=value)
+    else:
+        ret = ast.Num(n=value)
+    return ast.copy_location(ret, node)
+
+class _ConstantFolder(ast.NodeTransformer):
+    '''fold arithmetic on numeric literals. Names, including maths
+    constants such as pi and functions, are left alone, as the variables
+    an expression is evaluated with can replace them'''
+
+    def fold(self, node):
+        '''evaluate a constant sub-expression, returning node unchanged if
+        it can't be folded'''
+        try:
+            v = eval(compile(ast.fix_missing_locations(ast.Expression(body=node)),
+                             '<fold>', 'eval'), {}, {})
+        except (ArithmeticError, ValueError, TypeError):
+            return node
+        if not isinstance(v, (int, float)) or isinstance(v, bool):
+            return node
+        return _make_constant(v, node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        (lconst, lvalue) = _constant(node.left)
+        (rconst, rvalue) = _constant(node.right)
+        if not lconst or not rconst:
+            return node
+        if isinstance(node.op, ast.Pow) and abs(rvalue) > 64:
+            # don't build huge integers at compile time
+            return node
+        return self.fold(node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if _constant(node.operand)[0]:
+            return self.fold(node)
+        return node
+
+class MAVExpression(object):
+    '''an expression compiled once for repeated evaluation. The names it
+    uses that are not maths or mavextra functions are in message_types,
+    and the message fields it reads as (type, field) tuples in fields'''
+    def __init__(self, expression):
+        self.expression = expression
+        tree = ast.parse(expression.strip(), mode='eval')
+        bound = set()
+        names = set()
+        self.fields = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Load):
+                    names.add(node.id)
+                else:
+                    bound.add(node.id)
+            elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+                self.fields.add((node.value.id, node.attr))
+            elif hasattr(ast, 'arg') and isinstance(node, ast.arg):
+                bound.add(node.arg)
+        self.message_types = set()
+        for name in names - bound:
+            if name in globals() or name in _builtins:
+                continue
+            self.message_types.add(name)
+        self.fields = set([f for f in self.fields if f[0] in self.message_types])
+        self.tree = ast.fix_missing_locations(_ConstantFolder().visit(tree))
+        self.code = compile(self.tree, '<expression>', 'eval')
+        self._vectorisable = None
+
+    def evaluate(self, vars):
+        '''evaluate the expression, returning None if a variable is missing
+        or there is a division by zero'''
+        try:
+            v = eval(self.code, globals(), vars)
+        except NameError:
+            return None
+        except ZeroDivisionError:
+            return None
+        return v
+
+    def vectorisable(self):
+        '''return True if the expression can be evaluated over whole numpy
+        columns at once. Calls to functions without a numpy equivalent,
+        which may keep state between calls, and logic operators that
+        need a single truth value are not'''
+        if self._vectorisable is not None:
+            return self._vectorisable
+        self._vectorisable = True
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.Not, ast.Invert)):
+                self._vectorisable = False
+                break
+            if isinstance(node, (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop)):
+                continue
+            name = node.__class__.__name__
+            if name in ['Expression', 'BinOp', 'UnaryOp', 'Name', 'Constant', 'Num']:
+                continue
+            if name == 'Compare' and len(node.ops) == 1:
+                continue
+            if name == 'Attribute' and isinstance(node.value, ast.Name) and \
+               node.value.id in self.message_types:
+                continue
+            if name == 'Call' and isinstance(node.func, ast.Name) and \
+               not getattr(node, 'keywords', None) and not getattr(node, 'starargs', None) and \
+               not getattr(node, 'kwargs', None):
+                func = node.func.id
+                if func in _vector_extra:
+                    continue
+                if func in _vector_functions and _vector_functions[func][1] == len(node.args):
+                    continue
+            self._vectorisable = False
+            break
+        return self._vectorisable
+
+    def evaluate_columns(self, columns):
+        '''evaluate the expression over whole logs of messages. columns maps
+        each message type the expression uses to a dictionary of numpy
+        arrays, one per field plus '_timestamp', as given by to_arrays() on
+        a log. Once all of its message types have arrived, the expression
+        is evaluated each time one of them arrives, with the latest message
+        of each type held as in mlog.messages. Messages with the same
+        timestamp arrive in log order within a type, and in order of type
+        name across types. Expressions that
+        aren't vectorisable(), or that divide by zero somewhere, are
+        evaluated one row at a time. Returns a (timestamps, values) tuple
+        of arrays, leaving out the times evaluate() would give None.
+        NaN and infinite values are kept'''
+        import numpy
+        empty = (numpy.zeros(0), numpy.zeros(0))
+        types = sorted(self.message_types)
+        if len(types) == 0:
+            return empty
+        stamps = {}
+        order = {}
+        for t in types:
+            if not t in columns or len(columns[t]['_timestamp']) == 0:
+                return empty
+            order[t] = numpy.argsort(columns[t]['_timestamp'], kind='mergesort')
+            stamps[t] = columns[t]['_timestamp'][order[t]]
+
+        # each arriving message is a row, holding the latest row of each
+        # type. The sort is stable, so rows with equal timestamps keep their
+        # order, and each type's rows stay in order
+        timeline = numpy.concatenate([stamps[t] for t in types])
+        arrival = numpy.argsort(timeline, kind='mergesort')
+        timeline = timeline[arrival]
+        kinds = numpy.concatenate([numpy.full(len(stamps[types[k]]), k) for k in range(len(types))])[arrival]
+        rows = numpy.concatenate([numpy.arange(len(stamps[t])) for t in types])[arrival]
+        index = {}
+        valid = numpy.ones(len(timeline), dtype=bool)
+        for k in range(len(types)):
+            # carry the latest row of this type forward to later arrivals
+            index[types[k]] = numpy.maximum.accumulate(numpy.where(kinds == k, rows, -1))
+            valid &= index[types[k]] >= 0
+        timeline = timeline[valid]
+        for t in types:
+            index[t] = order[t][index[t][valid]]
+
+        vector = self.vectorisable()
+        for (t, field) in self.fields:
+            if not field in columns[t]:
+                return empty
+            col = columns[t][field]
+            if col.ndim != 1 or not col.dtype.kind in 'biuf':
+                vector = False
+        if vector:
+            v = self._evaluate_vector(columns, index, len(timeline))
+            if v is not None:
+                return (timeline, v)
+        return self._evaluate_rows(columns, index, timeline)
+
+    def _divides(self):
+        '''return True if the expression has a division or modulo'''
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.Div, ast.FloorDiv, ast.Mod)):
+                return True
+        return False
+
+    def _evaluate_vector(self, columns, index, length):
+        '''evaluate over aligned columns, returning None if the result is
+        not one number per row, or if evaluate() would give None for some
+        rows'''
+        import numpy
+        global _vector_globals
+        if _vector_globals is None:
+            _vector_globals = dict(globals())
+            for (name, (func, nargs)) in _vector_functions.items():
+                _vector_globals[name] = getattr(numpy, func)
+        vars = {}
+        for t in index:
+            vars[t] = _Row(t, {})
+        for (t, field) in self.fields:
+            col = columns[t][field]
+            if col.dtype.kind == 'f':
+                # do the sums in double precision as python would
+                col = col.astype(numpy.float64)
+            setattr(vars[t], field, col[index[t]])
+        # python raises ZeroDivisionError where numpy gives an infinity or
+        # NaN and flags divide or invalid, so if the expression divides
+        # leave those to _evaluate_rows()
+        flagged = []
+        try:
+            with numpy.errstate(all='ignore', divide='call', invalid='call',
+                                call=lambda err, flag: flagged.append(err)):
+                v = eval(self.code, _vector_globals, vars)
+        except (NameError, ZeroDivisionError, TypeError, ValueError):
+            return None
+        if len(flagged) != 0 and self._divides():
+            return None
+        v = numpy.asarray(v)
+        if not v.dtype.kind in 'biuf':
+            return None
+        if v.ndim == 0:
+            v = numpy.repeat(v, length)
+        if v.shape != (length,):
+            return None
+        return v
+
+    def _evaluate_rows(self, columns, index, timeline):
+        '''evaluate one row at a time with messages rebuilt from the columns'''
+        import numpy
+        values = {}
+        for t in index:
+            values[t] = {}
+            for field in columns[t]:
+                values[t][field] = _python_values(columns[t][field])
+        vars = {}
+        last = dict([(t, -1) for t in index])
+        stamps = []
+        ret = []
+        for i in range(len(timeline)):
+            for t in index:
+                row = index[t][i]
+                if row != last[t]:
+                    vars[t] = _Row(t, dict([(f, values[t][f][row]) for f in values[t]]))
+                    last[t] = row
+            v = self.evaluate(vars)
+            if v is None:
+                continue
+            stamps.append(timeline[i])
+            ret.append(v)
+        return (numpy.array(stamps), numpy.array(ret))
+
+    def evaluate_log(self, log):
+        '''evaluate the expression over a whole log that has to_arrays(),
+        such as DFReader_binary or mavmmaplog. See evaluate_columns()'''
+        columns = {}
+        for t in self.message_types:
+            c = log.to_arrays(t)
+            if c is not None:
+                columns[t] = c
+        return self.evaluate_columns(columns)
+
+    def __str__(self):
+        return self.expression
+
+class _Row(object):
+    '''a message rebuilt from columns'''
+    def __init__(self, type, fields):
+        self._type = type
+        self.__dict__.update(fields)
+
+    def get_type(self):
+        return self._type
+
+def _python_values(column):
+    '''the values of a numpy column as python objects, as they would be
+    in a message'''
+    ret = column.tolist()
+    if column.dtype.kind == 'S' and sys.version_info.major >= 3:
+        ret = [v.decode('utf-8', 'replace') for v in ret]
+    return ret
+
+def compile_expression(expression):
+    '''return a compiled MAVExpression for an expression string. Compiled
+    expressions are cached, and a MAVExpression is returned unchanged'''
+    if isinstance(expression, MAVExpression):
+        return expression
+    try:
+        return _cache[expression]
+    except KeyError:
+        pass
+    ret = MAVExpression(expression)
+    if len(_cache) >= _cache_size:
+        _cache.clear()
+    _cache[expression] = ret
+    return ret
+
 def evaluate_expression(expression, vars):
     '''evaluation an expression'''
-    try:
-        v = eval(expression, globals(), vars)
-    except NameError:
-        return None
-    except ZeroDivisionError:
-        return None
-    return v
+    return compile_expression(expression).evaluate(vars)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+'''
+numpy versions of the mavextra derived quantity functions, for
+computing them over whole logs at once
+
+The functions take the same arguments as their mavextra namesakes, but
+each message argument holds arrays of field values: a dictionary of
+columns as given by to_arrays() on a log, a numpy record array, or an
+object with array attributes. All the messages passed to a function
+must have the same length. Vectors are returned as (N,3) arrays and
+rotation matrices as (N,3,3) arrays.
+
+Released under GNU GPL version 3 or later
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def _field(msg, name):
+    '''the values of a message field as an array of doubles'''
+    if isinstance(msg, (dict, np.ndarray)):
+        return np.asarray(msg[name], dtype=np.float64)
+    return np.asarray(getattr(msg, name), dtype=np.float64)
+
+def _has_field(msg, name):
+    '''return True if a message has the given field'''
+    if isinstance(msg, dict):
+        return name in msg
+    if isinstance(msg, np.ndarray):
+        return msg.dtype.names is not None and name in msg.dtype.names
+    return hasattr(msg, name)
+
+def _rotate(r, x, y, z):
+    '''multiply each rotation matrix by a vector, giving an (N,3) array'''
+    return np.stack([r[:,0,0]*x + r[:,0,1]*y + r[:,0,2]*z,
+                     r[:,1,0]*x + r[:,1,1]*y + r[:,1,2]*z,
+                     r[:,2,0]*x + r[:,2,1]*y + r[:,2,2]*z], axis=-1)
+
+def kmh(mps):
+    '''convert m/s to Km/h'''
+    return np.asarray(mps)*3.6
+
+def altitude(SCALED_PRESSURE, ground_pressure=None, ground_temp=None):
+    '''calculate barometric altitude'''
+    from . import mavutil
+    self = mavutil.mavfile_global
+    press_abs = _field(SCALED_PRESSURE, 'press_abs')
+    if ground_pressure is None:
+        if self.param('GND_ABS_PRESS', None) is None:
+            return np.zeros(len(press_abs))
+        ground_pressure = self.param('GND_ABS_PRESS', 1)
+    if ground_temp is None:
+        ground_temp = self.param('GND_TEMP', 0)
+    scaling = ground_pressure / (press_abs*100.0)
+    temp = ground_temp + 273.15
+    return np.log(scaling) * temp * 29271.267 * 0.001
+
+def altitude2(SCALED_PRESSURE, ground_pressure=None, ground_temp=None):
+    '''calculate barometric altitude'''
+    from . import mavutil
+    self = mavutil.mavfile_global
+    press_abs = _field(SCALED_PRESSURE, 'press_abs')
+    if ground_pressure is None:
+        if self.param('GND_ABS_PRESS', None) is None:
+            return np.zeros(len(press_abs))
+        ground_pressure = self.param('GND_ABS_PRESS', 1)
+    if ground_temp is None:
+        ground_temp = self.param('GND_TEMP', 0)
+    scaling = press_abs*100.0 / ground_pressure
+    temp = ground_temp + 273.15
+    return 153.8462 * temp * (1.0 - np.exp(0.190259 * np.log(scaling)))
+
+def _mag(RAW_IMU, SENSOR_OFFSETS, ofs):
+    '''raw magnetometer field with optional offset correction'''
+    mag_x = _field(RAW_IMU, 'xmag')
+    mag_y = _field(RAW_IMU, 'ymag')
+    mag_z = _field(RAW_IMU, 'zmag')
+    if SENSOR_OFFSETS is not None and ofs is not None:
+        mag_x = mag_x + ofs[0] - _field(SENSOR_OFFSETS, 'mag_ofs_x')
+        mag_y = mag_y + ofs[1] - _field(SENSOR_OFFSETS, 'mag_ofs_y')
+        mag_z = mag_z + ofs[2] - _field(SENSOR_OFFSETS, 'mag_ofs_z')
+    return (mag_x, mag_y, mag_z)
+
+def mag_heading(RAW_IMU, ATTITUDE, declination=None, SENSOR_OFFSETS=None, ofs=None):
+    '''calculate heading from raw magnetometer'''
+    if declination is None:
+        from . import mavutil
+        declination = np.degrees(mavutil.mavfile_global.param('COMPASS_DEC', 0))
+    (mag_x, mag_y, mag_z) = _mag(RAW_IMU, SENSOR_OFFSETS, ofs)
+
+    # go via a DCM matrix to match the APM calculation
+    dcm = rotation(ATTITUDE)
+    cos_pitch_sq = 1.0-(dcm[:,2,0]*dcm[:,2,0])
+    headY = mag_y * dcm[:,2,2] - mag_z * dcm[:,2,1]
+    headX = mag_x * cos_pitch_sq - dcm[:,2,0] * (mag_y * dcm[:,2,1] + mag_z * dcm[:,2,2])
+
+    heading = np.degrees(np.arctan2(-headY,headX)) + declination
+    return np.where(heading < 0, heading + 360, heading)
+
+def mag_field(RAW_IMU, SENSOR_OFFSETS=None, ofs=None):
+    '''calculate magnetic field strength from raw magnetometer'''
+    (mag_x, mag_y, mag_z) = _mag(RAW_IMU, SENSOR_OFFSETS, ofs)
+    return np.sqrt(mag_x**2 + mag_y**2 + mag_z**2)
+
+def mag_field_df(MAG, ofs=None):
+    '''calculate magnetic field strength from raw magnetometer (dataflash version)'''
+    mag = np.stack([_field(MAG, 'MagX'), _field(MAG, 'MagY'), _field(MAG, 'MagZ')], axis=-1)
+    if ofs is not None:
+        offsets = np.stack([_field(MAG, 'OfsX'), _field(MAG, 'OfsY'), _field(MAG, 'OfsZ')], axis=-1)
+        mag = (mag - offsets) + np.asarray(ofs[:3], dtype=np.float64)
+    return np.sqrt((mag**2).sum(axis=-1))
+
+def angle_diff(angle1, angle2):
+    '''show the difference between two angles in degrees'''
+    ret = np.asarray(angle1, dtype=np.float64) - angle2
+    ret = np.where(ret > 180, ret - 360, ret)
+    return np.where(ret < -180, ret + 360, ret)
+
+def _rotation(roll, pitch, yaw):
+    '''rotation matrices from Euler angles in radians, as Matrix3.from_euler()'''
+    cp = np.cos(pitch)
+    sp = np.sin(pitch)
+    sr = np.sin(roll)
+    cr = np.cos(roll)
+    sy = np.sin(yaw)
+    cy = np.cos(yaw)
+    r = np.empty((len(cp), 3, 3))
+    r[:,0,0] = cp * cy
+    r[:,0,1] = (sr * sp * cy) - (cr * sy)
+    r[:,0,2] = (cr * sp * cy) + (sr * sy)
+    r[:,1,0] = cp * sy
+    r[:,1,1] = (sr * sp * sy) + (cr * cy)
+    r[:,1,2] = (cr * sp * sy) - (sr * cy)
+    r[:,2,0] = -sp
+    r[:,2,1] = sr * cp
+    r[:,2,2] = cr * cp
+    return r
+
+def rotation(ATTITUDE):
+    '''return the DCM rotation matrices'''
+    return _rotation(_field(ATTITUDE, 'roll'), _field(ATTITUDE, 'pitch'), _field(ATTITUDE, 'yaw'))
+
+def rotation_df(ATT):
+    '''return the DCM rotation matrices'''
+    return _rotation(np.radians(_field(ATT, 'Roll')), np.radians(_field(ATT, 'Pitch')),
+                     np.radians(_field(ATT, 'Yaw')))
+
+def distance_two(GPS_RAW1, GPS_RAW2, horizontal=True):
+    '''distance between two points'''
+    if _has_field(GPS_RAW1, 'Lat'):
+        lat1 = np.radians(_field(GPS_RAW1, 'Lat'))
+        lat2 = np.radians(_field(GPS_RAW2, 'Lat'))
+        lon1 = np.radians(_field(GPS_RAW1, 'Lng'))
+        lon2 = np.radians(_field(GPS_RAW2, 'Lng'))
+        alt1 = _field(GPS_RAW1, 'Alt')
+        alt2 = _field(GPS_RAW2, 'Alt')
+    elif _has_field(GPS_RAW1, 'cog'):
+        lat1 = np.radians(_field(GPS_RAW1, 'lat'))*1.0e-7
+        lat2 = np.radians(_field(GPS_RAW2, 'lat'))*1.0e-7
+        lon1 = np.radians(_field(GPS_RAW1, 'lon'))*1.0e-7
+        lon2 = np.radians(_field(GPS_RAW2, 'lon'))*1.0e-7
+        alt1 = _field(GPS_RAW1, 'alt')*0.001
+        alt2 = _field(GPS_RAW2, 'alt')*0.001
+    else:
+        lat1 = np.radians(_field(GPS_RAW1, 'lat'))
+        lat2 = np.radians(_field(GPS_RAW2, 'lat'))
+        lon1 = np.radians(_field(GPS_RAW1, 'lon'))
+        lon2 = np.radians(_field(GPS_RAW2, 'lon'))
+        alt1 = _field(GPS_RAW1, 'alt')*0.001
+        alt2 = _field(GPS_RAW2, 'alt')*0.001
+    dLat = lat2 - lat1
+    dLon = lon2 - lon1
+
+    a = np.sin(0.5*dLat)**2 + np.sin(0.5*dLon)**2 * np.cos(lat1) * np.cos(lat2)
+    c = 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0-a))
+    ground_dist = 6371 * 1000 * c
+    if horizontal:
+        return ground_dist
+    return np.sqrt(ground_dist**2 + (alt2-alt1)**2)
+
+def airspeed(VFR_HUD, ratio=None, used_ratio=None, offset=None):
+    '''recompute airspeed with a different ARSPD_RATIO'''
+    from . import mavutil
+    mav = mavutil.mavfile_global
+    if ratio is None:
+        ratio = 1.9936 # APM default
+    if used_ratio is None:
+        if 'ARSPD_RATIO' in mav.params:
+            used_ratio = mav.params['ARSPD_RATIO']
+        else:
+            print("no ARSPD_RATIO in mav.params")
+            used_ratio = ratio
+    if _has_field(VFR_HUD, 'airspeed'):
+        airspeed = _field(VFR_HUD, 'airspeed')
+    else:
+        airspeed = _field(VFR_HUD, 'Airspeed')
+    airspeed_pressure = (airspeed**2) / used_ratio
+    if offset is not None:
+        airspeed_pressure = np.maximum(airspeed_pressure + offset, 0)
+    return np.sqrt(airspeed_pressure * ratio)
+
+def gps_velocity(GLOBAL_POSITION_INT):
+    '''return GPS velocity vectors'''
+    return np.stack([_field(GLOBAL_POSITION_INT, 'vx'), _field(GLOBAL_POSITION_INT, 'vy'),
+                     _field(GLOBAL_POSITION_INT, 'vz')], axis=-1) * 0.01
+
+def gps_velocity_old(GPS_RAW_INT):
+    '''return GPS velocity vectors'''
+    vel = _field(GPS_RAW_INT, 'vel')*0.01
+    cog = np.radians(_field(GPS_RAW_INT, 'cog')*0.01)
+    return np.stack([vel*np.cos(cog), vel*np.sin(cog), np.zeros(len(vel))], axis=-1)
+
+def earth_accel(RAW_IMU,ATTITUDE):
+    '''return earth frame acceleration vectors'''
+    scale = 9.81 * 0.001
+    return _rotate(rotation(ATTITUDE), _field(RAW_IMU, 'xacc')*scale,
+                   _field(RAW_IMU, 'yacc')*scale, _field(RAW_IMU, 'zacc')*scale)
+
+def earth_gyro(RAW_IMU,ATTITUDE):
+    '''return earth frame gyro vectors'''
+    return _rotate(rotation(ATTITUDE), np.degrees(_field(RAW_IMU, 'xgyro'))*0.001,
+                   np.degrees(_field(RAW_IMU, 'ygyro'))*0.001,
+                   np.degrees(_field(RAW_IMU, 'zgyro'))*0.001)
+
+def earth_accel_df(IMU,ATT):
+    '''return earth frame acceleration vectors from df log'''
+    return _rotate(rotation_df(ATT), _field(IMU, 'AccX'), _field(IMU, 'AccY'), _field(IMU, 'AccZ'))
+
+def wrap_180(angle):
+    angle = np.asarray(angle, dtype=np.float64)
+    angle = np.where(angle > 180, angle - 360.0, angle)
+    return np.where(angle < -180, angle + 360.0, angle)
+
+def wrap_360(angle):
+    angle = np.asarray(angle, dtype=np.float64)
+    angle = np.where(angle > 360, angle - 360.0, angle)
+    return np.where(angle < 0, angle + 360.0, angle)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+sidecar index files for log readers
+
+An index records the per-type message offsets found by a reader's
+init_arrays() scan, along with whatever other tables the reader needs
+to rebuild its state, so that reopening a log that has been seen
+before does not need a full rescan. The index is keyed on the size,
+mtime and a hash of the head and tail of the log, and is ignored if
+any of those have changed.
+
+Released under GNU GPL version 3 or later
+'''
+
+import hashlib
+import json
+import os
+import struct
+
+INDEX_MAGIC = b'PYMAVIDX'
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.pmidx'
+
+# number of bytes hashed from each end of the log
+HASH_BLOCK = 65536
+
+def index_filename(filename):
+    '''return the sidecar index filename for a log'''
+    return filename + INDEX_SUFFIX
+
+def log_key(filename):
+    '''return the key identifying the current contents of a log'''
+    st = os.stat(filename)
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        h.update(f.read(HASH_BLOCK))
+        if st.st_size > HASH_BLOCK:
+            f.seek(max(HASH_BLOCK, st.st_size - HASH_BLOCK))
+            h.update(f.read(HASH_BLOCK))
+    return [st.st_size, repr(st.st_mtime), h.hexdigest()]
+
+def save_index(filename, kind, info, offsets):
+    '''save an index for a log. kind names the reader the index is for,
+    info is a JSON-serialisable dictionary and offsets is a dictionary
+    mapping integer message types to lists of file offsets. Failure
+    to write the index is not an error'''
+    keys = sorted(offsets.keys())
+    header = {'version': INDEX_VERSION,
+              'kind': kind,
+              'key': log_key(filename),
+              'info': info,
+              'offsets': [[k, len(offsets[k])] for k in keys]}
+    header = json.dumps(header).encode('utf-8')
+    chunks = [INDEX_MAGIC, struct.pack('<I', len(header)), header]
+    for k in keys:
+        chunks.append(struct.pack('<%uQ' % len(offsets[k]), *offsets[k]))
+    idxname = index_filename(filename)
+    tmpname = '%s.%u' % (idxname, os.getpid())
+    try:
+        with open(tmpname, 'wb') as f:
+            f.write(b''.join(chunks))
+        try:
+            os.rename(tmpname, idxname)
+        except OSError:
+            # windows won't rename over an existing file
+            os.remove(idxname)
+            os.rename(tmpname, idxname)
+    except (IOError, OSError):
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+
+def load_index(filename, kind):
+    '''load the index for a log, returning a tuple (info, offsets) as
+    passed to save_index(), or None if there is no usable index'''
+    try:
+        with open(index_filename(filename), 'rb') as f:
+            data = f.read()
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            return None
+        ofs = len(INDEX_MAGIC)
+        (hlen,) = struct.unpack_from('<I', data, ofs)
+        ofs += 4
+        header = json.loads(data[ofs:ofs+hlen].decode('utf-8'))
+        ofs += hlen
+        if (header['version'] != INDEX_VERSION or
+            header['kind'] != kind or
+            header['key'] != log_key(filename)):
+            return None
+        offsets = {}
+        for (k, count) in header['offsets']:
+            offsets[k] = list(struct.unpack_from('<%uQ' % count, data, ofs))
+            ofs += 8 * count
+    except (IOError, OSError, ValueError, KeyError, struct.error):
+        return None
+    return (header['info'], offsets)
@@ -4,7 +4,7 @@
 // This is normally dynamically generated as mavlink.h, but we just use the same settings for all native stacks
 
 #ifndef MAVLINK_STX
-#define MAVLINK_STX 254
+#define MAVLINK_STX 253
 #endif
 
 #ifndef MAVLINK_ENDIAN
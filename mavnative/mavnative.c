@@ -49,25 +49,22 @@ static void comm_send_ch(mavlink_channel_t chan, uint8_t c) {
 // static mavlink_message_t last_msg;
 
 /*
-  default message crc function. You can override this per-system to
-  put this data in a different memory segment
+  We look up message information ourselves (see find_message_info), so we
+  don't need the generated table of CRCs from mavlink_helpers.h
 */
-#define MAVLINK_MESSAGE_CRC(msgid) py_message_info[msgid].crc_extra
-
-/* Enable this option to check the length of each message.
- This allows invalid messages to be caught much sooner. Use if the transmission
- medium is prone to missing (or extra) characters (e.g. a radio that fades in
- and out). Only use if the channel will only contain messages types listed in
- the headers.
-*/
-
-#define MAVLINK_MESSAGE_LENGTH(msgid) py_message_info[msgid].len
+#define MAVLINK_GET_MSG_ENTRY
+static const mavlink_msg_entry_t *mavlink_get_msg_entry(uint32_t msgid) {
+    return NULL;
+}
 
 // #include <mavlink.h>
 
 #define TRUE 1
 #define FALSE 0
 
+#define HEADER_LEN_V1 6
+#define HEADER_LEN_V2 10
+
 typedef struct {
         PyObject                *name;               // name of this field
         mavlink_message_type_t  type;                // type of this field
@@ -78,8 +75,10 @@ typedef struct {
 // note that in this structure the order of fields is the order
 // in the XML file, not necessary the wire order
 typedef struct {
+    uint32_t            msgid;                                        // The msgid, for searching the table
     PyObject            *id;                                          // The int id for this msg
     PyObject            *name;                                        // name of the message
+    PyObject            *type_class;                                  // the python class for this message
     unsigned            len;                                          // the raw message length of this message - not including headers & CRC
     uint8_t             crc_extra;                                    // the CRC extra for this message
     unsigned            num_fields;                                   // how many fields in this message
@@ -87,8 +86,15 @@ typedef struct {
     py_field_info_t     fields[MAVLINK_MAX_FIELDS];                   // field information
 } py_message_info_t;
 
-static py_message_info_t py_message_info[256];
-static uint8_t           info_inited = FALSE; // We only do the init once (assuming only one dialect in use)
+// MAVLink2 message ids are 24 bits, so each dialect has a table sorted by msgid that we search
+typedef struct py_message_table {
+    PyObject                *mavlink_map;                             // the mavlink_map of the dialect (we keep a ref)
+    py_message_info_t       *info;                                    // information for each message, sorted by msgid
+    Py_ssize_t              len;                                      // how many messages in info
+    struct py_message_table *next;
+} py_message_table_t;
+
+static py_message_table_t *py_message_tables = NULL; // One for each dialect in use, each made once
 
 #include <protocol.h>
 
@@ -99,12 +105,14 @@ typedef struct {
     mavlink_message_t   msg;
     int                 numBytes;
     uint8_t             bytes[MAVLINK_MAX_PACKET_LEN];
+    const py_message_info_t *info;                                    // info for msg.msgid, NULL if unknown
 } py_message_t;
 
 typedef struct {
     PyObject_HEAD
 
     PyObject            *MAVLinkMessage;
+    const py_message_table_t *message_table;
     mavlink_status_t    mav_status;
     py_message_t        msg;
 } NativeConnection;
@@ -127,72 +135,133 @@ static jmp_buf python_entry;
 #define PYTHON_EXIT_INT  } else { return -1; } // Used for routines that return ints
 
 
+/**
+ * Find the information for a message, or NULL if it is not in the dialect
+ */
+static const py_message_info_t *find_message_info(const py_message_table_t *table, uint32_t msgid)
+{
+    Py_ssize_t low = 0, high = table->len;
+
+    while (low < high) {
+        Py_ssize_t mid = (low + high) / 2;
+        if (table->info[mid].msgid < msgid)
+            low = mid + 1;
+        else
+            high = mid;
+    }
+    if (low < table->len && table->info[low].msgid == msgid)
+        return &table->info[low];
+    return NULL;
+}
+
+/**
+ * Drop the message being parsed after a framing error, restarting on c if it could be
+ * the start of a new message.
+ */
+static void py_mavlink_parse_error(uint8_t c, py_message_t* pymsg, mavlink_status_t* status)
+{
+    mavlink_message_t *rxmsg = &pymsg->msg;
+
+    status->parse_error++;
+    status->msg_received = 0;
+    status->parse_state = MAVLINK_PARSE_STATE_IDLE;
+    if (c == MAVLINK_STX || c == MAVLINK_STX_MAVLINK1)
+    {
+        status->parse_state = MAVLINK_PARSE_STATE_GOT_STX;
+        rxmsg->len = 0;
+        rxmsg->magic = c;
+        rxmsg->incompat_flags = 0;
+        rxmsg->compat_flags = 0;
+        pymsg->numBytes = 0;
+        mavlink_start_checksum(rxmsg);
+        pymsg->bytes[pymsg->numBytes++] = c;
+    }
+}
+
 /** (originally from mavlink_helpers.h - but now customized to not be channel based)
  * This is a convenience function which handles the complete MAVLink parsing.
  * the function will parse one byte at a time and return the complete packet once
  * it could be successfully decoded. Checksum and other failures will be silently
  * ignored.
  *
+ * Both MAVLink1 and MAVLink2 frames are accepted. MAVLink2 payloads with trailing
+ * zeros stripped are zero extended to the full length of the message. Signatures
+ * are kept in the raw bytes but not checked, that is left to the caller.
+ *
  * Messages are parsed into an internal buffer (one for each channel). When a complete
  * message is received it is copies into *returnMsg and the channel's status is
  * copied into *returnStats.
  *
  * @param c        The char to parse
  *
+ * @param table    The messages of the dialect in use
+ *
  * @param returnMsg NULL if no message could be decoded, the message data else
  * @param returnStats if a message was decoded, this is filled with the channel's stats
  * @return 0 if no message could be decoded, 1 else
  *
  */
-MAVLINK_HELPER uint8_t py_mavlink_parse_char(uint8_t c, py_message_t* pymsg, mavlink_status_t* status)
+MAVLINK_HELPER uint8_t py_mavlink_parse_char(uint8_t c, const py_message_table_t *table, py_message_t* pymsg, mavlink_status_t* status)
 {
     mavlink_message_t *rxmsg = &pymsg->msg;
 
-    int bufferIndex = 0;
-
     status->msg_received = 0;
 
     switch (status->parse_state)
     {
     case MAVLINK_PARSE_STATE_UNINIT:
     case MAVLINK_PARSE_STATE_IDLE:
-        if (c == MAVLINK_STX)
+        if (c == MAVLINK_STX || c == MAVLINK_STX_MAVLINK1)
         {
             status->parse_state = MAVLINK_PARSE_STATE_GOT_STX;
             rxmsg->len = 0;
             pymsg->numBytes = 0;
             rxmsg->magic = c;
+            rxmsg->incompat_flags = 0;
+            rxmsg->compat_flags = 0;
             mavlink_start_checksum(rxmsg);
             pymsg->bytes[pymsg->numBytes++] = c;
         }
         break;
 
     case MAVLINK_PARSE_STATE_GOT_STX:
-            if (status->msg_received 
-/* Support shorter buffers than the
-   default maximum packet size */
-#if (MAVLINK_MAX_PAYLOAD_LEN < 255)
-                || c > MAVLINK_MAX_PAYLOAD_LEN
-#endif
-                )
+        // NOT counting STX, LENGTH, SEQ, SYSID, COMPID, MSGID, CRC1 and CRC2
+        rxmsg->len = c;
+        status->packet_idx = 0;
+        mavlink_update_checksum(rxmsg, c);
+        pymsg->bytes[pymsg->numBytes++] = c;
+        if (rxmsg->magic == MAVLINK_STX_MAVLINK1)
         {
-            status->buffer_overrun++;
-            status->parse_error++;
-            status->msg_received = 0;
-            status->parse_state = MAVLINK_PARSE_STATE_IDLE;
+            // MAVLink1 has no flags, the sequence number is next
+            status->parse_state = MAVLINK_PARSE_STATE_GOT_COMPAT_FLAGS;
         }
         else
         {
-            // NOT counting STX, LENGTH, SEQ, SYSID, COMPID, MSGID, CRC1 and CRC2
-            rxmsg->len = c;
-            status->packet_idx = 0;
-            mavlink_update_checksum(rxmsg, c);
-            pymsg->bytes[pymsg->numBytes++] = c;
             status->parse_state = MAVLINK_PARSE_STATE_GOT_LENGTH;
         }
         break;
 
     case MAVLINK_PARSE_STATE_GOT_LENGTH:
+        if ((c & ~MAVLINK_IFLAG_MASK) != 0)
+        {
+            // we can't parse a frame with flags we don't understand
+            py_mavlink_parse_error(c, pymsg, status);
+            break;
+        }
+        rxmsg->incompat_flags = c;
+        mavlink_update_checksum(rxmsg, c);
+        pymsg->bytes[pymsg->numBytes++] = c;
+        status->parse_state = MAVLINK_PARSE_STATE_GOT_INCOMPAT_FLAGS;
+        break;
+
+    case MAVLINK_PARSE_STATE_GOT_INCOMPAT_FLAGS:
+        rxmsg->compat_flags = c;
+        mavlink_update_checksum(rxmsg, c);
+        pymsg->bytes[pymsg->numBytes++] = c;
+        status->parse_state = MAVLINK_PARSE_STATE_GOT_COMPAT_FLAGS;
+        break;
+
+    case MAVLINK_PARSE_STATE_GOT_COMPAT_FLAGS:
         rxmsg->seq = c;
         mavlink_update_checksum(rxmsg, c);
         pymsg->bytes[pymsg->numBytes++] = c;
@@ -214,58 +283,71 @@ MAVLINK_HELPER uint8_t py_mavlink_parse_char(uint8_t c, py_message_t* pymsg, mav
         break;
 
     case MAVLINK_PARSE_STATE_GOT_COMPID:
-#ifdef MAVLINK_CHECK_MESSAGE_LENGTH
-            if (rxmsg->len != MAVLINK_MESSAGE_LENGTH(c))
-        {
-            status->parse_error++;
-            status->parse_state = MAVLINK_PARSE_STATE_IDLE;
-            break;
-        }
-#endif
         rxmsg->msgid = c;
         mavlink_update_checksum(rxmsg, c);
         pymsg->bytes[pymsg->numBytes++] = c;
-        if (rxmsg->len == 0)
+        if (rxmsg->magic == MAVLINK_STX_MAVLINK1)
         {
-            status->parse_state = MAVLINK_PARSE_STATE_GOT_PAYLOAD;
+            status->parse_state = MAVLINK_PARSE_STATE_GOT_MSGID3;
         }
         else
         {
-            status->parse_state = MAVLINK_PARSE_STATE_GOT_MSGID;
+            status->parse_state = MAVLINK_PARSE_STATE_GOT_MSGID1;
         }
         break;
 
-    case MAVLINK_PARSE_STATE_GOT_MSGID:
-        _MAV_PAYLOAD_NON_CONST(rxmsg)[status->packet_idx++] = (char)c;
+    case MAVLINK_PARSE_STATE_GOT_MSGID1:
+        rxmsg->msgid |= c<<8;
+        mavlink_update_checksum(rxmsg, c);
+        pymsg->bytes[pymsg->numBytes++] = c;
+        status->parse_state = MAVLINK_PARSE_STATE_GOT_MSGID2;
+        break;
+
+    case MAVLINK_PARSE_STATE_GOT_MSGID2:
+        rxmsg->msgid |= ((uint32_t)c)<<16;
         mavlink_update_checksum(rxmsg, c);
         pymsg->bytes[pymsg->numBytes++] = c;
-        if (status->packet_idx == rxmsg->len)
+        status->parse_state = MAVLINK_PARSE_STATE_GOT_MSGID3;
+        break;
+
+    case MAVLINK_PARSE_STATE_GOT_MSGID3:
+        // the whole header has been read, this byte is the first of the payload or CRC
+        if (status->packet_idx == 0)
         {
-            status->parse_state = MAVLINK_PARSE_STATE_GOT_PAYLOAD;
+            pymsg->info = find_message_info(table, rxmsg->msgid);
         }
-        break;
+        if (status->packet_idx < rxmsg->len)
+        {
+            _MAV_PAYLOAD_NON_CONST(rxmsg)[status->packet_idx++] = (char)c;
+            mavlink_update_checksum(rxmsg, c);
+            pymsg->bytes[pymsg->numBytes++] = c;
+            if (status->packet_idx == rxmsg->len)
+            {
+                status->parse_state = MAVLINK_PARSE_STATE_GOT_PAYLOAD;
+            }
+            break;
+        }
+        // an empty payload, so this is the first CRC byte
+        /* fall through */
 
     case MAVLINK_PARSE_STATE_GOT_PAYLOAD:
+        // we can only check the CRC of messages in our dialect
+        if (pymsg->info == NULL)
+        {
+            py_mavlink_parse_error(c, pymsg, status);
+            break;
+        }
 #if MAVLINK_CRC_EXTRA
-        mavlink_update_checksum(rxmsg, MAVLINK_MESSAGE_CRC(rxmsg->msgid));
+        mavlink_update_checksum(rxmsg, pymsg->info->crc_extra);
 #endif
         pymsg->bytes[pymsg->numBytes++] = c;
         if (c != (rxmsg->checksum & 0xFF)) {
             // Check first checksum byte
-            status->parse_error++;
-            status->msg_received = 0;
-            status->parse_state = MAVLINK_PARSE_STATE_IDLE;
-            if (c == MAVLINK_STX)
-            {
-                status->parse_state = MAVLINK_PARSE_STATE_GOT_STX;
-                rxmsg->len = 0;
-                mavlink_start_checksum(rxmsg);
-            }
+            py_mavlink_parse_error(c, pymsg, status);
         }
         else
         {
             status->parse_state = MAVLINK_PARSE_STATE_GOT_CRC1;
-            _MAV_PAYLOAD_NON_CONST(rxmsg)[status->packet_idx] = (char)c;
         }
         break;
 
@@ -273,22 +355,30 @@ MAVLINK_HELPER uint8_t py_mavlink_parse_char(uint8_t c, py_message_t* pymsg, mav
         pymsg->bytes[pymsg->numBytes++] = c;
         if (c != (rxmsg->checksum >> 8)) {
             // Check second checksum byte
-            status->parse_error++;
-            status->msg_received = 0;
-            status->parse_state = MAVLINK_PARSE_STATE_IDLE;
-            if (c == MAVLINK_STX)
-            {
-                status->parse_state = MAVLINK_PARSE_STATE_GOT_STX;
-                rxmsg->len = 0;
-                mavlink_start_checksum(rxmsg);
-            }
+            py_mavlink_parse_error(c, pymsg, status);
+        }
+        else if (rxmsg->incompat_flags & MAVLINK_IFLAG_SIGNED)
+        {
+            status->parse_state = MAVLINK_PARSE_STATE_SIGNATURE_WAIT;
+            status->signature_wait = MAVLINK_SIGNATURE_BLOCK_LEN;
         }
         else
         {
             // Successfully got message
             status->msg_received = 1;
             status->parse_state = MAVLINK_PARSE_STATE_IDLE;
-            _MAV_PAYLOAD_NON_CONST(rxmsg)[status->packet_idx+1] = (char)c;
+        }
+        break;
+
+    case MAVLINK_PARSE_STATE_SIGNATURE_WAIT:
+        rxmsg->signature[MAVLINK_SIGNATURE_BLOCK_LEN-status->signature_wait] = c;
+        pymsg->bytes[pymsg->numBytes++] = c;
+        status->signature_wait--;
+        if (status->signature_wait == 0)
+        {
+            // Successfully got a signed message, the signature is checked in python
+            status->msg_received = 1;
+            status->parse_state = MAVLINK_PARSE_STATE_IDLE;
         }
         break;
 
@@ -296,10 +386,13 @@ MAVLINK_HELPER uint8_t py_mavlink_parse_char(uint8_t c, py_message_t* pymsg, mav
         break;
     }
 
-    bufferIndex++;
     // If a message has been sucessfully decoded, check index
     if (status->msg_received == 1)
     {
+        // MAVLink2 strips trailing zeros from the payload, put them back
+        if (rxmsg->len < pymsg->info->len)
+            memset(_MAV_PAYLOAD_NON_CONST(rxmsg) + rxmsg->len, 0, pymsg->info->len - rxmsg->len);
+
         //while(status->current_seq != rxmsg->seq)
         //{
         //  status->packet_rx_drop_count++;
@@ -421,15 +514,33 @@ static int get_py_typeinfo(char type_char, int array_size, unsigned *wire_offset
     FIXME - we really should free these PyObjects if our module gets unloaded.
 
     @param mavlink_map - the mavlink_map object from python a dict from an int msgid -> tuple(fmt, type_class, order_list, len_list, crc_extra)
+
+    @return the table of messages for the dialect of mavlink_map
 */
-static void init_message_info(PyObject *mavlink_map) {
+static int compare_message_info(const void *a, const void *b) {
+    uint32_t ida = ((const py_message_info_t *) a)->msgid;
+    uint32_t idb = ((const py_message_info_t *) b)->msgid;
+
+    return (ida > idb) - (ida < idb);
+}
+
+static const py_message_table_t *init_message_info(PyObject *mavlink_map) {
     // static const mavlink_message_info_t src[256] = MAVLINK_MESSAGE_INFO;
-    
+
+    py_message_table_t *table;
+    for(table = py_message_tables; table != NULL; table = table->next) {
+        if(table->mavlink_map == mavlink_map)
+            return table;
+    }
+
     PyObject *items_list = PyDict_Values(mavlink_map);
     assert(items_list); // A list of the tuples in mavlink_map
 
     Py_ssize_t numMsgs = PyList_Size(items_list);
 
+    py_message_info_t *py_message_info = calloc(numMsgs, sizeof(py_message_info_t));
+    assert(py_message_info);
+
     int i;
     for(i = 0; i < numMsgs; i++) {
         PyObject *type_class = PyList_GetItem(items_list, i); // returns a _borrowed_ reference
@@ -454,10 +565,12 @@ static void init_message_info(PyObject *mavlink_map) {
                
         Py_ssize_t num_fields = PyList_Size(fieldname_list);
 
-        uint8_t id = (uint8_t) PyInt_AsLong(id_obj);
-        py_message_info_t *d = &py_message_info[id];
+        py_message_info_t *d = &py_message_info[i];
 
+        d->msgid = (uint32_t) PyInt_AsLong(id_obj);
         d->id = id_obj;
+        d->type_class = type_class;
+        Py_INCREF(type_class);
         d->name = name_obj;
         d->num_fields = num_fields;
         d->crc_extra = PyInt_AsLong(crc_extra_obj);
@@ -488,7 +601,20 @@ static void init_message_info(PyObject *mavlink_map) {
         //Py_DECREF(order_list);
     }
 
+    // sorted for find_message_info()
+    qsort(py_message_info, numMsgs, sizeof(py_message_info_t), compare_message_info);
+
     Py_DECREF(items_list);
+
+    table = malloc(sizeof(py_message_table_t));
+    assert(table);
+    table->mavlink_map = mavlink_map;
+    Py_INCREF(mavlink_map);
+    table->info = py_message_info;
+    table->len = numMsgs;
+    table->next = py_message_tables;
+    py_message_tables = table;
+    return table;
 }
 
 static PyObject *createPyNone(void)
@@ -519,31 +645,39 @@ static PyObject *pyextract_mavlink(const mavlink_message_t *msg, const py_field_
     unsigned offset = field->wire_offset;
     int index;
 
-    // For arrays of chars we build the result in a string instead of an array
-    PyObject *arrayResult =  (field->array_length != 0 && field->type != MAVLINK_TYPE_CHAR) ? PyList_New(field->array_length) : NULL;
-    PyObject *stringResult = (field->array_length != 0 && field->type == MAVLINK_TYPE_CHAR) ? PyByteString_FromString("") : NULL;
+    // For arrays of chars we build the result in a string, stopping at the first null char
+    if (field->array_length != 0 && field->type == MAVLINK_TYPE_CHAR) {
+        const char *s = _MAV_PAYLOAD(msg) + offset;
+        Py_ssize_t len = 0;
+
+        while (len < field->array_length && s[len] != 0)
+            len++;
+#if PY_MAJOR_VERSION >= 3
+        // the same str the python decoder gives
+        return PyUnicode_DecodeUTF8(s, len, "replace");
+#else
+        return PyString_FromStringAndSize(s, len);
+#endif
+    }
+
+    // Other arrays are lists, as the python decoder gives
+    PyObject *arrayResult = (field->array_length != 0) ? PyList_New(field->array_length) : NULL;
     PyObject *result = NULL;
 
     int numValues = (field->array_length == 0) ? 1 : field->array_length;
     unsigned fieldSize = get_field_size(field->type);
 
-    uint8_t string_ended = FALSE;
-
     if(arrayResult != NULL)
         result = arrayResult;
 
-    // Either build a full array of results, or return a single value 
+    // Either build a full array of results, or return a single value
     for(index = 0; index < numValues; index++) {
         PyObject *val = NULL;
 
         switch(field->type) {
             case MAVLINK_TYPE_CHAR: {
-                // If we are building a string, stop writing when we see a null char
                 char c = _MAV_RETURN_char(msg, offset);
 
-                if(stringResult && c == 0) 
-                    string_ended = TRUE;
-
                 val = PyByteString_FromStringAndSize(&c, 1);
                 break;
                 }
@@ -560,13 +694,13 @@ static PyObject *pyextract_mavlink(const mavlink_message_t *msg, const py_field_
                 val = PyInt_FromLong(_MAV_RETURN_int16_t(msg, offset));
                 break;
             case MAVLINK_TYPE_UINT32_T:
-                val = PyLong_FromLong(_MAV_RETURN_uint32_t(msg, offset));
+                val = PyLong_FromUnsignedLong(_MAV_RETURN_uint32_t(msg, offset));
                 break;
             case MAVLINK_TYPE_INT32_T:
-                val = PyInt_FromLong(_MAV_RETURN_int32_t(msg, offset));   
+                val = PyInt_FromLong(_MAV_RETURN_int32_t(msg, offset));
                 break;
             case MAVLINK_TYPE_UINT64_T:
-                val = PyLong_FromLongLong(_MAV_RETURN_uint64_t(msg, offset));
+                val = PyLong_FromUnsignedLongLong(_MAV_RETURN_uint64_t(msg, offset));
                 break;
             case MAVLINK_TYPE_INT64_T:
                 val = PyLong_FromLongLong(_MAV_RETURN_int64_t(msg, offset));
@@ -576,25 +710,18 @@ static PyObject *pyextract_mavlink(const mavlink_message_t *msg, const py_field_
                 break;
             case MAVLINK_TYPE_DOUBLE:
                 val = PyFloat_FromDouble(_MAV_RETURN_double(msg, offset));
-                break;            
+                break;
             default:
                 mavdebug("BAD MAV TYPE %d\n", field->type);
                 set_pyerror("Unexpected mavlink type");
+                Py_XDECREF(arrayResult);
                 return NULL;
         }
         offset += fieldSize;
 
         assert(val);
-        if(arrayResult != NULL)  
-            PyList_SetItem(arrayResult, index, val);
-        else if(stringResult != NULL) {
-            if(!string_ended)
-                PyByteString_ConcatAndDel(&stringResult, val);
-            else
-                Py_DECREF(val); // We didn't use this char
-
-            result = stringResult;
-        }
+        if(arrayResult != NULL)
+            PyList_SET_ITEM(arrayResult, index, val);
         else // Not building an array
             result = val;
     }
@@ -613,18 +740,23 @@ static PyObject *pyextract_mavlink(const mavlink_message_t *msg, const py_field_
     */
 static PyObject *msg_to_py(PyObject* msgclass, const py_message_t *pymsg) {
     const mavlink_message_t *msg = &pymsg->msg;
-    const py_message_info_t *info = &py_message_info[msg->msgid];
+    const py_message_info_t *info = pymsg->info;
+    PyTypeObject *type = (PyTypeObject *) info->type_class;
 
     mavdebug("Found a msg: %s\n", PyString_AS_STRING(info->name));
 
-    /* Call the class object to create our instance */
-    // PyObject *obj = PyObject_CallObject((PyObject *) &NativeConnectionType, null);
-    PyObject *argList = PyTuple_Pack(2, info->id, info->name);
-    PyObject *obj = PyObject_CallObject(msgclass, argList);
+    /* Make an instance of the message class without calling its constructor (which wants
+       all the fields), then let the base class constructor set up the header */
+    PyObject *argList = PyTuple_New(0);
+    PyObject *obj = type->tp_new(type, argList, NULL);
     uint8_t objValid = TRUE;
     assert(obj);
     Py_DECREF(argList);
 
+    PyObject *ret = PyObject_CallMethod(msgclass, "__init__", "OOO", obj, info->id, info->name);
+    assert(ret);
+    Py_DECREF(ret);
+
     // Find the header subobject
     PyObject *header = PyObject_GetAttrString(obj, "_header");
     assert(header);
@@ -634,18 +766,21 @@ static PyObject *msg_to_py(PyObject* msgclass, const py_message_t *pymsg) {
     set_attribute(header, "seq", PyInt_FromLong(msg->seq));
     set_attribute(header, "srcSystem", PyInt_FromLong(msg->sysid));
     set_attribute(header, "srcComponent", PyInt_FromLong(msg->compid));
+    set_attribute(header, "incompat_flags", PyInt_FromLong(msg->incompat_flags));
+    set_attribute(header, "compat_flags", PyInt_FromLong(msg->compat_flags));
     Py_DECREF(header);
     header = NULL;
 
     // FIXME - we should generate this expensive field only as needed (via a getattr override)
     set_attribute(obj, "_msgbuf", PyByteArray_FromStringAndSize((const char *) pymsg->bytes, pymsg->numBytes));
+    set_attribute(obj, "_crc", PyInt_FromLong(msg->checksum));
 
     // Now add all the fields - FIXME - do this lazily using getattr overrides
     PyObject_SetAttrString(obj, "_fieldnames", info->fieldnames); // Will increment the reference count
 
     // FIXME - reuse the fieldnames list from python - so it is in the right order
 
-    int fnum;
+    unsigned fnum;
     for(fnum = 0; fnum < info->num_fields && objValid; fnum++) {
         const py_field_info_t *f = &info->fields[fnum];
         PyObject *val = pyextract_mavlink(msg, f);
@@ -654,7 +789,7 @@ static PyObject *msg_to_py(PyObject* msgclass, const py_message_t *pymsg) {
             PyObject_SetAttr(obj, f->name, val);
             Py_DECREF(val); // We no longer need val, the attribute will keep a ref
         }
-        else 
+        else
             objValid = FALSE;
     }
 
@@ -674,43 +809,32 @@ static int get_expectedlength(NativeConnection *self)
 {
     int desired;
 
-    mavlink_message_t *msg = &self->msg.msg;
+    const py_message_t *pymsg = &self->msg;
+    const mavlink_message_t *msg = &pymsg->msg;
+    int header_len = (msg->magic == MAVLINK_STX_MAVLINK1) ? HEADER_LEN_V1 : HEADER_LEN_V2;
 
     switch(self->mav_status.parse_state) {
-        case MAVLINK_PARSE_STATE_UNINIT: 
-        case MAVLINK_PARSE_STATE_IDLE: 
-            desired = 8;
-            break;
-        case MAVLINK_PARSE_STATE_GOT_STX: 
-            desired = 7;
+        case MAVLINK_PARSE_STATE_UNINIT:
+        case MAVLINK_PARSE_STATE_IDLE:
+            // we don't know which protocol is next, so ask for the shortest frame
+            desired = HEADER_LEN_V1 + 2;
             break;
-        case MAVLINK_PARSE_STATE_GOT_LENGTH:
-            desired = msg->len + 6;
+        case MAVLINK_PARSE_STATE_GOT_STX:
+            desired = header_len + 2 - pymsg->numBytes;
             break;
-        case MAVLINK_PARSE_STATE_GOT_SEQ: 
-            desired = msg->len + 5;
-            break;
-        case MAVLINK_PARSE_STATE_GOT_SYSID: 
-            desired = msg->len + 4;
-            break;        
-        case MAVLINK_PARSE_STATE_GOT_COMPID:
-            desired = msg->len + 3;
-            break;         
-        case MAVLINK_PARSE_STATE_GOT_MSGID: 
-            desired = msg->len - self->mav_status.packet_idx + 2;
-            break;          
-        case MAVLINK_PARSE_STATE_GOT_PAYLOAD:
-            desired = 2;
-            break;          
-        case MAVLINK_PARSE_STATE_GOT_CRC1: 
-            desired = 1;
-            break;  
         default:
-            // Huh?  Just claim 1
-            desired = 1;
+            // the length is known, and the flags are before the payload
+            desired = header_len + msg->len + 2 - pymsg->numBytes;
+            if (msg->incompat_flags & MAVLINK_IFLAG_SIGNED)
+                desired += MAVLINK_SIGNATURE_BLOCK_LEN;
             break;
-    } 
-    
+    }
+
+    if (desired < 1) {
+        // Huh?  Just claim 1
+        desired = 1;
+    }
+
     mavdebug("in state %d, expected_length=%d\n", (int) self->mav_status.parse_state, desired);
     return desired;
 }
@@ -751,7 +875,7 @@ py_parse_chars(NativeConnection *self, PyObject *args)
         numBytes--;
         get_expectedlength(self); mavdebug("parse 0x%x\n", (unsigned char) c);
 
-        if (py_mavlink_parse_char(c, &self->msg, &self->mav_status)) {
+        if (py_mavlink_parse_char(c, self->message_table, &self->msg, &self->mav_status)) {
             mavdebug("got packet\n");
             result = msg_to_py(self->MAVLinkMessage, &self->msg);
             if(result != NULL)
@@ -802,7 +926,7 @@ py_parse_buffer(NativeConnection *self, PyObject *args)
         char c = *bytes++;
         // mavdebug("parse %c\n", c);
 
-        if (py_mavlink_parse_char(c, &self->msg, &self->mav_status)) {
+        if (py_mavlink_parse_char(c, self->message_table, &self->msg, &self->mav_status)) {
             PyObject *obj = msg_to_py(self->MAVLinkMessage, &self->msg);
             if(obj != NULL) {
                 PyList_Append(list, obj);
@@ -849,10 +973,7 @@ NativeConnection_init(NativeConnection *self, PyObject *args, PyObject *kwds)
     Py_INCREF(msgclass);
 
     assert(mavlink_map);
-    if(!info_inited) {
-        init_message_info(mavlink_map);
-        info_inited = TRUE;
-    }
+    self->message_table = init_message_info(mavlink_map);
 
     mavdebug("inited connection\n");
     return 0;
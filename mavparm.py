@@ -42,19 +42,33 @@ class MAVParmDict(dict):
         else:
             vfloat = float(value)
                 
-        while retries > 0 and not got_ack:
-            retries -= 1
-            mav.param_set_send(name.upper(), vfloat, parm_type=parm_type)
-            tstart = time.time()
-            while time.time() - tstart < 1:
-                ack = mav.recv_match(type='PARAM_VALUE', blocking=False)
-                if ack is None:
-                    time.sleep(0.1)
-                    continue
-                if str(name).upper() == str(ack.param_id).upper():
-                    got_ack = True
-                    self.__setitem__(name, float(value))
-                    break
+        sub = None
+        if getattr(mav, 'reader', None) is not None:
+            # other threads may be receiving from the connection, so
+            # watch for the ack on a queue of our own
+            sub = mav.subscribe(type='PARAM_VALUE')
+        try:
+            while retries > 0 and not got_ack:
+                retries -= 1
+                mav.param_set_send(name.upper(), vfloat, parm_type=parm_type)
+                tstart = time.time()
+                while True:
+                    remaining = tstart + 1 - time.time()
+                    if remaining <= 0:
+                        break
+                    if sub is None:
+                        ack = mav.recv_match(type='PARAM_VALUE', blocking=True, timeout=remaining)
+                    else:
+                        ack = sub.get(timeout=remaining)
+                    if ack is None:
+                        continue
+                    if str(name).upper() == str(ack.param_id).upper():
+                        got_ack = True
+                        self.__setitem__(name, float(value))
+                        break
+        finally:
+            if sub is not None:
+                sub.close()
         if not got_ack:
             print("timeout setting %s to %f" % (name, vfloat))
             return False
@@ -8,9 +8,14 @@ Released under GNU GPL version 3 or later
 from __future__ import print_function
 from builtins import object
 
-import socket, math, struct, time, os, fnmatch, array, sys, errno
+import socket, math, struct, time, os, fnmatch, sys, errno, re, io
+import collections
+import threading
 import select
 from pymavlink import mavexpression
+from pymavlink import mavindex
+# x25crc is re-exported for the code that uses mavutil.x25crc
+from pymavlink.generator.mavcrc import x25crc  # noqa: F401
 
 # adding these extra imports allows pymavlink to be used directly with pyinstaller
 # without having complex spec files. To allow for installs that don't have ardupilotmega
@@ -24,6 +29,9 @@ except Exception:
 # maximum packet length for a single receive call - use the UDP limit
 UDP_MAX_PACKET_LEN = 65535
 
+# how much stream links and log files read at a time
+READ_AHEAD_LEN = 65536
+
 # Store the MAVLink library for the currently-selected dialect
 # (set by set_dialect())
 mavlink = None
@@ -50,6 +58,10 @@ def mavlink20():
     '''return True if using MAVLink 2.0'''
     return 'MAVLINK20' in os.environ
 
+def compile_expression(expression):
+    '''compile an expression or condition for repeated evaluation'''
+    return mavexpression.compile_expression(expression)
+
 def evaluate_expression(expression, vars):
     '''evaluation an expression'''
     return mavexpression.evaluate_expression(expression, vars)
@@ -130,6 +142,105 @@ class param_state(object):
     def __init__(self):
         self.params = {}
 
+class mavsubscription(object):
+    '''a queue of received messages for one consumer, filled by the
+    reader thread started with mavfile.start_reader(). Only messages of
+    the given types (a type name or list of names, None for all) for
+    which the condition holds when they arrive are queued. Once
+    max_queue messages are waiting the oldest are dropped, and counted
+    in dropped'''
+    def __init__(self, conn, type=None, condition=None, max_queue=1000):
+        if type is not None and not isinstance(type, (list, tuple, set)):
+            type = [type]
+        if type is not None:
+            type = set(type)
+        if condition is not None:
+            condition = compile_expression(condition)
+        self.conn = conn
+        self.types = type
+        self.condition = condition
+        self.max_queue = max_queue
+        self.queue = collections.deque()
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def matches(self, msg):
+        '''see if a message should be queued'''
+        if self.types is not None and not msg.get_type() in self.types:
+            return False
+        return evaluate_condition(self.condition, self.conn.messages)
+
+    def put(self, msg):
+        '''queue a message'''
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(msg)
+            self.cond.notify_all()
+
+    def wait(self, timeout=None):
+        '''wait up to timeout seconds for a message to be queued,
+        returning True if there is one'''
+        with self.cond:
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while len(self.queue) == 0 and not self.closed:
+                if timeout is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return len(self.queue) != 0
+
+    def get(self, blocking=True, timeout=None):
+        '''take the next queued message, waiting for one if blocking.
+        Returns None on timeout, or once closed and empty. If the reader
+        thread stopped on an error, the error is raised once the queue
+        is empty'''
+        with self.cond:
+            if blocking:
+                self.wait(timeout)
+            if len(self.queue) == 0:
+                if self.closed and self.conn.reader_error is not None:
+                    raise self.conn.reader_error
+                return None
+            return self.queue.popleft()
+
+    def take(self, type=None, condition=None):
+        '''take the oldest queued message of the given types (a set, or
+        None for all) that meets the condition, leaving the others
+        queued. Returns None if there isn't one'''
+        with self.cond:
+            for m in self.queue:
+                if type is not None and not m.get_type() in type:
+                    continue
+                if not evaluate_condition(condition, self.conn.messages):
+                    continue
+                self.queue.remove(m)
+                return m
+            return None
+
+    def discard(self, msg):
+        '''remove a message from the queue, returning False if it had
+        already been taken'''
+        with self.cond:
+            for m in self.queue:
+                if m is msg:
+                    self.queue.remove(m)
+                    return True
+            return False
+
+    def close(self):
+        '''stop queueing messages, waking anything waiting'''
+        self.conn.unsubscribe(self)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
 class mavfile(object):
     '''a generic mavlink port'''
     def __init__(self, fd, address, source_system=255, source_component=0, notimestamps=False, input=True, use_native=default_native):
@@ -161,10 +272,12 @@ class mavfile(object):
         self.robust_parsing = True
         self.mav = mavlink.MAVLink(self, srcSystem=self.source_system, srcComponent=self.source_component, use_native=use_native)
         self.mav.robust_parsing = self.robust_parsing
+        self.mav.set_filter_callback(self.filtered_message)
         self.logfile = None
         self.logfile_raw = None
         self.start_time = time.time()
         self.message_hooks = []
+        self.type_hooks = {}
         self.idle_hooks = []
         self.uptime = 0.0
         self.notimestamps = notimestamps
@@ -172,6 +285,13 @@ class mavfile(object):
         self.WIRE_PROTOCOL_VERSION = mavlink.WIRE_PROTOCOL_VERSION
         self.stop_on_EOF = False
         self.portdead = False
+        # recv() may be asked for up to this many bytes more than the
+        # parser needs, on links where a read returns what is waiting
+        self.read_ahead = 0
+        # the reader thread, see start_reader()
+        self.reader = None
+        self.reader_error = None
+        self.subscriptions = []
 
     @property
     def target_system(self):
@@ -271,8 +391,15 @@ class mavfile(object):
         (callback, callback_args, callback_kwargs) = (self.mav.callback,
                                                       self.mav.callback_args,
                                                       self.mav.callback_kwargs)
+        msgid_filter = self.mav.msgid_filter
+        message_callbacks = self.mav.message_callbacks
+        crc_resync = getattr(self.mav, 'crc_resync', False)
         self.mav = mavlink.MAVLink(self, srcSystem=self.source_system, srcComponent=self.source_component)
+        self.mav.message_callbacks = message_callbacks
         self.mav.robust_parsing = self.robust_parsing
+        self.mav.crc_resync = crc_resync
+        self.mav.set_filter_callback(self.filtered_message)
+        self.mav.set_msgid_filter(msgid_filter)
         self.WIRE_PROTOCOL_VERSION = mavlink.WIRE_PROTOCOL_VERSION
         (self.mav.callback, self.mav.callback_args, self.mav.callback_kwargs) = (callback,
                                                                                  callback_args,
@@ -322,15 +449,16 @@ class mavfile(object):
 
     def post_message(self, msg):
         '''default post message call'''
-        if '_posted' in msg.__dict__:
+        if getattr(msg, '_posted', False):
             return
         msg._posted = True
         msg._timestamp = time.time()
         type = msg.get_type()
 
-        if 'usec' in msg.__dict__:
+        fieldnames = msg.get_fieldnames()
+        if 'usec' in fieldnames:
             self.uptime = msg.usec * 1.0e-6
-        if 'time_boot_ms' in msg.__dict__:
+        if 'time_boot_ms' in fieldnames:
             self.uptime = msg.time_boot_ms * 1.0e-3
 
         if self._timestamp is not None:
@@ -352,19 +480,8 @@ class mavfile(object):
         self.sysid_state[src_system].messages[type] = msg
 
         if not (src_tuple == radio_tuple or msg.get_type() == 'BAD_DATA'):
-            if not src_tuple in self.last_seq:
-                last_seq = -1
-            else:
-                last_seq = self.last_seq[src_tuple]
-            seq = (last_seq+1) % 256
-            seq2 = msg.get_seq()
-            if seq != seq2 and last_seq != -1:
-                diff = (seq2 - seq) % 256
-                self.mav_loss += diff
-                #print("lost %u seq=%u seq2=%u last_seq=%u src_system=%u %s" % (diff, seq, seq2, last_seq, src_system, msg.get_type()))
-            self.last_seq[src_tuple] = seq2
-            self.mav_count += 1
-        
+            self.update_seq(src_tuple, msg.get_seq())
+
         self.timestamp = msg._timestamp
         if type == 'HEARTBEAT' and self.probably_vehicle_heartbeat(msg):
             if self.sysid == 0:
@@ -390,6 +507,9 @@ class mavfile(object):
                 self.sysid_state[src_system].messages['HOME'] = msg
         for hook in self.message_hooks:
             hook(self, msg)
+        if type in self.type_hooks:
+            for hook in self.type_hooks[type]:
+                hook(self, msg)
 
         if (msg.get_signed() and
             self.mav.signing.link_id == 0 and
@@ -400,6 +520,60 @@ class mavfile(object):
             self.mav.signing.link_id = msg.get_link_id()
 
 
+    def update_seq(self, src_tuple, seq2):
+        '''update packet loss statistics for a new sequence number from a source'''
+        if not src_tuple in self.last_seq:
+            last_seq = -1
+        else:
+            last_seq = self.last_seq[src_tuple]
+        seq = (last_seq+1) % 256
+        if seq != seq2 and last_seq != -1:
+            diff = (seq2 - seq) % 256
+            self.mav_loss += diff
+            #print("lost %u seq=%u seq2=%u last_seq=%u src_system=%u" % (diff, seq, seq2, last_seq, src_tuple[0]))
+        self.last_seq[src_tuple] = seq2
+        self.mav_count += 1
+
+    def filtered_message(self, msgId, seq, src_system, src_component):
+        '''called for frames dropped by the message id filter, so they
+        still count towards packet loss statistics'''
+        src_tuple = (src_system, src_component)
+        if src_tuple != (ord('3'), ord('D')):
+            self.update_seq(src_tuple, seq)
+
+    def add_message_hook(self, hook, types=None):
+        '''add a hook called as hook(self, msg) for received messages of the
+        given types (a type name or list of names). With types of None the
+        hook sees all messages, the same as appending to message_hooks'''
+        if types is None:
+            self.message_hooks.append(hook)
+            return
+        if not isinstance(types, (list, tuple, set)):
+            types = [types]
+        for t in types:
+            self.type_hooks[t] = self.type_hooks.get(t, ()) + (hook,)
+
+    def remove_message_hook(self, hook, types=None):
+        '''remove a hook added with add_message_hook()'''
+        if types is None:
+            if hook in self.message_hooks:
+                self.message_hooks.remove(hook)
+            return
+        if not isinstance(types, (list, tuple, set)):
+            types = [types]
+        for t in types:
+            hooks = tuple([h for h in self.type_hooks.get(t, ()) if h != hook])
+            if hooks:
+                self.type_hooks[t] = hooks
+            elif t in self.type_hooks:
+                del self.type_hooks[t]
+
+    def set_msgid_filter(self, types):
+        '''only decode messages of the given types (names or ids). Other
+        messages are dropped by the parser without being decoded, and are
+        not seen by recv_msg() or message hooks. None decodes all messages'''
+        self.mav.set_msgid_filter(types)
+
     def packet_loss(self):
         '''packet loss as a percentage'''
         if self.mav_count == 0:
@@ -410,9 +584,15 @@ class mavfile(object):
     def recv_msg(self):
         '''message receive routine'''
         self.pre_message()
+        # with read ahead the parser may already hold whole messages, so
+        # try those before reading more
+        buffered = self.read_ahead != 0 and self.mav.buf_len() != 0
         while True:
-            n = self.mav.bytes_needed()
-            s = self.recv(n)
+            if buffered:
+                s = ''
+            else:
+                n = self.mav.bytes_needed()
+                s = self.recv(max(n, self.read_ahead))
             numnew = len(s)
 
             if numnew != 0:
@@ -423,6 +603,7 @@ class mavfile(object):
 
             # We always call parse_char even if the new string is empty, because the existing message buf might already have some valid packet
             # we can extract
+            filtered = self.mav.total_packets_filtered
             msg = self.mav.parse_char(s)
             if msg:
                 if self.logfile and  msg.get_type() != 'BAD_DATA' :
@@ -430,17 +611,151 @@ class mavfile(object):
                     self.logfile.write(str(struct.pack('>Q', usec) + msg.get_msgbuf()))
                 self.post_message(msg)
                 return msg
+            elif self.mav.total_packets_filtered != filtered:
+                # the message id filter dropped a frame. Start again
+                # on the next one, which may have its own timestamp
+                self.pre_message()
             else:
                 # if we failed to parse any messages _and_ no new bytes arrived, return immediately so the client has the option to
                 # timeout
-                if numnew == 0:
+                if numnew == 0 and not buffered:
                     return None
-                
-    def recv_match(self, condition=None, type=None, blocking=False, timeout=None):
+            buffered = False
+
+    def recv_many(self):
+        '''receive all the messages waiting, returning them as a list'''
+        ret = []
+        while True:
+            m = self.recv_msg()
+            if m is None:
+                return ret
+            ret.append(m)
+
+    def subscribe(self, type=None, condition=None, max_queue=1000):
+        '''return a mavsubscription, queueing the messages of the given
+        types that meet the condition as they arrive. Needs the reader
+        thread, see start_reader()'''
+        sub = mavsubscription(self, type=type, condition=condition, max_queue=max_queue)
+        if self.reader_error is not None:
+            # nothing will be queued, so don't let anything wait
+            sub.closed = True
+            return sub
+        # the reader thread looks at a snapshot of the list, so replace it
+        # rather than changing it
+        self.subscriptions = self.subscriptions + [sub]
+        return sub
+
+    def unsubscribe(self, sub):
+        '''stop queueing messages for a subscription'''
+        self.subscriptions = [s for s in self.subscriptions if s is not sub]
+
+    def start_reader(self, max_queue=1000):
+        '''start a thread that receives messages continuously, so several
+        threads can share the connection, each waiting on its own
+        subscribe() queue. Messages still go through post_message() and
+        message hooks, in the reader thread. recv_msg() then takes
+        messages from a queue of all received messages, up to max_queue
+        of them. recv_match() takes only the messages it matches from
+        that queue, and a blocking recv_match() waits on a subscription
+        of its own, so callers in different threads don't take each
+        other's messages; each message goes to one caller. recv_match()
+        ignores prefilter, as the filter would hide messages from every
+        subscriber. If receiving raises an exception the thread stops,
+        and the exception is raised by recv_msg(), recv_match() and
+        subscription waits once their queues are empty'''
+        if self.reader is not None:
+            return
+        self.reader_error = None
+        (recv_msg, select) = (self.recv_msg, self.select)
+        self.reader_queue = mavsubscription(self, max_queue=max_queue)
+        self.recv_msg = self._reader_recv_msg
+        self.select = self.reader_queue.wait
+        self.reader = threading.Thread(target=self._reader_loop, args=(recv_msg, select))
+        self.reader.daemon = True
+        self.reader_running = True
+        self.reader.start()
+
+    def stop_reader(self):
+        '''stop the reader thread, after which messages are received
+        directly again. Messages still queued for recv_msg() are dropped,
+        and subscriptions are closed'''
+        if self.reader is None:
+            return
+        self.reader_running = False
+        self.reader.join()
+        self.reader = None
+        del self.recv_msg
+        del self.select
+        self.reader_queue.close()
+        for sub in self.subscriptions:
+            sub.close()
+        self.reader_error = None
+
+    def _reader_recv_msg(self):
+        '''recv_msg() while the reader thread runs'''
+        return self.reader_queue.get(blocking=False)
+
+    def _reader_loop(self, recv_msg, select):
+        '''receive messages and queue them for their subscribers'''
+        try:
+            while self.reader_running:
+                m = recv_msg()
+                if m is None:
+                    select(0.05)
+                    continue
+                self.reader_queue.put(m)
+                for sub in self.subscriptions:
+                    if sub.matches(m):
+                        sub.put(m)
+        except Exception as e:
+            # pass the error on to whatever is waiting for messages
+            self.reader_error = e
+            self.reader_queue.close()
+            for sub in self.subscriptions:
+                sub.close()
+
+    def recv_tuples(self, named=False):
+        '''iterate over the messages received, as tuples of the message id,
+        source system, source component and sequence number followed by the
+        fields (see decode_tuple() in the dialect), stopping when no more
+        data is waiting. No message objects are made, so the messages are
+        not logged, post_message() is not called for them and message hooks
+        don't see them. Bad data is dropped'''
+        while True:
+            n = self.mav.bytes_needed()
+            s = self.recv(max(n, self.read_ahead))
+            numnew = len(s)
+
+            if numnew != 0:
+                if self.logfile_raw:
+                    self.logfile_raw.write(str(s))
+                if self.first_byte:
+                    self.auto_mavlink_version(s)
+
+            tuples = self.mav.parse_tuples(s, named)
+            for t in tuples:
+                yield t
+            if numnew == 0 and len(tuples) == 0:
+                return
+
+    def recv_match(self, condition=None, type=None, blocking=False, timeout=None, prefilter=False):
         '''recv the next MAVLink message that matches the given condition
-        type can be a string or a list of strings'''
+        type can be a string or a list of strings. If prefilter is True
+        messages of other types are dropped by the parser without being
+        decoded while waiting, so they won't update self.messages'''
         if type is not None and not isinstance(type, list) and not isinstance(type, set):
             type = [type]
+        if prefilter and type is not None and self.reader is None:
+            msgid_filter = self.mav.msgid_filter
+            self.set_msgid_filter(type)
+            try:
+                return self.recv_match(condition=condition, type=type, blocking=blocking, timeout=timeout)
+            finally:
+                self.set_msgid_filter(msgid_filter)
+        if condition is not None:
+            condition = compile_expression(condition)
+        if self.reader is not None:
+            return self._reader_recv_match(condition, type, blocking, timeout)
         start_time = time.time()
         while True:
             if timeout is not None:
@@ -466,6 +781,88 @@ class mavfile(object):
                 continue
             return m
 
+    def _reader_recv_match(self, condition, type, blocking, timeout):
+        '''recv_match() while the reader thread runs'''
+        sub = None
+        if blocking:
+            # subscribe before looking at the queue, so nothing arriving
+            # in between is missed
+            sub = self.subscribe(type=type, condition=condition)
+        try:
+            m = self.reader_queue.take(type, condition)
+            if m is not None or sub is None:
+                if m is None and self.reader_queue.closed and self.reader_error is not None:
+                    raise self.reader_error
+                return m
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while True:
+                wait = 0.05
+                if timeout is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        return None
+                m = sub.get(timeout=wait)
+                if m is not None:
+                    # another caller may have taken it from the queue of
+                    # all messages already
+                    if self.reader_queue.discard(m):
+                        return m
+                    continue
+                if sub.closed:
+                    return sub.get(blocking=False)
+                for hook in self.idle_hooks:
+                    hook(self)
+        finally:
+            if sub is not None:
+                sub.close()
+
+    def iter_messages(self, types=None, condition=None, start=None, end=None, blocking=False, timeout=None):
+        '''generator yielding the messages that match the given types
+        and condition, so loops over recv_match() can be written as a
+        for loop or chained with other generators. types can be a
+        string or a list or set of strings. start and end bound the
+        message _timestamp; earlier messages are still read so
+        self.messages stays current, and the first message after end
+        stops the iteration. If not blocking the iteration stops when
+        there is no more data. If timeout is given the iteration stops
+        when no matching message has arrived for that many seconds'''
+        if types is not None and not isinstance(types, set):
+            if not isinstance(types, list):
+                types = [types]
+            types = set(types)
+        if condition is not None:
+            condition = compile_expression(condition)
+        recv_msg = self.recv_msg
+        messages = self.messages
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            if timeout is not None and time.time() > deadline:
+                return
+            m = recv_msg()
+            if m is None:
+                if not blocking:
+                    return
+                for hook in self.idle_hooks:
+                    hook(self)
+                if timeout is None:
+                    self.select(0.05)
+                else:
+                    self.select(timeout/2)
+                continue
+            if types is not None and not m.get_type() in types:
+                continue
+            if start is not None and m._timestamp < start:
+                continue
+            if end is not None and m._timestamp > end:
+                return
+            if condition is not None and not evaluate_condition(condition, messages):
+                continue
+            yield m
+            if timeout is not None:
+                deadline = time.time() + timeout
+
     def check_condition(self, condition):
         '''check if a condition is true'''
         return evaluate_condition(condition, self.messages)
@@ -759,21 +1156,34 @@ class mavfile(object):
                                        mavlink.MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN, 0,
                                        1, 0, 0, 0, 0, 0, 0)
 
+    def wait_match(self, type, condition=None):
+        '''wait for a new message of the given type meeting the condition.
+        While the reader thread runs this waits on a subscription of its
+        own, so it doesn't take messages from recv_match() callers in
+        other threads'''
+        if self.reader is None:
+            return self.recv_match(type=type, condition=condition, blocking=True)
+        sub = self.subscribe(type=type, condition=condition)
+        try:
+            return sub.get()
+        finally:
+            sub.close()
+
     def wait_gps_fix(self):
-        self.recv_match(type='VFR_HUD', blocking=True)
+        self.wait_match('VFR_HUD')
         if self.mavlink10():
-            self.recv_match(type='GPS_RAW_INT', blocking=True,
+            self.wait_match('GPS_RAW_INT',
                             condition='GPS_RAW_INT.fix_type>=3 and GPS_RAW_INT.lat != 0')
         else:
-            self.recv_match(type='GPS_RAW', blocking=True,
+            self.wait_match('GPS_RAW',
                             condition='GPS_RAW.fix_type>=2 and GPS_RAW.lat != 0')
 
     def location(self, relative_alt=False):
         '''return current location'''
         self.wait_gps_fix()
         # wait for another VFR_HUD, to ensure we have correct altitude
-        self.recv_match(type='VFR_HUD', blocking=True)
-        self.recv_match(type='GLOBAL_POSITION_INT', blocking=True)
+        self.wait_match('VFR_HUD')
+        self.wait_match('GLOBAL_POSITION_INT')
         if relative_alt:
             alt = self.messages['GLOBAL_POSITION_INT'].relative_alt*0.001
         else:
@@ -822,14 +1232,14 @@ class mavfile(object):
     def motors_armed_wait(self):
         '''wait for motors to be armed'''
         while True:
-            m = self.wait_heartbeat()
+            m = self.wait_match('HEARTBEAT')
             if self.motors_armed():
                 return
 
     def motors_disarmed_wait(self):
         '''wait for motors to be disarmed'''
         while True:
-            m = self.wait_heartbeat()
+            m = self.wait_match('HEARTBEAT')
             if not self.motors_armed():
                 return
 
@@ -927,6 +1337,7 @@ class mavserial(mavfile):
         self.set_baudrate(self.baud)
         mavfile.__init__(self, fd, device, source_system=source_system, source_component=source_component, use_native=use_native)
         self.rtscts = False
+        self.read_ahead = READ_AHEAD_LEN
 
     def set_rtscts(self, enable):
         '''enable/disable RTS/CTS if applicable'''
@@ -1017,21 +1428,31 @@ class mavudp(mavfile):
         self.port.setblocking(0)
         self.last_address = None
         self.resolved_destination_addr = None
+        # address each (sysid, compid) was last heard from by recv_many()
+        self.source_addresses = {}
         mavfile.__init__(self, self.port.fileno(), device, source_system=source_system, source_component=source_component, input=input, use_native=use_native)
 
     def close(self):
         self.port.close()
 
-    def recv(self,n=None):
+    def recvfrom(self):
+        '''read a datagram, returning the data and the address it came
+        from, or None if nothing is waiting'''
         try:
             data, new_addr = self.port.recvfrom(UDP_MAX_PACKET_LEN)
         except socket.error as e:
             if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED ]:
-                return ""
+                return None
             raise
         if self.udp_server or self.broadcast:
             self.last_address = new_addr
-        return data
+        return (data, new_addr)
+
+    def recv(self,n=None):
+        ret = self.recvfrom()
+        if ret is None:
+            return ""
+        return ret[0]
 
     def write(self, buf):
         try:
@@ -1066,6 +1487,13 @@ class mavudp(mavfile):
 
         return m
 
+    def recv_many(self):
+        '''receive all the datagrams waiting, returning a list of all the
+        messages in them'''
+        if self.reader is not None:
+            return mavfile.recv_many(self)
+        return recv_datagrams(self)
+
 class mavmcast(mavfile):
     '''a UDP multicast mavlink socket'''
     def __init__(self, device, broadcast=False, source_system=255, source_component=0, use_native=default_native):
@@ -1096,6 +1524,8 @@ class mavmcast(mavfile):
         self.port_out.connect((mcast_ip, mcast_port))
         set_close_on_exec(self.port_out.fileno())
         self.myport = None
+        # address each (sysid, compid) was last heard from by recv_many()
+        self.source_addresses = {}
 
         mavfile.__init__(self, self.port.fileno(), device,
                          source_system=source_system, source_component=source_component,
@@ -1105,7 +1535,10 @@ class mavmcast(mavfile):
         self.port.close()
         self.port_out.close()
 
-    def recv(self,n=None):
+    def recvfrom(self):
+        '''read a datagram, returning the data and the address it came
+        from, or None if nothing is waiting. Our own datagrams come back
+        as empty data'''
         try:
             data, new_addr = self.port.recvfrom(UDP_MAX_PACKET_LEN)
             if self.myport is None:
@@ -1115,12 +1548,18 @@ class mavmcast(mavfile):
                     pass
         except socket.error as e:
             if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED ]:
-                return ""
+                return None
             raise
         if self.myport == new_addr[1]:
             # data from ourselves, discard
+            return ('', new_addr)
+        return (data, new_addr)
+
+    def recv(self,n=None):
+        ret = self.recvfrom()
+        if ret is None:
             return ''
-        return data
+        return ret[0]
 
     def write(self, buf):
         try:
@@ -1141,7 +1580,45 @@ class mavmcast(mavfile):
             self.post_message(m)
 
         return m
-    
+
+    def recv_many(self):
+        '''receive all the datagrams waiting, returning a list of all the
+        messages in them'''
+        if self.reader is not None:
+            return mavfile.recv_many(self)
+        return recv_datagrams(self)
+
+def recv_datagrams(link):
+    '''recv_many() for UDP links. Each datagram waiting is parsed whole,
+    and the address each source system and component was heard from is
+    noted in link.source_addresses'''
+    link.pre_message()
+    ret = []
+    if link.mav.buf_len() != 0:
+        # frames left over from recv_msg()
+        msgs = link.mav.parse_buffer(b'')
+        if msgs is not None:
+            for m in msgs:
+                link.post_message(m)
+            ret.extend(msgs)
+    while True:
+        d = link.recvfrom()
+        if d is None:
+            return ret
+        (data, addr) = d
+        if len(data) == 0:
+            continue
+        if link.first_byte:
+            link.auto_mavlink_version(data)
+        msgs = link.mav.parse_buffer(data)
+        if msgs is None:
+            continue
+        for m in msgs:
+            if m.get_type() != 'BAD_DATA':
+                link.source_addresses[(m.get_srcSystem(), m.get_srcComponent())] = addr
+            link.post_message(m)
+        ret.extend(msgs)
+
 
 class mavtcp(mavfile):
     '''a TCP mavlink socket'''
@@ -1163,6 +1640,7 @@ class mavtcp(mavfile):
         self.do_connect(retries)
 
         mavfile.__init__(self, self.port.fileno(), "tcp:" + device, source_system=source_system, source_component=source_component, use_native=use_native)
+        self.read_ahead = READ_AHEAD_LEN
 
     def do_connect(self, retries=3):
         self.port = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1202,6 +1680,7 @@ class mavtcp(mavfile):
                 print("Attempting reconnect")
                 self.port.close()
                 self.do_connect()
+                self.fd = self.port.fileno()
 
         return data
 
@@ -1229,6 +1708,7 @@ class mavtcpin(mavfile):
         self.listen.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
         mavfile.__init__(self, self.listen.fileno(), "tcpin:" + device, source_system=source_system, source_component=source_component, use_native=use_native)
         self.port = None
+        self.read_ahead = READ_AHEAD_LEN
 
     def close(self):
         self.listen.close()
@@ -1255,6 +1735,11 @@ class mavtcpin(mavfile):
             self.port = None
             self.fd = self.listen.fileno()
             return ''
+        if len(data) == 0:
+            # EOF, wait for another client
+            self.port.close()
+            self.port = None
+            self.fd = self.listen.fileno()
         return data
 
     def write(self, buf):
@@ -1286,7 +1771,10 @@ class mavlogfile(mavfile):
                 mode = 'ab'
             else:
                 mode = 'wb'
-        self.f = open(filename, mode)
+            self.f = open(filename, mode)
+        else:
+            # read the log in large chunks
+            self.f = io.open(filename, mode, buffering=READ_AHEAD_LEN)
         self.filesize = os.path.getsize(filename)
         self.percent = 0
         mavfile.__init__(self, None, filename, source_system=source_system, source_component=source_component, notimestamps=notimestamps, use_native=use_native)
@@ -1305,8 +1793,27 @@ class mavlogfile(mavfile):
     def recv(self,n=None):
         if n is None:
             n = self.mav.bytes_needed()
+        if not self.writeable and self.mav.buf_len() == 0:
+            # read a whole frame at once, rather than its header and then
+            # the rest
+            n = max(n, self._frame_length())
         return self.f.read(n)
 
+    def _frame_length(self):
+        '''length of the frame at the current position in the log, or 0 if
+        there isn't a frame marker there'''
+        head = bytearray(self.f.peek(3)[:3])
+        if len(head) < 3:
+            return 0
+        if head[0] == mavlink.PROTOCOL_MARKER_V2:
+            n = mavlink.HEADER_LEN_V2 + head[1] + 2
+            if head[2] & mavlink.MAVLINK_IFLAG_SIGNED:
+                n += mavlink.MAVLINK_SIGNATURE_BLOCK_LEN
+            return n
+        if head[0] == mavlink.PROTOCOL_MARKER_V1:
+            return mavlink.HEADER_LEN_V1 + head[1] + 2
+        return 0
+
     def write(self, buf):
         self.f.write(buf)
 
@@ -1364,13 +1871,25 @@ class mavlogfile(mavfile):
             self._last_timestamp = msg._timestamp
         msg._link = self._link
 
+    def recv_tuples(self, named=False):
+        '''iterate over the messages in the log as tuples, like
+        mavfile.recv_tuples(). The frames are between timestamps, so
+        messages are read with recv_msg() and converted'''
+        while True:
+            msg = self.recv_msg()
+            if msg is None:
+                return
+            if msg.get_type() != 'BAD_DATA':
+                yield msg.to_tuple(named)
+
 
 class mavmmaplog(mavlogfile):
     '''a MAVLink log file accessed via mmap. Used for fast read-only
     access with low memory overhead where particular message types are wanted'''
-    def __init__(self, filename, progress_callback=None):
+    def __init__(self, filename, progress_callback=None, use_index=False):
         import platform, mmap
         mavlogfile.__init__(self, filename)
+        self.use_index = use_index
         self.f.seek(0, 2)
         self.data_len = self.f.tell()
         self.f.seek(0)
@@ -1395,6 +1914,8 @@ class mavmmaplog(mavlogfile):
         
     def init_arrays(self, progress_callback=None):
         '''initialise arrays for fast recv_match()'''
+        if self.use_index and self.load_index():
+            return
 
         # dictionary indexed by msgid, mapping to arrays of file offsets where
         # each instance of a msg type is found
@@ -1457,6 +1978,43 @@ class mavmmaplog(mavlogfile):
             self._count += self.counts[mtype]
         self.offset = 0
         self._rewind()
+        if self.use_index:
+            mavindex.save_index(self.filename, 'mavmmaplog', self.index_info(), self.offsets)
+
+    def index_info(self):
+        '''information identifying the dialect a sidecar index was built with'''
+        return {'dialect': current_dialect,
+                'wire_protocol': mavlink.WIRE_PROTOCOL_VERSION}
+
+    def load_index(self):
+        '''load the arrays for init_arrays() from a sidecar index file,
+        returning False if there is no valid index'''
+        index = mavindex.load_index(self.filename, 'mavmmaplog')
+        if index is None:
+            return False
+        (info, offsets) = index
+        if info != self.index_info():
+            return False
+        for mtype in offsets:
+            if not mtype in mavlink.mavlink_map:
+                return False
+        self.offsets = offsets
+        self.counts = {}
+        self.name_to_id = {}
+        self.id_to_name = {}
+        self.type_nums = None
+        for mtype in offsets:
+            name = mavlink.mavlink_map[mtype].name
+            self.counts[mtype] = len(offsets[mtype])
+            self.name_to_id[name] = mtype
+            self.id_to_name[mtype] = name
+            # init_arrays() leaves the first message of each type in self.messages
+            self.f.seek(offsets[mtype][0])
+            self.messages[name] = self.recv_msg()
+        self._count = sum(self.counts.values())
+        self.offset = 0
+        self._rewind()
+        return True
 
     def skip_to_type(self, type):
         '''skip fwd to next msg matching given type set'''
@@ -1486,14 +2044,50 @@ class mavmmaplog(mavlogfile):
             self.offset = smallest_offset
             self.f.seek(smallest_offset)
 
-    def recv_match(self, condition=None, type=None, blocking=False, timeout=None):
+    def to_arrays(self, type):
+        '''return all messages of the given type as a dictionary of numpy
+        arrays, one per field, plus a '_timestamp' array. Frames with a
+        bad CRC are left out. Returns None if the type is not in the log'''
+        import numpy
+        if not type in self.name_to_id:
+            return None
+        frames = []
+        stamps = []
+        for ofs in self.offsets[self.name_to_id[type]]:
+            marker = u_ord(self.data_map[ofs+8])
+            flen = u_ord(self.data_map[ofs+9])
+            if marker == mavlink.PROTOCOL_MARKER_V2:
+                flen += mavlink.HEADER_LEN_V2 + 2
+                if u_ord(self.data_map[ofs+10]) & mavlink.MAVLINK_IFLAG_SIGNED:
+                    flen += mavlink.MAVLINK_SIGNATURE_BLOCK_LEN
+            else:
+                flen += mavlink.HEADER_LEN_V1 + 2
+            if ofs+8+flen > self.data_len:
+                continue
+            frames.append(self.data_map[ofs+8:ofs+8+flen])
+            stamps.append(struct.unpack_from('>Q', self.data_map, ofs)[0])
+        valid = self.mav.check_frames(frames)
+        records = self.mav.decode_array([f for (f, ok) in zip(frames, valid) if ok], check_crc=False)
+        if records is None:
+            return None
+        columns = {}
+        for name in records.dtype.names:
+            columns[name] = records[name]
+        stamps = numpy.array([t for (t, ok) in zip(stamps, valid) if ok], dtype=numpy.float64)
+        columns['_timestamp'] = stamps * 1.0e-6
+        return columns
+
+    def recv_match(self, condition=None, type=None, blocking=False, timeout=None, prefilter=False):
         '''recv the next message that matches the given condition
-        type can be a string or a list of strings'''
+        type can be a string or a list of strings. Other types are
+        always skipped without decoding, so prefilter is ignored'''
         if type is not None:
             if isinstance(type, str):
                 type = set([type])
             elif isinstance(type, list):
                 type = set(type)
+        if condition is not None:
+            condition = compile_expression(condition)
         while True:
             if type is not None:
                 self.skip_to_type(type)
@@ -1513,7 +2107,36 @@ class mavmmaplog(mavlogfile):
             if not evaluate_condition(condition, self.messages):
                 continue
             return m
-        
+
+    def iter_messages(self, types=None, condition=None, start=None, end=None, blocking=False, timeout=None):
+        '''generator yielding the messages that match the given types
+        and condition, see mavfile.iter_messages(). Other types are
+        skipped using the offset index without being decoded. The log
+        is mapped in full, so blocking and timeout are ignored'''
+        if types is not None and not isinstance(types, set):
+            if not isinstance(types, list):
+                types = [types]
+            types = set(types)
+        if condition is not None:
+            condition = compile_expression(condition)
+        recv_msg = self.recv_msg
+        skip_to_type = self.skip_to_type
+        while True:
+            if types is not None:
+                skip_to_type(types)
+            m = recv_msg()
+            if m is None:
+                return
+            if types is not None and not m.get_type() in types:
+                continue
+            if start is not None and m._timestamp < start:
+                continue
+            if end is not None and m._timestamp > end:
+                return
+            if condition is not None and not evaluate_condition(condition, self.messages):
+                continue
+            yield m
+
     def flightmode_list(self):
         '''return an array of tuples for all flightmodes in log. Tuple is (modestring, t0, t1)'''
         tstamp = None
@@ -1521,11 +2144,7 @@ class mavmmaplog(mavlogfile):
         if self._flightmodes is None:
             self._rewind()
             self._flightmodes = []
-            types = set(['HEARTBEAT'])
-            while True:
-                m = self.recv_match(type=types)
-                if m is None:
-                    break
+            for m in self.iter_messages(types=set(['HEARTBEAT'])):
                 tstamp = m._timestamp
                 if self.flightmode == fmode:
                     continue
@@ -1558,15 +2177,21 @@ class mavchildexec(mavfile):
         fcntl.fcntl(self.child.stdout.fileno(), fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
         mavfile.__init__(self, self.fd, filename, source_system=source_system, source_component=source_component, use_native=use_native)
+        self.read_ahead = READ_AHEAD_LEN
 
     def close(self):
         self.child.close()
 
     def recv(self,n=None):
+        if n is None:
+            n = self.mav.bytes_needed()
         try:
-            x = self.child.stdout.read(1)
+            x = self.child.stdout.read(n)
         except Exception:
             return ''
+        if x is None:
+            # nothing waiting on the non-blocking pipe
+            return ''
         return x
 
     def write(self, buf):
@@ -1578,10 +2203,18 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
                        robust_parsing=True, notimestamps=False, input=True,
                        dialect=None, autoreconnect=False, zero_time_base=False,
                        retries=3, use_native=default_native,
-                       force_connected=False, progress_callback=None):
-    '''open a serial, UDP, TCP or file mavlink connection'''
+                       force_connected=False, progress_callback=None,
+                       use_index=False, msgid_filter=None):
+    '''open a serial, UDP, TCP or file mavlink connection. If
+    msgid_filter is given only those message types (names or ids) are
+    decoded, see mavfile.set_msgid_filter()'''
     global mavfile_global
 
+    def filtered(m):
+        if msgid_filter is not None:
+            m.set_msgid_filter(msgid_filter)
+        return m
+
     if force_connected:
         # force_connected implies autoreconnect
         autoreconnect = True
@@ -1589,30 +2222,31 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
     if dialect is not None:
         set_dialect(dialect)
     if device.startswith('tcp:'):
-        return mavtcp(device[4:],
-                      autoreconnect=autoreconnect,
-                      source_system=source_system,
-                      source_component=source_component,
-                      retries=retries,
-                      use_native=use_native)
+        return filtered(mavtcp(device[4:],
+                               autoreconnect=autoreconnect,
+                               source_system=source_system,
+                               source_component=source_component,
+                               retries=retries,
+                               use_native=use_native))
     if device.startswith('tcpin:'):
-        return mavtcpin(device[6:], source_system=source_system, source_component=source_component, retries=retries, use_native=use_native)
+        return filtered(mavtcpin(device[6:], source_system=source_system, source_component=source_component, retries=retries, use_native=use_native))
     if device.startswith('udpin:'):
-        return mavudp(device[6:], input=True, source_system=source_system, source_component=source_component, use_native=use_native)
+        return filtered(mavudp(device[6:], input=True, source_system=source_system, source_component=source_component, use_native=use_native))
     if device.startswith('udpout:'):
-        return mavudp(device[7:], input=False, source_system=source_system, source_component=source_component, use_native=use_native)
+        return filtered(mavudp(device[7:], input=False, source_system=source_system, source_component=source_component, use_native=use_native))
     if device.startswith('udpbcast:'):
-        return mavudp(device[9:], input=False, source_system=source_system, source_component=source_component, use_native=use_native, broadcast=True)
+        return filtered(mavudp(device[9:], input=False, source_system=source_system, source_component=source_component, use_native=use_native, broadcast=True))
     # For legacy purposes we accept the following syntax and let the caller to specify direction
     if device.startswith('udp:'):
-        return mavudp(device[4:], input=input, source_system=source_system, source_component=source_component, use_native=use_native)
+        return filtered(mavudp(device[4:], input=input, source_system=source_system, source_component=source_component, use_native=use_native))
     if device.startswith('mcast:'):
-        return mavmcast(device[6:], source_system=source_system, source_component=source_component, use_native=use_native)
+        return filtered(mavmcast(device[6:], source_system=source_system, source_component=source_component, use_native=use_native))
 
     if device.lower().endswith('.bin') or device.lower().endswith('.px4log'):
         # support dataflash logs
         from pymavlink import DFReader
-        m = DFReader.DFReader_binary(device, zero_time_base=zero_time_base, progress_callback=progress_callback)
+        m = DFReader.DFReader_binary(device, zero_time_base=zero_time_base, progress_callback=progress_callback,
+                                     use_index=use_index)
         mavfile_global = m
         return m
 
@@ -1628,24 +2262,24 @@ def mavlink_connection(device, baud=115200, source_system=255, source_component=
     logsuffixes = ['mavlink', 'log', 'raw', 'tlog' ]
     suffix = device.split('.')[-1].lower()
     if device.find(':') != -1 and not suffix in logsuffixes:
-        return mavudp(device, source_system=source_system, source_component=source_component, input=input, use_native=use_native)
+        return filtered(mavudp(device, source_system=source_system, source_component=source_component, input=input, use_native=use_native))
     if os.path.isfile(device):
         if device.endswith(".elf") or device.find("/bin/") != -1:
             print("executing '%s'" % device)
-            return mavchildexec(device, source_system=source_system, source_component=source_component, use_native=use_native)
+            return filtered(mavchildexec(device, source_system=source_system, source_component=source_component, use_native=use_native))
         elif not write and not append and not notimestamps:
-            return mavmmaplog(device, progress_callback=progress_callback)
+            return filtered(mavmmaplog(device, progress_callback=progress_callback, use_index=use_index))
         else:
-            return mavlogfile(device, planner_format=planner_format, write=write,
-                              append=append, robust_parsing=robust_parsing, notimestamps=notimestamps,
-                              source_system=source_system, source_component=source_component, use_native=use_native)
-    return mavserial(device,
-                     baud=baud,
-                     source_system=source_system,
-                     source_component=source_component,
-                     autoreconnect=autoreconnect,
-                     use_native=use_native,
-                     force_connected=force_connected)
+            return filtered(mavlogfile(device, planner_format=planner_format, write=write,
+                                       append=append, robust_parsing=robust_parsing, notimestamps=notimestamps,
+                                       source_system=source_system, source_component=source_component, use_native=use_native))
+    return filtered(mavserial(device,
+                              baud=baud,
+                              source_system=source_system,
+                              source_component=source_component,
+                              autoreconnect=autoreconnect,
+                              use_native=use_native,
+                              force_connected=force_connected))
 
 class periodic_event(object):
     '''a class for fixed frequency events'''
@@ -1671,6 +2305,235 @@ class periodic_event(object):
         return False
 
 
+class _hub_link(object):
+    '''the state mavhub keeps for each link'''
+    def __init__(self, link, handler, route, decode):
+        self.link = link
+        self.handler = handler
+        self.route = route
+        self.decode = decode
+        self.fd = link.fd
+        self.datagram = isinstance(link, (mavudp, mavmcast))
+        # sysid -> set of compids heard on this link
+        self.systems = {}
+        # undecoded bytes, when not decoding
+        self.buf = bytearray()
+
+class mavhub(object):
+    '''wait on any number of mavlink connections at once, waking only
+    when one of them has data. Each link that is ready is drained of all
+    the messages waiting on it, which are passed to its handler as
+    handler(link, msg). The handler is called with a msg of None when
+    its link closes, after the link has been removed from the hub.
+
+    Links added with route=True forward frames to each other, following
+    the MAVLink routing rules. Frames with no target system, or a target
+    system of 0, go to all the other routed links. Other frames only go
+    to the links their target has been heard on. Frames are forwarded
+    as received, the target is read straight from the payload. Links
+    added with decode=False are only routed: their frames are checked
+    and forwarded but never decoded, and don't reach post_message().
+
+    Needs the selectors module from python 3.4 or later, and links with
+    a file descriptor, which rules out serial ports on Windows'''
+    def __init__(self):
+        import selectors
+        self.EVENT_READ = selectors.EVENT_READ
+        self.selector = selectors.DefaultSelector()
+        self.links = {}
+        self.running = False
+        self.target_offsets = {}
+
+    def add(self, link, handler=None, route=False, decode=True):
+        '''add a link, with a handler for its messages'''
+        if link.fd is None:
+            raise ValueError("%s has no file descriptor to wait on" % link.address)
+        if not decode and not route:
+            raise ValueError("a link that is not decoded must be routed")
+        state = _hub_link(link, handler, route, decode)
+        self.links[link] = state
+        self.selector.register(state.fd, self.EVENT_READ, state)
+
+    def remove(self, link):
+        '''remove a link. The link is not closed'''
+        state = self.links.pop(link, None)
+        if state is not None:
+            self.selector.unregister(state.fd)
+
+    def poll(self, timeout=None):
+        '''wait up to timeout seconds for data on any link, then handle
+        everything that has arrived. Returns the number of messages'''
+        count = 0
+        for (key, events) in self.selector.select(timeout):
+            count += self.drain(key.data)
+        return count
+
+    def run(self, timeout=None, idle=None):
+        '''handle messages until stop() is called or no links are left.
+        If given, idle() is called after each wait for data, which lasts
+        at most timeout seconds'''
+        self.running = True
+        while self.running and self.links:
+            self.poll(timeout)
+            if idle is not None:
+                idle()
+
+    def stop(self):
+        '''make run() return'''
+        self.running = False
+
+    def close(self):
+        '''close the selector. The links are not closed'''
+        self.selector.close()
+        self.links = {}
+
+    def drain(self, state):
+        '''handle everything waiting on a link'''
+        link = state.link
+        count = 0
+        if state.decode:
+            received = link.mav.total_bytes_received
+            for m in link.recv_many():
+                if self.links.get(link) is not state:
+                    break
+                count += 1
+                if state.route and m.get_type() != 'BAD_DATA':
+                    self.forward(state, m.get_msgbuf())
+                if state.handler is not None:
+                    state.handler(link, m)
+            got_data = link.mav.total_bytes_received != received
+        else:
+            got_data = False
+            while self.links.get(link) is state:
+                s = link.recv(UDP_MAX_PACKET_LEN)
+                if len(s) == 0:
+                    break
+                got_data = True
+                state.buf.extend(s)
+                for msgbuf in self.split_frames(state):
+                    count += 1
+                    self.forward(state, msgbuf)
+        if self.links.get(link) is not state:
+            return count
+        if link.fd != state.fd:
+            # reconnected, or a TCP server gained or lost its client
+            self.selector.unregister(state.fd)
+            state.fd = link.fd
+            if state.fd is None:
+                self.closed(state)
+            else:
+                self.selector.register(state.fd, self.EVENT_READ, state)
+        elif not got_data and not state.datagram:
+            # readable with nothing to read is end of file
+            self.closed(state)
+        return count
+
+    def closed(self, state):
+        '''remove a link that has closed and tell its handler'''
+        self.links.pop(state.link, None)
+        if state.fd is not None:
+            self.selector.unregister(state.fd)
+        if state.handler is not None:
+            state.handler(state.link, None)
+
+    def split_frames(self, state):
+        '''split the complete frames out of the data received on an
+        undecoded link. Frames that fail the CRC check, including frames
+        of message types the dialect doesn't know, are dropped'''
+        buf = state.buf
+        mav = state.link.mav
+        frames = []
+        i = 0
+        n = len(buf)
+        while i < n:
+            if buf[i] == mavlink.PROTOCOL_MARKER_V2:
+                if n - i < mavlink.HEADER_LEN_V2:
+                    break
+                flen = mavlink.HEADER_LEN_V2 + buf[i+1] + 2
+                if buf[i+2] & mavlink.MAVLINK_IFLAG_SIGNED:
+                    flen += mavlink.MAVLINK_SIGNATURE_BLOCK_LEN
+            elif buf[i] == mavlink.PROTOCOL_MARKER_V1:
+                if n - i < mavlink.HEADER_LEN_V1:
+                    break
+                flen = mavlink.HEADER_LEN_V1 + buf[i+1] + 2
+            else:
+                # skip to the next byte that could start a frame
+                j = buf.find(b'\xfe', i, n)
+                k = buf.find(b'\xfd', i, n)
+                if j == -1 or (k != -1 and k < j):
+                    j = k
+                i = n if j == -1 else j
+                continue
+            if n - i < flen:
+                break
+            frame = buf[i:i+flen]
+            if mav.check_frames([frame])[0]:
+                frames.append(frame)
+                i += flen
+            else:
+                i += 1
+        del buf[:i]
+        return frames
+
+    def forward(self, state, msgbuf):
+        '''note where the sender of a frame is, then send the frame on to
+        the other routed links its target can be reached through'''
+        if msgbuf[0] == mavlink.PROTOCOL_MARKER_V2:
+            hlen = mavlink.HEADER_LEN_V2
+            (src_system, src_component) = (msgbuf[5], msgbuf[6])
+            msgId = msgbuf[7] | (msgbuf[8]<<8) | (msgbuf[9]<<16)
+        else:
+            hlen = mavlink.HEADER_LEN_V1
+            (src_system, src_component) = (msgbuf[3], msgbuf[4])
+            msgId = msgbuf[5]
+        components = state.systems.get(src_system)
+        if components is None:
+            state.systems[src_system] = set([src_component])
+        else:
+            components.add(src_component)
+
+        # MAVLink2 trims trailing zeros from payloads, so a target past
+        # the end of the payload is 0
+        plen = msgbuf[1]
+        (system_ofs, component_ofs) = self.get_target_offsets(msgId)
+        target_system = 0
+        target_component = 0
+        if system_ofs is not None and system_ofs < plen:
+            target_system = msgbuf[hlen+system_ofs]
+        if component_ofs is not None and component_ofs < plen:
+            target_component = msgbuf[hlen+component_ofs]
+
+        for other in self.links.values():
+            if other is state or not other.route:
+                continue
+            if target_system != 0:
+                components = other.systems.get(target_system)
+                if components is None:
+                    continue
+                if target_component != 0 and not target_component in components:
+                    continue
+            other.link.write(msgbuf)
+
+    def get_target_offsets(self, msgId):
+        '''offsets into the payload of the target_system and
+        target_component fields of a message type, None for fields it
+        doesn't have'''
+        ret = self.target_offsets.get(msgId)
+        if ret is not None:
+            return ret
+        ret = (None, None)
+        if msgId in mavlink.mavlink_map:
+            cls = mavlink.mavlink_map[msgId]
+            offsets = {}
+            ofs = 0
+            for (name, fmt) in zip(cls.ordered_fieldnames, re.findall(r'\d*[a-zA-Z]', cls.format[1:])):
+                offsets[name] = ofs
+                ofs += struct.calcsize('<' + fmt)
+            ret = (offsets.get('target_system'), offsets.get('target_component'))
+        self.target_offsets[msgId] = ret
+        return ret
+
+
 try:
     from curses import ascii
     have_ascii = True
@@ -2091,27 +2954,6 @@ def mode_string_acm(mode_number):
         return mode_mapping_acm[mode_number]
     return "Mode(%u)" % mode_number
 
-class x25crc(object):
-    '''x25 CRC - based on checksum.h from mavlink library'''
-    def __init__(self, buf=''):
-        self.crc = 0xffff
-        self.accumulate(buf)
-
-    def accumulate(self, buf):
-        '''add in some more bytes'''
-        byte_buf = array.array('B')
-        if isinstance(buf, array.array):
-            byte_buf.extend(buf)
-        else:
-            byte_buf.fromstring(buf)
-        accum = self.crc
-        for b in byte_buf:
-            tmp = b ^ (accum & 0xff)
-            tmp = (tmp ^ (tmp<<4)) & 0xFF
-            accum = (accum>>8) ^ (tmp<<8) ^ (tmp<<3) ^ (tmp>>4)
-            accum = accum & 0xFFFF
-        self.crc = accum
-
 class MavlinkSerialPort(object):
         '''an object that looks like a serial port, but
         transmits using mavlink SERIAL_CONTROL packets'''
@@ -44,6 +44,8 @@ def generate_content():
     v20_dialects = glob.glob(os.path.join(mdef_path, 'v1.0', '*.xml'))
 
     should_generate = not "NOGEN" in os.environ
+    # MAVLINK_LAZY builds dialects that define their message classes on first use
+    lazy = "MAVLINK_LAZY" in os.environ
     if should_generate:
         if len(v10_dialects) == 0:
             print("No XML message definitions found")
@@ -60,7 +62,7 @@ def generate_content():
             if not fnmatch.fnmatch(dialect, wildcard):
                 continue
             print("Building %s for protocol 1.0" % xml)
-            if not mavgen.mavgen_python_dialect(dialect, mavparse.PROTOCOL_1_0):
+            if not mavgen.mavgen_python_dialect(dialect, mavparse.PROTOCOL_1_0, lazy=lazy):
                 print("Building failed %s for protocol 1.0" % xml)
                 sys.exit(1)
 
@@ -70,7 +72,7 @@ def generate_content():
             if not fnmatch.fnmatch(dialect, wildcard):
                 continue
             print("Building %s for protocol 2.0" % xml)
-            if not mavgen.mavgen_python_dialect(dialect, mavparse.PROTOCOL_2_0):
+            if not mavgen.mavgen_python_dialect(dialect, mavparse.PROTOCOL_2_0, lazy=lazy):
                 print("Building failed %s for protocol 2.0" % xml)
                 sys.exit(1)
 
@@ -79,7 +81,6 @@ if platform.system() != 'Windows':
     extensions = [ Extension('mavnative',
                    sources=['mavnative/mavnative.c'],
                    include_dirs=[
-                       'generator/C/include_v1.0',
                        'generator/C/include_v2.0',
                        'mavnative'
                        ]
@@ -95,6 +96,13 @@ class custom_build_py(build_py):
         # distutils uses old-style classes, so no super()
         build_py.run(self)
 
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            # mavasync uses async/await, which older pythons can't compile
+            modules = [m for m in modules if m[:2] != ('pymavlink', 'mavasync')]
+        return modules
+
 
 setup (name = 'pymavlink',
        version = version,
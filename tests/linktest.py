@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+
+"""
+Shared setup for the unit tests that talk over MAVLink2 links
+"""
+
+import os
+
+from pymavlink import mavutil
+
+
+class LinkTest(object):
+
+    """
+    Mixin for unittest.TestCase that switches mavutil to MAVLink2 for
+    the duration of each test, and closes the connections it made
+    """
+
+    def setUp(self):
+        self.saved_mavlink20 = os.environ.get('MAVLINK20')
+        os.environ['MAVLINK20'] = '1'
+        mavutil.set_dialect(mavutil.current_dialect)
+        self.links = []
+
+    def tearDown(self):
+        for link in self.links:
+            link.close()
+        if self.saved_mavlink20 is None:
+            del os.environ['MAVLINK20']
+        else:
+            os.environ['MAVLINK20'] = self.saved_mavlink20
+        mavutil.set_dialect(mavutil.current_dialect)
+
+    def open(self, device, **kwargs):
+        '''open a connection'''
+        return mavutil.mavlink_connection(device, **kwargs)
+
+    def connect(self, device, **kwargs):
+        '''open a connection, closed again in tearDown'''
+        link = self.open(device, **kwargs)
+        self.links.append(link)
+        return link
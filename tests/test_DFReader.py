@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the DFReader library
+"""
+
+from __future__ import print_function
+import unittest
+import os
+import struct
+import tempfile
+
+import numpy
+
+from pymavlink import DFReader
+from pymavlink import mavindex
+
+
+def fmt_record(mtype, length, name, format, columns):
+    '''build a FMT record'''
+    return struct.pack('<BBBBB4s16s64s', 0xA3, 0x95, 0x80, mtype, length,
+                       name.encode('ascii'), format.encode('ascii'),
+                       columns.encode('ascii'))
+
+
+def write_test_log(filename):
+    '''write a small binary dataflash log'''
+    log = fmt_record(0x80, 89, 'FMT', 'BBnNZ', 'Type,Length,Name,Format,Columns')
+    log += fmt_record(0x81, 3+24, 'IMU', 'QfffI', 'TimeUS,GyrX,GyrY,GyrZ,Status')
+    log += fmt_record(0x82, 3+8+2+4+4+64, 'SCL', 'QcLna', 'TimeUS,Alt,Lat,Id,Data')
+    for i in range(20):
+        log += struct.pack('<BBBQfffI', 0xA3, 0x95, 0x81, 1000000 + i*2500,
+                           i*0.5, -i*0.25, 3.0, i)
+        if i % 4 == 0:
+            data = struct.pack('<32h', *[i-j for j in range(32)])
+            log += struct.pack('<BBBQhi4s64s', 0xA3, 0x95, 0x82, 1000000 + i*2500,
+                               -150*i, 350000000 + i, b'AB', data)
+    with open(filename, 'wb') as f:
+        f.write(log)
+
+
+class DFReaderArraysTest(unittest.TestCase):
+
+    """
+    Class to test DFReader_binary.to_arrays
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+        write_test_log(self.filename)
+        self.log = DFReader.DFReader_binary(self.filename)
+
+    def tearDown(self):
+        self.log.filehandle.close()
+        os.remove(self.filename)
+
+    def messages(self, type):
+        '''all messages of a type, read via recv_match'''
+        self.log.rewind()
+        ret = []
+        while True:
+            m = self.log.recv_match(type=type)
+            if m is None:
+                break
+            ret.append(m)
+        self.log.rewind()
+        return ret
+
+    def test_columns(self):
+        """Test to_arrays matches recv_match for plain columns"""
+        cols = self.log.to_arrays('IMU')
+        msgs = self.messages('IMU')
+        assert len(cols['TimeUS']) == len(msgs) == 20
+        for i in range(len(msgs)):
+            assert cols['TimeUS'][i] == msgs[i].TimeUS
+            assert cols['GyrY'][i] == msgs[i].GyrY
+            assert cols['Status'][i] == msgs[i].Status
+            assert cols['_timestamp'][i] == msgs[i]._timestamp
+
+    def test_multipliers(self):
+        """Test to_arrays applies multipliers and expands arrays"""
+        cols = self.log.to_arrays('SCL')
+        msgs = self.messages('SCL')
+        assert len(cols['Alt']) == len(msgs) == 5
+        for i in range(len(msgs)):
+            assert abs(cols['Alt'][i] - msgs[i].Alt) < 1.0e-9
+            assert abs(cols['Lat'][i] - msgs[i].Lat) < 1.0e-9
+            assert cols['Id'][i] == b'AB'
+            assert list(cols['Data'][i]) == list(msgs[i].Data)
+        raw = self.log.to_arrays('SCL', apply_multiplier=False)
+        assert raw['Alt'].dtype == numpy.int16
+
+    def test_unknown_type(self):
+        """Test to_arrays on a type not in the log"""
+        assert self.log.to_arrays('NOTHERE') is None
+
+
+class DFReaderIndexTest(unittest.TestCase):
+
+    """
+    Class to test the DFReader_binary sidecar index
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+        write_test_log(self.filename)
+
+    def tearDown(self):
+        for f in [self.filename, mavindex.index_filename(self.filename)]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_index(self):
+        """Test reopening a log with a sidecar index"""
+        log1 = DFReader.DFReader_binary(self.filename, use_index=True)
+        assert os.path.exists(mavindex.index_filename(self.filename))
+        log2 = DFReader.DFReader_binary(self.filename, use_index=True)
+        assert log2.load_index()
+        assert log2.offsets == log1.offsets
+        assert log2.counts == log1.counts
+        assert log2.name_to_id == log1.name_to_id
+        assert sorted(log2.messages.keys()) == sorted(log1.messages.keys())
+        assert log2.messages['IMU'].GyrX == log1.messages['IMU'].GyrX
+        assert log2.recv_match(type='SCL').Alt == log1.recv_match(type='SCL').Alt
+        log1.filehandle.close()
+        log2.filehandle.close()
+
+    def test_stale_index(self):
+        """Test an index is ignored once the log changes"""
+        log = DFReader.DFReader_binary(self.filename, use_index=True)
+        log.filehandle.close()
+        with open(self.filename, 'ab') as f:
+            f.write(struct.pack('<BBBQfffI', 0xA3, 0x95, 0x81, 2000000, 0, 0, 0, 0))
+        log = DFReader.DFReader_binary(self.filename, use_index=True)
+        assert log.counts[0x81] == 21
+        log.filehandle.close()
+
+
+class DFReaderIterTest(unittest.TestCase):
+
+    """
+    Class to test DFReader.iter_messages
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+        write_test_log(self.filename)
+        self.log = DFReader.DFReader_binary(self.filename)
+
+    def tearDown(self):
+        self.log.filehandle.close()
+        os.remove(self.filename)
+
+    def test_types(self):
+        """Test iter_messages gives the same messages as recv_match"""
+        msgs = []
+        while True:
+            m = self.log.recv_match(type=['IMU', 'SCL'])
+            if m is None:
+                break
+            msgs.append(m)
+        self.log.rewind()
+        it = list(self.log.iter_messages(types=['IMU', 'SCL']))
+        assert len(it) == len(msgs) == 25
+        for (m1, m2) in zip(it, msgs):
+            assert m1.get_type() == m2.get_type()
+            assert m1.TimeUS == m2.TimeUS
+        self.log.rewind()
+        assert len(list(self.log.iter_messages(types='SCL'))) == 5
+
+    def test_bounds(self):
+        """Test iter_messages with start, end and a condition"""
+        msgs = list(self.log.iter_messages(types='IMU'))
+        start = msgs[5]._timestamp
+        end = msgs[14]._timestamp
+        self.log.rewind()
+        it = list(self.log.iter_messages(types='IMU', start=start, end=end))
+        assert [m.Status for m in it] == list(range(5, 15))
+        self.log.rewind()
+        it = self.log.iter_messages(types='IMU', condition='IMU.Status % 2 == 0')
+        # generators chain into further stages
+        status = [m.Status for m in it if m.Status > 10]
+        assert status == [12, 14, 16, 18]
+
+
+if __name__ == '__main__':
+    unittest.main()
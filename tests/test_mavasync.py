@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the mavasync asyncio connections
+"""
+
+from __future__ import print_function
+import unittest
+
+from linktest import LinkTest
+
+try:
+    import asyncio
+    from pymavlink import mavasync
+except (ImportError, SyntaxError):
+    mavasync = None
+
+
+@unittest.skipIf(mavasync is None, "needs python 3.5 or later")
+class MavasyncTest(LinkTest, unittest.TestCase):
+
+    """
+    Class to test mavasync over UDP and TCP on the loopback interface
+    """
+
+    def setUp(self):
+        super(MavasyncTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        for c in self.links:
+            c.close()
+        self.links = []
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super(MavasyncTest, self).tearDown()
+
+    def open(self, device, **kwargs):
+        '''open an asyncio connection'''
+        return self.loop.run_until_complete(mavasync.mavlink_connection(device, **kwargs))
+
+    def wait(self, coro):
+        '''run a coroutine to completion'''
+        return self.loop.run_until_complete(coro)
+
+    def test_udp(self):
+        """Test heartbeats, replies and iteration over UDP"""
+        server = self.connect('udpin:127.0.0.1:0')
+        port = server.transport.get_extra_info('sockname')[1]
+        client = self.connect('udpout:127.0.0.1:%u' % port, source_system=7)
+        for i in range(3):
+            client.mav.heartbeat_send(2, 3, 0, 0, 0)
+        m = self.wait(server.wait_heartbeat(timeout=2))
+        assert m is not None and m.get_srcSystem() == 7
+        assert server.target_system == 7
+        assert 'HEARTBEAT' in server.messages
+
+        # replies go back to the address last heard from
+        server.mav.ping_send(1, 2, 3, 4)
+        m = self.wait(client.recv_match(type='PING', timeout=2))
+        assert m is not None and m.seq == 2
+
+        # the other heartbeats are still queued for async iteration
+        assert self.wait(server.__anext__()).get_type() == 'HEARTBEAT'
+        assert self.wait(server.__anext__()).get_type() == 'HEARTBEAT'
+        assert self.wait(server.recv_match(type='PING', timeout=0.1)) is None
+        assert self.wait(server.recv_match(blocking=False)) is None
+
+    def test_tcp(self):
+        """Test a TCP client and server, and closing the connection"""
+        server = self.connect('tcpin:127.0.0.1:0')
+        port = server.server.sockets[0].getsockname()[1]
+        client = self.connect('tcp:127.0.0.1:%u' % port, source_system=9)
+        client.mav.heartbeat_send(2, 3, 0, 0, 0)
+        m = self.wait(server.wait_heartbeat(timeout=2))
+        assert m is not None and m.get_srcSystem() == 9
+        server.mav.ping_send(1, 2, 3, 4)
+        assert self.wait(client.recv_match(type='PING', timeout=2)) is not None
+        client.close()
+        assert self.wait(client.recv_msg()) is None
+
+    def test_queue_limit(self):
+        """Test the oldest messages are dropped when the queue is full"""
+        server = self.connect('udpin:127.0.0.1:0', max_queue=5)
+        port = server.transport.get_extra_info('sockname')[1]
+        client = self.connect('udpout:127.0.0.1:%u' % port)
+        for i in range(8):
+            client.mav.ping_send(0, i, 0, 0)
+        self.wait(asyncio.sleep(0.2))
+        assert server.queue_dropped == 3
+        assert [m.seq for m in server.queue] == [3, 4, 5, 6, 7]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the mavcrc library
+"""
+
+from __future__ import print_function
+import unittest
+import array
+import struct
+
+from pymavlink.generator import mavcrc
+
+class X25CRCTest(unittest.TestCase):
+
+    """
+    Class to test x25crc
+    """
+
+    def test_check_value(self):
+        """Test the CRC of the standard check string"""
+        assert mavcrc.x25crc(b'123456789').crc == 0x6F91
+        assert mavcrc.x25crc('123456789').crc == 0x6F91
+        assert mavcrc.x25crc(bytearray(b'123456789')).crc == 0x6F91
+        assert mavcrc.x25crc(array.array('B', b'123456789')).crc == 0x6F91
+
+    def test_accumulate(self):
+        """Test accumulating in pieces gives the same CRC"""
+        crc = mavcrc.x25crc(b'1234')
+        crc.accumulate_str('56')
+        crc.accumulate(bytearray(b'789'))
+        assert crc.crc == 0x6F91
+        crc = mavcrc.x25crc(b'1234')
+        crc.accumulate('56789')
+        assert crc.crc == 0x6F91
+
+    def test_frames(self):
+        """Test checking many frames from one buffer"""
+        buf = bytearray()
+        frames = []
+        for i in range(10):
+            start = len(buf)
+            body = bytearray([i] * (i + 5))
+            crc = mavcrc.x25crc(body)
+            crc.accumulate((50 + i,))
+            buf += body + struct.pack('<H', crc.crc)
+            frames.append((start, start + len(body), 50 + i))
+        assert mavcrc.x25crc_frames(buf, frames) == [True] * 10
+        frames[3] = (frames[3][0], frames[3][1], 0)
+        buf[0] ^= 1
+        assert mavcrc.x25crc_frames(buf, frames) == [False, True, True, False] + [True] * 6
+
+if __name__ == '__main__':
+    unittest.main()
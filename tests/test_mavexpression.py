@@ -9,6 +9,8 @@ from __future__ import print_function
 import unittest
 import random
 
+import numpy
+
 from pymavlink import mavexpression
 
 class ExpressionTest(unittest.TestCase):
@@ -42,5 +44,112 @@ class ExpressionTest(unittest.TestCase):
         assert mavexpression.evaluate_expression('kmh(10)', {}) == 36
         assert mavexpression.evaluate_expression('angle_diff(170, -90)', {}) == -100
         
+    def test_compiled(self):
+        """Test compile_expression and the dependencies it finds"""
+        expr = mavexpression.compile_expression('sqrt(IMU.AccX**2+IMU.AccY**2) + DCM_update(IMU, ATT).x')
+        assert expr.message_types == set(['IMU', 'ATT'])
+        assert expr.fields == set([('IMU', 'AccX'), ('IMU', 'AccY')])
+        assert mavexpression.compile_expression(expr.expression) is expr
+        assert mavexpression.compile_expression(expr) is expr
+        expr = mavexpression.compile_expression('lat*(180/pi) + speed')
+        assert expr.message_types == set(['lat', 'speed'])
+        assert abs(expr.evaluate(self.varsDict) - (5.67*57.29577951308232 + 8)) < 1.0e-9
+        assert expr.evaluate({}) is None
+        assert mavexpression.compile_expression('4/0').evaluate({}) is None
+
+    def test_folding(self):
+        """Test constant sub-expressions are folded at compile time"""
+        expr = mavexpression.compile_expression('speed * (180/3.5) + radians(90) - 2**3')
+        consts = [c for c in expr.code.co_consts if isinstance(c, (int, float)) and not isinstance(c, bool)]
+        assert sorted(consts) == [8, 180/3.5, 90]
+        assert abs(expr.evaluate(self.varsDict) - (8*180/3.5 + 3.141592653589793/2 - 8)) < 1.0e-9
+
+    def test_shadowing(self):
+        """Test variables replace maths constants and functions"""
+        assert mavexpression.evaluate_expression('e + 1', {'e': 5}) == 6
+        assert mavexpression.evaluate_expression('pi * 2', {'pi': 3}) == 6
+        assert mavexpression.evaluate_expression('radians(90)', {'radians': lambda x: x + 1}) == 91
+        assert abs(mavexpression.evaluate_expression('e + 1', {}) - 3.718281828459045) < 1.0e-9
+
+class ColumnsTest(unittest.TestCase):
+
+    """
+    Class to test evaluate_columns
+    """
+
+    def setUp(self):
+        self.columns = {
+            'A': {'_timestamp': numpy.arange(10) * 1.0,
+                  'x': numpy.arange(10, dtype=numpy.float32) * 50},
+            'B': {'_timestamp': numpy.arange(4) * 3.0 + 0.5,
+                  'y': numpy.array([1, -2, 3, -4])}}
+
+    def scalar(self, expression):
+        """evaluate row by row, holding the latest row of each type"""
+        events = []
+        for t in self.columns:
+            for i in range(len(self.columns[t]['_timestamp'])):
+                events.append((self.columns[t]['_timestamp'][i], t, i))
+        events.sort()
+        expr = mavexpression.compile_expression(expression)
+        vars = {}
+        ret = []
+        for (stamp, t, i) in events:
+            row = mavexpression._Row(t, {})
+            for f in self.columns[t]:
+                setattr(row, f, self.columns[t][f][i].item())
+            vars[t] = row
+            if not t in expr.message_types:
+                continue
+            v = expr.evaluate(vars)
+            if v is not None:
+                ret.append((stamp, v))
+        return ret
+
+    def test_vector(self):
+        """Test column evaluation matches evaluating each row"""
+        for e in ['sqrt(A.x**2 + B.y**2)', 'degrees(A.x) * kmh(B.y)', 'A.x > B.y', 'A.x / (B.y + 1)']:
+            expr = mavexpression.compile_expression(e)
+            assert expr.vectorisable()
+            (stamps, values) = expr.evaluate_columns(self.columns)
+            assert list(zip(stamps.tolist(), values.tolist())) == self.scalar(e)
+
+    def test_fallback(self):
+        """Test expressions that can't be vectorised are evaluated per row"""
+        for e in ['wrap_180(A.x)', 'A.x if B.y > 0 else -A.x', 'B.y > 0 and A.x > 100']:
+            expr = mavexpression.compile_expression(e)
+            assert not expr.vectorisable()
+            (stamps, values) = expr.evaluate_columns(self.columns)
+            assert list(zip(stamps.tolist(), values.tolist())) == self.scalar(e)
+        (stamps, values) = mavexpression.compile_expression('A.x + C.z').evaluate_columns(self.columns)
+        assert len(stamps) == 0
+
+    def test_equal_timestamps(self):
+        """Test each row is evaluated once when timestamps are equal"""
+        self.columns = {
+            'A': {'_timestamp': numpy.array([1.0, 2, 2, 3]), 'x': numpy.array([10, 20, 21, 30])},
+            'B': {'_timestamp': numpy.array([2.0, 3]), 'y': numpy.array([1, 2])}}
+        (stamps, values) = mavexpression.compile_expression('A.x').evaluate_columns(self.columns)
+        assert stamps.tolist() == [1, 2, 2, 3] and values.tolist() == [10, 20, 21, 30]
+        # as used by mavsearch to skip logs
+        assert mavexpression.compile_expression('A.x == 20').evaluate_columns(self.columns)[1].any()
+        for e in ['A.x + B.y', 'A.x if B.y > 1 else -A.x']:
+            (stamps, values) = mavexpression.compile_expression(e).evaluate_columns(self.columns)
+            assert list(zip(stamps.tolist(), values.tolist())) == self.scalar(e)
+
+    def test_non_finite(self):
+        """Test NaN and infinite values are kept, and division by zero left out"""
+        self.columns['A']['x'][2] = numpy.nan
+        self.columns['A']['x'][5] = numpy.inf
+        for e in ['A.x', 'A.x * 2 + B.y', 'A.x / (B.y - 1)', 'B.y % (A.x - 50)', 'A.x // 0']:
+            (stamps, values) = mavexpression.compile_expression(e).evaluate_columns(self.columns)
+            # repr so NaN compares equal to NaN
+            assert repr(list(zip(stamps.tolist(), values.tolist()))) == repr(self.scalar(e))
+        (stamps, values) = mavexpression.compile_expression('A.x').evaluate_columns(self.columns)
+        assert len(values) == 10
+        # as used by mavsearch to skip logs
+        assert mavexpression.compile_expression('A.x != A.x').evaluate_columns(self.columns)[1].any()
+        assert mavexpression.compile_expression('A.x > 1e30').evaluate_columns(self.columns)[1].any()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the mavextra_np library
+"""
+
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from pymavlink import mavextra
+from pymavlink import mavextra_np
+
+
+class Msg(object):
+    '''a message with the given fields'''
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MavextraNumpyTest(unittest.TestCase):
+
+    """
+    Class to test the numpy mavextra functions against the scalar ones
+    """
+
+    N = 50
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        n = self.N
+        self.columns = {
+            'RAW_IMU': {'xmag': rng.randint(-500, 500, n), 'ymag': rng.randint(-500, 500, n),
+                        'zmag': rng.randint(-500, 500, n), 'xacc': rng.randint(-1000, 1000, n),
+                        'yacc': rng.randint(-1000, 1000, n), 'zacc': rng.randint(-1000, 1000, n),
+                        'xgyro': rng.randint(-100, 100, n), 'ygyro': rng.randint(-100, 100, n),
+                        'zgyro': rng.randint(-100, 100, n)},
+            'ATTITUDE': {'roll': rng.uniform(-1, 1, n), 'pitch': rng.uniform(-1, 1, n),
+                         'yaw': rng.uniform(-3, 3, n)},
+            'SENSOR_OFFSETS': {'mag_ofs_x': rng.randint(-50, 50, n), 'mag_ofs_y': rng.randint(-50, 50, n),
+                               'mag_ofs_z': rng.randint(-50, 50, n)},
+            'SCALED_PRESSURE': {'press_abs': rng.uniform(900, 1020, n)},
+            'VFR_HUD': {'airspeed': rng.uniform(0, 30, n)},
+            'GLOBAL_POSITION_INT': {'vx': rng.randint(-2000, 2000, n), 'vy': rng.randint(-2000, 2000, n),
+                                    'vz': rng.randint(-500, 500, n)},
+            'GPS_RAW_INT': {'lat': rng.randint(-350000000, -340000000, n), 'lon': rng.randint(1490000000, 1500000000, n),
+                            'alt': rng.randint(0, 100000, n), 'cog': rng.randint(0, 36000, n),
+                            'vel': rng.randint(0, 3000, n)},
+            'GPS': {'Lat': rng.uniform(-35.4, -35.3, n), 'Lng': rng.uniform(149.1, 149.2, n),
+                    'Alt': rng.uniform(500, 600, n)},
+        }
+
+    def messages(self, type, i):
+        '''row i of a message type as a scalar message'''
+        fields = {}
+        for (name, values) in self.columns[type].items():
+            fields[name] = values[i].item()
+        return Msg(**fields)
+
+    def check(self, scalar, vector, types, to_list=lambda v: v, **kwargs):
+        '''check a numpy function matches the scalar one on every row'''
+        result = vector(*[self.columns[t] for t in types], **kwargs)
+        assert len(result) == self.N
+        for i in range(self.N):
+            expected = to_list(scalar(*[self.messages(t, i) for t in types], **kwargs))
+            assert np.allclose(result[i], expected, rtol=1.0e-9, atol=1.0e-9), (scalar.__name__, i)
+
+    def test_mag(self):
+        """Test the magnetometer functions"""
+        self.check(mavextra.mag_field, mavextra_np.mag_field, ['RAW_IMU'])
+        self.check(mavextra.mag_field, mavextra_np.mag_field, ['RAW_IMU', 'SENSOR_OFFSETS'], ofs=(10, -20, 30))
+        self.check(mavextra.mag_heading, mavextra_np.mag_heading, ['RAW_IMU', 'ATTITUDE'], declination=5.0)
+
+    def test_altitude_airspeed(self):
+        """Test barometric altitude and airspeed"""
+        self.check(mavextra.altitude, mavextra_np.altitude, ['SCALED_PRESSURE'],
+                   ground_pressure=101000.0, ground_temp=20.0)
+        self.check(mavextra.altitude2, mavextra_np.altitude2, ['SCALED_PRESSURE'],
+                   ground_pressure=101000.0, ground_temp=20.0)
+        self.check(mavextra.airspeed, mavextra_np.airspeed, ['VFR_HUD'], used_ratio=2.1, offset=-20.0)
+
+    def test_vectors(self):
+        """Test the functions giving vectors"""
+        to_list = lambda v: [v.x, v.y, v.z]
+        self.check(mavextra.earth_accel, mavextra_np.earth_accel, ['RAW_IMU', 'ATTITUDE'], to_list)
+        self.check(mavextra.earth_gyro, mavextra_np.earth_gyro, ['RAW_IMU', 'ATTITUDE'], to_list)
+        self.check(mavextra.gps_velocity, mavextra_np.gps_velocity, ['GLOBAL_POSITION_INT'], to_list)
+        self.check(mavextra.gps_velocity_old, mavextra_np.gps_velocity_old, ['GPS_RAW_INT'], to_list)
+
+    def test_distance(self):
+        """Test distance_two on MAVLink and dataflash GPS messages"""
+        for t in ['GPS_RAW_INT', 'GPS']:
+            first = dict([(k, v[:1].repeat(self.N)) for (k, v) in self.columns[t].items()])
+            self.columns['FIRST'] = first
+            self.check(mavextra.distance_two, mavextra_np.distance_two, [t, 'FIRST'])
+            self.check(mavextra.distance_two, mavextra_np.distance_two, [t, 'FIRST'], horizontal=False)
+
+    def test_wrap(self):
+        """Test angle wrapping on arrays and record arrays"""
+        angles = np.linspace(-350, 350, self.N)
+        assert np.allclose(mavextra_np.wrap_180(angles), [mavextra.wrap_180(a) for a in angles])
+        assert np.allclose(mavextra_np.wrap_360(angles), [mavextra.wrap_360(a) for a in angles])
+        assert np.allclose(mavextra_np.angle_diff(angles, 170), [mavextra.angle_diff(a, 170) for a in angles])
+        records = np.zeros(3, dtype=[('press_abs', 'f4')])
+        records['press_abs'] = 1000
+        assert np.allclose(mavextra_np.altitude(records, ground_pressure=100000.0, ground_temp=0), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for mavutil.mavhub
+"""
+
+from __future__ import print_function
+import socket
+import unittest
+
+from pymavlink import mavutil
+
+from linktest import LinkTest
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+
+@unittest.skipIf(selectors is None, "needs python 3.4 or later")
+class MavhubTest(LinkTest, unittest.TestCase):
+
+    """
+    Class to test mavhub with UDP and TCP links on the loopback interface
+    """
+
+    def setUp(self):
+        super(MavhubTest, self).setUp()
+        self.hub = mavutil.mavhub()
+
+    def tearDown(self):
+        self.hub.close()
+        super(MavhubTest, self).tearDown()
+
+    def udp_pair(self, source_system):
+        '''a UDP server on a free port, and a client sending to it'''
+        server = self.connect('udpin:127.0.0.1:0')
+        port = server.port.getsockname()[1]
+        client = self.connect('udpout:127.0.0.1:%u' % port, source_system=source_system)
+        return (server, client)
+
+    def poll_until(self, done):
+        '''poll the hub until done() is true, or give up'''
+        for i in range(50):
+            if done():
+                return True
+            self.hub.poll(0.1)
+        return done()
+
+    def test_dispatch(self):
+        """Test each link's messages go to its handler"""
+        (server1, client1) = self.udp_pair(1)
+        (server2, client2) = self.udp_pair(2)
+        received = []
+        self.hub.add(server1, lambda link, m: received.append((link, m.get_srcSystem())))
+        self.hub.add(server2, lambda link, m: received.append((link, m.get_srcSystem())))
+        for i in range(3):
+            client1.mav.heartbeat_send(2, 3, 0, 0, 0)
+        client2.mav.heartbeat_send(2, 3, 0, 0, 0)
+        assert self.poll_until(lambda: len(received) == 4)
+        assert received.count((server1, 1)) == 3
+        assert received.count((server2, 2)) == 1
+        assert server1.messages['HEARTBEAT'].get_srcSystem() == 1
+        assert self.hub.poll(0) == 0
+
+    def test_routing(self):
+        """Test frames are routed by target system and component"""
+        (server1, client1) = self.udp_pair(1)
+        (server2, client2) = self.udp_pair(2)
+        (server3, client3) = self.udp_pair(3)
+        self.hub.add(server1, route=True)
+        self.hub.add(server2, route=True, decode=False)
+        self.hub.add(server3, route=True)
+
+        # heartbeats tell the hub where each system is, and the servers
+        # where to send to
+        clients = [client1, client2, client3]
+        for client in clients:
+            client.mav.heartbeat_send(2, 3, 0, 0, 0)
+        servers = [server1, server2, server3]
+        assert self.poll_until(lambda: None not in [s.last_address for s in servers])
+        for client in clients:
+            while client.recv_match(type='HEARTBEAT') is not None:
+                pass
+
+        # and are broadcast
+        client2.mav.heartbeat_send(2, 3, 0, 0, 0)
+        assert self.poll_until(lambda: client1.recv_match(type='HEARTBEAT') is not None)
+        assert self.poll_until(lambda: client3.recv_match(type='HEARTBEAT') is not None)
+        assert client2.recv_match(type='HEARTBEAT') is None
+
+        # a command for system 2 only goes to the second link
+        client1.mav.command_long_send(2, 0, 400, 0, 1, 0, 0, 0, 0, 0, 0)
+        assert self.poll_until(lambda: client2.recv_match(type='COMMAND_LONG') is not None)
+        client3.mav.command_long_send(1, 7, 400, 0, 1, 0, 0, 0, 0, 0, 0)
+        client3.mav.command_long_send(1, 0, 400, 0, 1, 0, 0, 0, 0, 0, 0)
+        assert self.poll_until(lambda: client1.recv_match(type='COMMAND_LONG') is not None)
+        self.hub.poll(0.1)
+        assert client3.recv_match(type='COMMAND_LONG') is None
+        assert client1.recv_match(type='COMMAND_LONG') is None
+        assert server2.mav.total_packets_received == 0
+
+    def test_tcp_close(self):
+        """Test a TCP server link follows its clients, and closing a client link"""
+        listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen.bind(('127.0.0.1', 0))
+        port = listen.getsockname()[1]
+        listen.close()
+        server = self.connect('tcpin:127.0.0.1:%u' % port)
+        received = []
+        self.hub.add(server, lambda link, m: received.append(m))
+        for i in range(2):
+            client = mavutil.mavlink_connection('tcp:127.0.0.1:%u' % port, source_system=5+i)
+            client.mav.heartbeat_send(2, 3, 0, 0, 0)
+            assert self.poll_until(lambda: len(received) == i+1)
+            assert received[i].get_srcSystem() == 5+i
+            client.close()
+            assert self.poll_until(lambda: server.port is None)
+
+        client = self.connect('tcp:127.0.0.1:%u' % port)
+        closed = []
+        self.hub.add(client, lambda link, m: closed.append(m))
+        assert self.poll_until(lambda: server.port is not None)
+        server.port.close()
+        assert self.poll_until(lambda: closed == [None])
+        assert not client in self.hub.links
+
+if __name__ == '__main__':
+    unittest.main()
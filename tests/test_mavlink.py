@@ -0,0 +1,801 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for the generated MAVLink parser
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+from pymavlink.generator import mavgen, mavparse
+from pymavlink.generator.mavcrc import x25crc
+
+
+# a small dialect for testing generator options, with an enum, an array,
+# a string, an extension field and a field named like a class attribute
+test_xml = '''<?xml version="1.0"?>
+<mavlink>
+  <version>3</version>
+  <enums>
+    <enum name="TEST_MODE">
+      <description>test modes</description>
+      <entry value="0" name="TEST_MODE_OFF">
+        <description>off</description>
+      </entry>
+      <entry value="3" name="TEST_MODE_ON">
+        <description>on</description>
+        <param index="1">level</param>
+      </entry>
+    </enum>
+  </enums>
+  <messages>
+    <message id="1" name="TEST_VALUE">
+      <description>a named value</description>
+      <field type="char[16]" name="label">label</field>
+      <field type="float" name="value">value</field>
+      <field type="uint8_t" name="mode" enum="TEST_MODE">mode</field>
+      <field type="uint16_t[4]" name="raw">raw values</field>
+      <extensions/>
+      <field type="uint32_t" name="extra">extra</field>
+    </message>
+    <message id="300" name="TEST_ID">
+      <description>an id</description>
+      <field type="uint8_t" name="id">id</field>
+      <field type="int32_t" name="count">count</field>
+    </message>
+  </messages>
+</mavlink>
+'''
+
+generated_count = 0
+
+def generate_module(**kwargs):
+    '''generate test_xml as MAVLink2 with the given mavgen options, and
+    import the result'''
+    global generated_count
+    generated_count += 1
+    name = 'pymavlink.dialects.v20.generated_test%u' % generated_count
+    tmpdir = tempfile.mkdtemp()
+    try:
+        xml = os.path.join(tmpdir, 'test.xml')
+        with open(xml, 'w') as f:
+            f.write(test_xml)
+        py = os.path.join(tmpdir, 'test.py')
+        opts = mavgen.Opts(py, mavparse.PROTOCOL_2_0, validate=False, **kwargs)
+        assert mavgen.mavgen(opts, [xml])
+        try:
+            import importlib.util
+        except ImportError:
+            import imp
+            return imp.load_source(name, py)
+        spec = importlib.util.spec_from_file_location(name, py)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        return mod
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def attitude_stream(count):
+    '''return a buffer of packed ATTITUDE messages'''
+    mav = mavlink.MAVLink(None)
+    buf = bytearray()
+    for i in range(count):
+        buf += mavlink.MAVLink_attitude_message(i, 0.5*i, 0.25, 0, 0, 0, 0).pack(mav)
+    return buf
+
+
+class ParseBufferTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink.parse_buffer
+    """
+
+    def test_split_frames(self):
+        """Test frames split across calls are reassembled"""
+        buf = attitude_stream(20)
+        mav = mavlink.MAVLink(None)
+        msgs = []
+        for i in range(0, len(buf), 7):
+            ret = mav.parse_buffer(bytes(buf[i:i+7]))
+            if ret is not None:
+                msgs.extend(ret)
+        assert len(msgs) == 20
+        assert [m.time_boot_ms for m in msgs] == list(range(20))
+        assert msgs[3].roll == 1.5
+        assert mav.buf_len() == 0
+
+    def test_msgbuf(self):
+        """Test decoded messages keep their own copy of the frame"""
+        buf = attitude_stream(2)
+        mav = mavlink.MAVLink(None)
+        msgs = mav.parse_buffer(bytes(buf))
+        assert len(msgs) == 2
+        assert msgs[0].get_msgbuf() + msgs[1].get_msgbuf() == buf
+
+    def test_robust(self):
+        """Test garbage between frames is reported as bad data"""
+        buf = attitude_stream(2)
+        mav = mavlink.MAVLink(None)
+        mav.robust_parsing = True
+        msgs = mav.parse_buffer(bytes(b'\x01\x02' + buf))
+        assert [m.get_type() for m in msgs] == ['BAD_DATA', 'ATTITUDE', 'ATTITUDE']
+        assert mav.total_receive_errors == 2
+        assert mav.parse_buffer(b'') is None
+
+
+class ResyncTest(unittest.TestCase):
+
+    """
+    Class to test recovery from garbage with robust_parsing
+    """
+
+    def test_coalesce(self):
+        """Test a run of garbage gives one BAD_DATA message"""
+        frames = attitude_stream(2)
+        n = len(frames) // 2
+        buf = bytes(frames[:n] + bytearray(range(100)) + frames[n:])
+        mav = mavlink.MAVLink(None)
+        mav.robust_parsing = True
+        msgs = mav.parse_buffer(buf)
+        assert [m.get_type() for m in msgs] == ['ATTITUDE', 'BAD_DATA', 'ATTITUDE']
+        assert msgs[1].data == bytearray(range(100))
+        assert msgs[1].reason == 'Bad prefix'
+        assert msgs[1].offset == n
+        assert mav.total_receive_errors == 100
+
+    def test_parse_char(self):
+        """Test parse_char skips buffered garbage in one step"""
+        buf = bytearray(range(1, 50)) + attitude_stream(1)
+        mav = mavlink.MAVLink(None)
+        mav.robust_parsing = True
+        m = mav.parse_char(buf)
+        assert m.get_type() == 'BAD_DATA'
+        assert len(m.data) == 49
+        assert mav.parse_char(b'').get_type() == 'ATTITUDE'
+
+    def test_crc_resync(self):
+        """Test a frame hidden by a false marker is found with crc_resync"""
+        frames = attitude_stream(2)
+        n = len(frames) // 2
+        # a MAVLink1 marker whose length runs into the next frame
+        buf = bytes(frames[:n] + bytearray([0xfe, 5]) + frames[n:])
+        for resync in [False, True]:
+            mav = mavlink.MAVLink(None)
+            mav.robust_parsing = True
+            mav.crc_resync = resync
+            msgs = mav.parse_buffer(buf)
+            types = [m.get_type() for m in msgs]
+            if resync:
+                assert types == ['ATTITUDE', 'BAD_DATA', 'ATTITUDE']
+                assert msgs[1].data == bytearray([0xfe, 5])
+                assert msgs[2].time_boot_ms == 1
+            else:
+                assert types.count('ATTITUDE') == 1
+
+
+class DecodeTest(unittest.TestCase):
+
+    """
+    Class to test the generated per-message decoders
+    """
+
+    def test_field_order(self):
+        """Test fields come back in definition order, not wire order"""
+        mav = mavlink.MAVLink(None)
+        msg = mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12)
+        m = mav.decode(msg.pack(mav))
+        assert m.get_type() == 'PARAM_VALUE'
+        assert (m.param_id, m.param_value, m.param_type, m.param_count, m.param_index) == \
+            ('RATE_RLL_P', 0.25, 9, 300, 12)
+        assert m._unpack_fields(msg.get_payload()) == [m.param_id, 0.25, 9, 300, 12]
+
+    def test_truncated_payload(self):
+        """Test trailing zeros dropped by MAVLink2 are restored"""
+        msg = mavlink.MAVLink_servo_output_raw_message(1000, 1, *([1500] + [0] * 15))
+        msg.pack(mavlink.MAVLink(None))
+        payload = bytes(msg.get_payload()).rstrip(b'\x00')
+        buf = bytearray(msg.get_msgbuf()[:10]) + payload
+        buf[1] = len(payload)
+        crc = x25crc(buf[1:])
+        crc.accumulate((msg.crc_extra,))
+        buf += struct.pack('<H', crc.crc)
+        m = mavlink.MAVLink(None).decode(buf)
+        assert m.time_usec == 1000
+        assert m.servo1_raw == 1500
+        assert m.servo16_raw == 0
+        assert m.to_dict() == msg.to_dict()
+
+    def test_array_fields(self):
+        """Test array fields decode as lists"""
+        mav = mavlink.MAVLink(None)
+        msg = mavlink.MAVLink_hil_actuator_controls_message(1, [0.5] * 16, 2, 3)
+        m = mav.decode(msg.pack(mav))
+        assert m.controls == [0.5] * 16
+        assert mav.decode_tuple(msg.pack(mav))[5] == [0.5] * 16
+
+
+class TupleTest(unittest.TestCase):
+
+    """
+    Class to test decoding messages as tuples
+    """
+
+    def test_decode_tuple(self):
+        """Test tuples match the decoded message"""
+        mav = mavlink.MAVLink(None, srcSystem=3, srcComponent=4)
+        mav.seq = 9
+        msg = mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12)
+        buf = msg.pack(mav)
+        t = mav.decode_tuple(buf)
+        assert t == (mavlink.MAVLINK_MSG_ID_PARAM_VALUE, 3, 4, 9, 'RATE_RLL_P', 0.25, 9, 300, 12)
+        assert t == mav.decode(buf).to_tuple()
+        msg = mavlink.MAVLink_servo_output_raw_message(1000, 1, *([1500] + [0] * 15))
+        assert mav.decode_tuple(msg.pack(mav))[-1] == 0
+
+    def test_named(self):
+        """Test namedtuples have the header and field names"""
+        mav = mavlink.MAVLink(None, srcSystem=3)
+        buf = mavlink.MAVLink_mission_item_reached_message(5).pack(mav)
+        t = mav.decode_tuple(buf, named=True)
+        assert type(t).__name__ == 'MISSION_ITEM_REACHED'
+        assert t._fields == ('mavmsgid', 'mavsysid', 'mavcompid', 'mavseq', 'seq')
+        assert (t.mavsysid, t.seq) == (3, 5)
+        assert type(t) is mavlink.MAVLink_mission_item_reached_message.get_tuple_type()
+
+    def test_parse_tuples(self):
+        """Test parsing a stream as tuples drops bad data"""
+        buf = attitude_stream(3)
+        mav = mavlink.MAVLink(None)
+        mav.robust_parsing = True
+        calls = []
+        mav.set_callback(lambda m: calls.append(m))
+        n = len(buf) // 3
+        tuples = mav.parse_tuples(bytes(buf[:n] + b'\x01\x02' + buf[n:]))
+        assert [t[4] for t in tuples] == [0, 1, 2]
+        assert mav.total_receive_errors == 2
+        assert calls == []
+        assert mav.parse_tuples(b'') == []
+
+
+class Output(object):
+    '''file like object collecting each write'''
+    def __init__(self):
+        self.writes = []
+
+    def write(self, buf):
+        self.writes.append(bytes(buf))
+
+
+class EncodeTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink_message.pack_into and MAVLink.send_many
+    """
+
+    def messages(self):
+        '''a few messages of different types'''
+        return [mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3),
+                mavlink.MAVLink_attitude_message(10, 0.5, 0.25, 0, 0, 0, 0),
+                mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12),
+                mavlink.MAVLink_servo_output_raw_message(1000, 1, *([1500] * 8 + [0] * 8))]
+
+    def test_pack_into(self):
+        """Test pack_into gives the same frame as pack"""
+        mav = mavlink.MAVLink(None, srcSystem=3, srcComponent=4)
+        buf = bytearray(300)
+        for msg in self.messages():
+            n = msg.pack_into(mav, buf, 17)
+            assert bytes(buf[17:17+n]) == msg.pack(mav)
+
+    def test_truncation(self):
+        """Test trailing zeros are stripped from MAVLink2 payloads"""
+        mav = mavlink.MAVLink(None)
+        msg = self.messages()[3]
+        buf = msg.pack(mav)
+        assert len(msg.get_payload()) == 21
+        assert msg.get_header().mlen == 21
+        assert mav.decode(buf).to_dict() == msg.to_dict()
+
+    def test_send_many(self):
+        """Test send_many writes the same bytes as send, in one write"""
+        def sent_state(m):
+            h = m.get_header()
+            return (bytes(m.get_msgbuf()), bytes(m.get_payload()), m.get_crc(), h.msgId, h.mlen,
+                    h.seq, h.srcSystem, h.srcComponent, h.incompat_flags)
+        out1 = Output()
+        mav1 = mavlink.MAVLink(out1, srcSystem=3, srcComponent=4)
+        mav1.seq = 250
+        sent1 = []
+        mav1.set_send_callback(lambda m: sent1.append(sent_state(m)))
+        for msg in self.messages():
+            mav1.send(msg)
+        out2 = Output()
+        mav2 = mavlink.MAVLink(out2, srcSystem=3, srcComponent=4)
+        mav2.seq = 250
+        sent2 = []
+        mav2.set_send_callback(lambda m: sent2.append(sent_state(m)))
+        mav2.send_many(self.messages())
+        assert len(out2.writes) == 1
+        assert out2.writes[0] == b''.join(out1.writes)
+        assert [s[0] for s in sent1] == out1.writes
+        assert sent2 == sent1
+        assert [s[5] for s in sent2] == [250, 251, 252, 253]
+        assert mav2.seq == 254
+        assert mav2.total_packets_sent == 4
+        assert mav2.total_bytes_sent == len(out2.writes[0])
+        assert mav2.encode_batch([]) == b''
+
+    def test_signed(self):
+        """Test batches are signed like single messages"""
+        frames = []
+        for batch in [False, True]:
+            mav = mavlink.MAVLink(None)
+            mav.signing.secret_key = bytearray(range(32))
+            mav.signing.sign_outgoing = True
+            mav.signing.link_id = 2
+            mav.signing.timestamp = 1000
+            if batch:
+                frames.append(mav.encode_batch(self.messages()))
+            else:
+                buf = b''
+                for msg in self.messages():
+                    buf += msg.pack(mav)
+                    mav.seq += 1
+                frames.append(buf)
+            assert mav.signing.timestamp == 1004
+        assert frames[0] == frames[1]
+
+
+class SigningTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink2 signature checking
+    """
+
+    def signed_frames(self, count, key=bytearray(range(32)), srcSystem=1, timestamp=1000):
+        '''return a list of signed ATTITUDE frames'''
+        mav = mavlink.MAVLink(None, srcSystem=srcSystem)
+        mav.signing.secret_key = key
+        mav.signing.sign_outgoing = True
+        mav.signing.timestamp = timestamp
+        frames = []
+        for i in range(count):
+            frames.append(bytearray(mavlink.MAVLink_attitude_message(i, 0, 0, 0, 0, 0, 0).pack(mav)))
+            mav.seq += 1
+        return frames
+
+    def receiver(self):
+        '''return a MAVLink object expecting signed messages'''
+        mav = mavlink.MAVLink(None)
+        mav.signing.secret_key = bytearray(range(32))
+        return mav
+
+    def test_decode(self):
+        """Test signed messages are accepted and replays rejected"""
+        frames = self.signed_frames(5)
+        mav = self.receiver()
+        msgs = mav.parse_buffer(bytes(b''.join(frames)))
+        assert [m.get_type() for m in msgs] == ['ATTITUDE'] * 5
+        assert all([m.get_signed() for m in msgs])
+        assert mav.signing.goodsig_count == 5
+        assert mav.signing.timestamp == 1004
+        with self.assertRaises(mavlink.MAVError):
+            mav.decode(frames[2])
+
+    def test_bad_key(self):
+        """Test messages signed with another key are rejected"""
+        frames = self.signed_frames(2, key=bytearray(32))
+        mav = self.receiver()
+        assert mav.check_signatures(frames) == [False, False]
+        assert mav.signing.stream_timestamps == {}
+        mav.signing.secret_key = bytearray(32)
+        assert mav.check_signatures(frames) == [True, True]
+
+    def test_check_signatures(self):
+        """Test checking a list of frames"""
+        frames = self.signed_frames(4)
+        frames[1][-1] ^= 1
+        frames.append(bytearray(attitude_stream(1)))
+        mav = self.receiver()
+        assert mav.check_signatures(frames) == [True, False, True, True, False]
+        assert mav.check_signatures(frames[:1]) == [False]
+
+    def test_max_streams(self):
+        """Test the oldest streams are forgotten"""
+        mav = self.receiver()
+        mav.signing.max_streams = 3
+        for sysid in range(1, 6):
+            assert mav.check_signatures(self.signed_frames(1, srcSystem=sysid, timestamp=1000+sysid)) == [True]
+        assert sorted(mav.signing.stream_timestamps.keys()) == [(0, 3, 0), (0, 4, 0), (0, 5, 0)]
+
+
+class LazyDecodeTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink.lazy_decode
+    """
+
+    def decode(self, msg, lazy):
+        '''pack and decode a message'''
+        mav = mavlink.MAVLink(None, srcSystem=5, srcComponent=7)
+        buf = msg.pack(mav)
+        mav.lazy_decode = lazy
+        return mav.parse_buffer(bytes(buf))[0]
+
+    def test_lazy(self):
+        """Test fields are decoded on first access"""
+        msg = mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12)
+        eager = self.decode(msg, False)
+        lazy = self.decode(msg, True)
+        assert lazy._lazy_payload is not None
+        assert lazy.get_type() == 'PARAM_VALUE'
+        assert lazy.get_srcSystem() == 5
+        assert lazy.get_srcComponent() == 7
+        assert lazy.param_value == 0.25
+        assert lazy.param_id == 'RATE_RLL_P'
+        assert not hasattr(lazy, '_lazy_payload')
+        assert lazy.to_dict() == eager.to_dict()
+        assert lazy == eager
+
+    def test_arrays(self):
+        """Test lazy decoding of array fields"""
+        msg = mavlink.MAVLink_servo_output_raw_message(1000, 1, *range(1000, 1016))
+        lazy = self.decode(msg, True)
+        assert lazy.to_dict() == self.decode(msg, False).to_dict()
+
+    def test_shadowed_fields(self):
+        """Test fields hidden by class attributes are still decoded"""
+        msg = mavlink.MAVLink_log_entry_message(17, 3, 4, 5, 6)
+        lazy = self.decode(msg, True)
+        assert lazy.id == 17
+        with self.assertRaises(AttributeError):
+            lazy.not_a_field
+
+
+class SlotsTest(unittest.TestCase):
+
+    """
+    Class to test a dialect generated with --slots
+    """
+
+    def setUp(self):
+        self.mod = generate_module(slots=True)
+
+    def round_trip(self, msg, lazy=False):
+        '''pack and decode a message'''
+        mav = self.mod.MAVLink(None, srcSystem=5)
+        buf = msg.pack(mav)
+        mav.lazy_decode = lazy
+        return mav.parse_buffer(bytes(buf))[0]
+
+    def test_round_trip(self):
+        """Test messages with __slots__ encode and decode"""
+        msg = self.mod.MAVLink_test_value_message(b'speed', 1.5, self.mod.TEST_MODE_ON, [1, 2, 3, 4], 7)
+        assert not hasattr(msg, '__dict__')
+        with self.assertRaises(AttributeError):
+            msg.not_a_field = 1
+        for lazy in [False, True]:
+            m = self.round_trip(msg, lazy)
+            if lazy:
+                assert m._lazy_payload is not None
+            assert m.get_type() == 'TEST_VALUE'
+            assert m.get_srcSystem() == 5
+            assert (m.label, m.value, m.mode, m.raw, m.extra) == ('speed', 1.5, 3, [1, 2, 3, 4], 7)
+            assert m.to_dict() == msg.to_dict()
+            assert not hasattr(m, '_lazy_payload')
+
+    def test_shadowed_fields(self):
+        """Test fields named like class attributes go in a __dict__"""
+        msg = self.mod.MAVLink_test_id_message(9, -2)
+        m = self.round_trip(msg)
+        assert m.get_msgId() == 300
+        assert (m.id, m.count) == (9, -2)
+        assert m.__dict__ == {'id': 9}
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "needs python 3.7 or later")
+class LazyModuleTest(unittest.TestCase):
+
+    """
+    Class to test a dialect generated with --lazy against the same
+    dialect generated without it
+    """
+
+    def setUp(self):
+        self.mod = generate_module(lazy=True)
+        self.eager = generate_module()
+
+    def frames(self, mod):
+        '''pack a message of each type with the given module'''
+        mav = mod.MAVLink(None, srcSystem=5)
+        return [bytes(mav.test_value_encode(b'speed', 1.5, mod.TEST_MODE_ON, [1, 2, 3, 4], 7).pack(mav)),
+                bytes(mav.test_id_encode(9, -2).pack(mav))]
+
+    def test_classes(self):
+        """Test message classes are defined on first use"""
+        mod = self.mod
+        assert 'MAVLink_test_value_message' not in mod.__dict__
+        assert len(mod.mavlink_map) == 2
+        assert sorted(mod.mavlink_map.keys()) == [1, 300]
+        assert 300 in mod.mavlink_map and not 2 in mod.mavlink_map
+        assert mod.mavlink_map.get(2) is None
+        cls = mod.MAVLink_test_value_message
+        assert mod.__dict__['MAVLink_test_value_message'] is cls
+        assert mod.mavlink_map[mod.MAVLINK_MSG_ID_TEST_VALUE] is cls
+        assert cls.__qualname__ == 'MAVLink_test_value_message'
+        assert 'MAVLink_test_id_message' not in mod.__dict__
+        eager_cls = self.eager.MAVLink_test_value_message
+        for attr in ['id', 'name', 'fieldnames', 'ordered_fieldnames', 'format', 'crc_extra']:
+            assert getattr(cls, attr) == getattr(eager_cls, attr)
+        assert [c.name for c in mod.mavlink_map.values()] == ['TEST_VALUE', 'TEST_ID']
+        assert 'MAVLink_test_id_message' in mod.__dict__
+        with self.assertRaises(AttributeError):
+            mod.MAVLink_not_a_message
+
+    def test_enums(self):
+        """Test the enums table is built on first use"""
+        mod = self.mod
+        assert mod.TEST_MODE_ON == self.eager.TEST_MODE_ON == 3
+        assert 'enums' not in mod.__dict__
+        enums = mod.enums
+        assert mod.__dict__['enums'] is enums
+        assert sorted(enums.keys()) == sorted(self.eager.enums.keys())
+        for (value, entry) in self.eager.enums['TEST_MODE'].items():
+            lazy_entry = enums['TEST_MODE'][value]
+            assert (lazy_entry.name, lazy_entry.description, lazy_entry.param) == \
+                (entry.name, entry.description, entry.param)
+
+    def test_decode(self):
+        """Test lazy and eager modules encode and decode the same"""
+        frames = self.frames(self.mod)
+        assert frames == self.frames(self.eager)
+        msgs = self.mod.MAVLink(None).parse_buffer(b''.join(frames))
+        eager_msgs = self.eager.MAVLink(None).parse_buffer(b''.join(frames))
+        assert [m.get_type() for m in msgs] == ['TEST_VALUE', 'TEST_ID']
+        assert [m.to_dict() for m in msgs] == [m.to_dict() for m in eager_msgs]
+        assert isinstance(msgs[0], self.mod.MAVLink_test_value_message)
+
+
+class MsgidFilterTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink.set_msgid_filter
+    """
+
+    def mixed_stream(self):
+        '''return a buffer of alternating HEARTBEAT and ATTITUDE messages'''
+        mav = mavlink.MAVLink(None)
+        buf = bytearray()
+        for i in range(10):
+            buf += mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3).pack(mav)
+            mav.seq += 1
+            buf += mavlink.MAVLink_attitude_message(i, 0, 0, 0, 0, 0, 0).pack(mav)
+            mav.seq += 1
+        return buf
+
+    def test_parse_buffer(self):
+        """Test filtered frames are dropped by parse_buffer"""
+        mav = mavlink.MAVLink(None)
+        mav.set_msgid_filter(['ATTITUDE'])
+        seqs = []
+        mav.set_filter_callback(lambda msgId, seq, srcSystem, srcComponent: seqs.append(seq))
+        msgs = mav.parse_buffer(bytes(self.mixed_stream()))
+        assert [m.get_type() for m in msgs] == ['ATTITUDE'] * 10
+        assert mav.total_packets_filtered == 10
+        assert mav.total_packets_received == 10
+        assert seqs == list(range(0, 20, 2))
+
+    def test_parse_char(self):
+        """Test filtered frames are dropped by parse_char"""
+        mav = mavlink.MAVLink(None)
+        mav.set_msgid_filter([mavlink.MAVLINK_MSG_ID_HEARTBEAT])
+        msgs = []
+        for b in self.mixed_stream():
+            m = mav.parse_char(bytearray([b]))
+            if m is not None:
+                msgs.append(m)
+        assert [m.get_type() for m in msgs] == ['HEARTBEAT'] * 10
+        mav.set_msgid_filter(None)
+        assert len(mav.parse_buffer(bytes(self.mixed_stream()))) == 20
+
+    def test_bad_crc(self):
+        """Test filtered frames with a bad CRC are bad data, not filtered"""
+        buf = self.mixed_stream()
+        # corrupt the CRC of the first HEARTBEAT
+        n = len(buf) // 20
+        buf[n-1] ^= 1
+        mav = mavlink.MAVLink(None)
+        mav.robust_parsing = True
+        mav.set_msgid_filter(['ATTITUDE'])
+        seqs = []
+        mav.set_filter_callback(lambda msgId, seq, srcSystem, srcComponent: seqs.append(seq))
+        msgs = mav.parse_buffer(bytes(buf))
+        assert [m.get_type() for m in msgs] == ['BAD_DATA'] + ['ATTITUDE'] * 10
+        assert mav.total_packets_filtered == 9
+        assert seqs == list(range(2, 20, 2))
+
+    def test_unknown_type(self):
+        """Test filtering on an unknown type name"""
+        mav = mavlink.MAVLink(None)
+        with self.assertRaises(mavlink.MAVError):
+            mav.set_msgid_filter(['NOT_A_MESSAGE'])
+
+
+class MessageCallbackTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink.add_message_callback
+    """
+
+    def test_dispatch(self):
+        """Test callbacks only see the types they asked for"""
+        mav = mavlink.MAVLink(None)
+        seen = []
+        def callback(msg, name):
+            seen.append((name, msg.get_type()))
+        mav.add_message_callback('ATTITUDE', callback, 'att')
+        mav.add_message_callback(mavlink.MAVLINK_MSG_ID_HEARTBEAT, callback, 'hb')
+        mav.add_message_callback('*', callback, 'all')
+        buf = mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3).pack(mav)
+        buf += attitude_stream(1)
+        mav.parse_buffer(bytes(buf))
+        assert seen == [('hb', 'HEARTBEAT'), ('all', 'HEARTBEAT'),
+                        ('att', 'ATTITUDE'), ('all', 'ATTITUDE')]
+
+    def test_remove(self):
+        """Test removing a callback"""
+        mav = mavlink.MAVLink(None)
+        seen = []
+        def callback(msg):
+            seen.append(msg.get_type())
+        mav.add_message_callback(['ATTITUDE', 'HEARTBEAT'], callback)
+        mav.remove_message_callback('ATTITUDE', callback)
+        mav.parse_buffer(bytes(attitude_stream(3)))
+        assert seen == []
+        assert list(mav.message_callbacks.keys()) == ['HEARTBEAT']
+
+
+class DecodeArrayTest(unittest.TestCase):
+
+    """
+    Class to test MAVLink.decode_array
+    """
+
+    def frames(self, msgs):
+        '''pack a list of messages into separate frames'''
+        mav = mavlink.MAVLink(None)
+        return [bytes(m.pack(mav)) for m in msgs]
+
+    def test_decode(self):
+        """Test batch decoding matches the message objects"""
+        msgs = [mavlink.MAVLink_attitude_message(i, 0.5*i, 0.25, 0, 0, 0, -1.5) for i in range(10)]
+        records = mavlink.MAVLink(None).decode_array(self.frames(msgs))
+        assert len(records) == 10
+        assert list(records.time_boot_ms) == list(range(10))
+        assert records.roll[3] == 1.5
+        assert records['yawspeed'][9] == -1.5
+
+    def test_arrays_and_strings(self):
+        """Test batch decoding of array and char fields"""
+        msgs = [mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12),
+                mavlink.MAVLink_param_value_message(b'RATE', 1.5, 9, 300, 13)]
+        records = mavlink.MAVLink(None).decode_array(self.frames(msgs))
+        assert list(records.param_id) == [b'RATE_RLL_P', b'RATE']
+        msgs = [mavlink.MAVLink_servo_output_raw_message(1000, 1, *range(1000, 1016))]
+        records = mavlink.MAVLink(None).decode_array(self.frames(msgs))
+        assert records.dtype.itemsize == mavlink.MAVLink_servo_output_raw_message.unpacker.size
+        assert records.servo1_raw[0] == 1000
+        assert records.servo16_raw[0] == 1015
+
+    def test_bad_crc(self):
+        """Test frames with a bad CRC are left out"""
+        frames = self.frames([mavlink.MAVLink_attitude_message(i, 0, 0, 0, 0, 0, 0) for i in range(3)])
+        frames[1] = frames[1][:-1] + bytes(bytearray([frames[1][-1] ^ 1]))
+        mav = mavlink.MAVLink(None)
+        assert mav.check_frames(frames) == [True, False, True]
+        assert list(mav.decode_array(frames).time_boot_ms) == [0, 2]
+        assert len(mav.decode_array(frames, check_crc=False)) == 3
+        assert mav.decode_array([]) is None
+
+    def test_mixed_types(self):
+        """Test frames of different types are rejected"""
+        frames = self.frames([mavlink.MAVLink_attitude_message(0, 0, 0, 0, 0, 0, 0),
+                              mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3)])
+        with self.assertRaises(mavlink.MAVError):
+            mavlink.MAVLink(None).decode_array(frames)
+
+
+class NativeTest(unittest.TestCase):
+
+    """
+    Class to test the mavnative parser with MAVLink2
+    """
+
+    def setUp(self):
+        if not mavlink.native_supported:
+            self.skipTest('mavnative is not available')
+
+    def stream(self, mav=None):
+        '''return a buffer with MAVLink1 and MAVLink2 frames, including
+        a truncated payload, array fields and a message id above 255'''
+        if mav is None:
+            mav = mavlink.MAVLink(None)
+        msgs = [(mavlink.MAVLink_gps_raw_int_message(1, 3, 10, 20, 30, 0, 0, 0, 0, 8, 0, 0, 0, 0, 0), False),
+                (mavlink.MAVLink_button_change_message(100, 50, 3), False),
+                (mavlink.MAVLink_param_value_message(b'RATE_RLL_P', 0.25, 9, 300, 12), False),
+                (mavlink.MAVLink_servo_output_raw_message(1000, 1, *range(1000, 1016)), False),
+                (mavlink.MAVLink_attitude_quaternion_cov_message(5, [1, 0, 0.5, 0], 0.25, 0, 0, [0.125] * 9), False),
+                (mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3), True)]
+        buf = bytearray()
+        for (m, force_mavlink1) in msgs:
+            buf += m.pack(mav, force_mavlink1=force_mavlink1)
+            mav.seq += 1
+        return buf
+
+    def parse(self, buf, use_native):
+        mav = mavlink.MAVLink(None, use_native=use_native)
+        return mav.parse_buffer(bytes(buf))
+
+    def test_parse(self):
+        """Test the native parser gives the same messages as the python parser"""
+        buf = self.stream()
+        msgs = self.parse(buf, True)
+        assert [m.get_type() for m in msgs] == ['GPS_RAW_INT', 'BUTTON_CHANGE', 'PARAM_VALUE',
+                                                'SERVO_OUTPUT_RAW', 'ATTITUDE_QUATERNION_COV', 'HEARTBEAT']
+        assert msgs == self.parse(buf, False)
+        assert msgs[0].get_header().mlen < mavlink.MAVLink_gps_raw_int_message.unpacker.size
+        assert msgs[0].alt_ellipsoid == 0
+        assert msgs[1].get_msgId() == 257
+        assert msgs[2].param_id == self.parse(buf, False)[2].param_id
+        assert msgs[3].servo16_raw == 1015
+        assert msgs[4].q == [1, 0, 0.5, 0]
+        assert msgs[4].covariance == [0.125] * 9
+        assert msgs[5].get_msgbuf()[0] == mavlink.PROTOCOL_MARKER_V1
+
+    def test_expected_length(self):
+        """Test byte at a time parsing asks for the rest of each frame"""
+        buf = self.stream()
+        mav = mavlink.MAVLink(None, use_native=True)
+        count = 0
+        while buf:
+            n = mav.bytes_needed()
+            if mav.parse_char(buf[:n]) is not None:
+                count += 1
+            buf = buf[n:]
+        assert count == 6
+        assert mav.bytes_needed() == mavlink.HEADER_LEN_V1 + 2
+
+    def test_signed(self):
+        """Test signed frames are checked by the native parser"""
+        tx = mavlink.MAVLink(None)
+        tx.signing.secret_key = bytearray(range(32))
+        tx.signing.sign_outgoing = True
+        tx.signing.link_id = 2
+        buf = self.stream(tx)
+        mav = mavlink.MAVLink(None, use_native=True)
+        mav.signing.secret_key = bytearray(range(32))
+        mav.signing.allow_unsigned_callback = lambda mav, msgId: msgId == mavlink.MAVLINK_MSG_ID_HEARTBEAT
+        msgs = mav.parse_buffer(bytes(buf))
+        assert [m.get_signed() for m in msgs] == [True, True, True, True, True, False]
+        assert msgs[0].get_link_id() == 2
+        mav = mavlink.MAVLink(None, use_native=True)
+        mav.signing.secret_key = bytearray(32)
+        with self.assertRaises(mavlink.MAVError):
+            mav.parse_buffer(bytes(buf))
+        mav = mavlink.MAVLink(None, use_native=True)
+        mav.robust_parsing = True
+        mav.signing.secret_key = bytearray(32)
+        msgs = mav.parse_buffer(bytes(buf))
+        assert [m.get_type() for m in msgs[:5]] == ['BAD_DATA'] * 5
+        assert msgs[0].reason == 'Invalid signature'
+
+if __name__ == '__main__':
+    unittest.main()
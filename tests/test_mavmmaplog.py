@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for reading telemetry logs with mavutil.mavmmaplog
+"""
+
+from __future__ import print_function
+import os
+import struct
+import tempfile
+import unittest
+
+from pymavlink import mavutil
+from pymavlink import mavindex
+
+
+def tlog_record(mav, msg, usec):
+    '''pack a message with its timestamp as a tlog record'''
+    return struct.pack('>Q', usec) + msg.pack(mav)
+
+
+def write_test_tlog(filename, count=20):
+    '''write a telemetry log with a HEARTBEAT and an ATTITUDE message
+    every 0.1 seconds from 1 second, and a PARAM_VALUE every fourth time'''
+    mavlink = mavutil.mavlink
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    log = b''
+    for i in range(count):
+        usec = 1000000 + i*100000
+        log += tlog_record(mav, mavlink.MAVLink_heartbeat_message(1, 3, 0, 0, 0, 3), usec)
+        log += tlog_record(mav, mavlink.MAVLink_attitude_message(i, 0.5*i, 0.25, 0, 0, 0, 0), usec)
+        if i % 4 == 0:
+            log += tlog_record(mav, mavlink.MAVLink_param_value_message(b'RATE_RLL_P', i, 9, 300, i), usec)
+    with open(filename, 'wb') as f:
+        f.write(log)
+
+
+class MavmmaplogIndexTest(unittest.TestCase):
+
+    """
+    Class to test the mavmmaplog sidecar index
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.tlog')
+        os.close(fd)
+        write_test_tlog(self.filename)
+
+    def tearDown(self):
+        for f in [self.filename, mavindex.index_filename(self.filename)]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_index(self):
+        """Test reopening a log with a sidecar index"""
+        log1 = mavutil.mavlink_connection(self.filename, use_index=True)
+        assert isinstance(log1, mavutil.mavmmaplog)
+        assert os.path.exists(mavindex.index_filename(self.filename))
+        log2 = mavutil.mavlink_connection(self.filename, use_index=True)
+        assert log2.load_index()
+        assert log2.offsets == log1.offsets
+        assert log2.counts == log1.counts
+        assert log2.name_to_id == log1.name_to_id
+        assert log2._count == log1._count == 45
+        assert log2.messages['PARAM_VALUE'].param_value == 0
+        for i in range(3):
+            assert log2.recv_match(type='ATTITUDE').roll == log1.recv_match(type='ATTITUDE').roll
+        log1.close()
+        log2.close()
+
+    def test_stale_index(self):
+        """Test an index is ignored once the log changes"""
+        log = mavutil.mavlink_connection(self.filename, use_index=True)
+        log.close()
+        mavlink = mavutil.mavlink
+        with open(self.filename, 'ab') as f:
+            f.write(tlog_record(mavlink.MAVLink(None), mavlink.MAVLink_attitude_message(20, 0, 0, 0, 0, 0, 0), 3000000))
+        log = mavutil.mavlink_connection(self.filename, use_index=True)
+        assert log.counts[mavlink.MAVLINK_MSG_ID_ATTITUDE] == 21
+        # and the index is rebuilt for the new contents
+        assert log.load_index()
+        assert log.counts[mavlink.MAVLINK_MSG_ID_ATTITUDE] == 21
+        log.close()
+
+
+class MavmmaplogIterTest(unittest.TestCase):
+
+    """
+    Class to test mavmmaplog.iter_messages
+    """
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.tlog')
+        os.close(fd)
+        write_test_tlog(self.filename)
+        self.log = mavutil.mavlink_connection(self.filename)
+
+    def tearDown(self):
+        self.log.close()
+        os.remove(self.filename)
+
+    def test_types(self):
+        """Test iter_messages gives the same messages as recv_match"""
+        msgs = []
+        while True:
+            m = self.log.recv_match(type=['ATTITUDE', 'PARAM_VALUE'])
+            if m is None:
+                break
+            msgs.append(m)
+        self.log.rewind()
+        it = list(self.log.iter_messages(types=['ATTITUDE', 'PARAM_VALUE']))
+        assert len(it) == len(msgs) == 25
+        assert [m.get_type() for m in it] == [m.get_type() for m in msgs]
+        assert [m._timestamp for m in it] == [m._timestamp for m in msgs]
+        # types outside the set are skipped using the offset index
+        assert self.log.type_nums is not None
+        self.log.rewind()
+        assert [m.param_index for m in self.log.iter_messages(types='PARAM_VALUE')] == [0, 4, 8, 12, 16]
+
+    def test_bounds(self):
+        """Test iter_messages with start, end and a condition"""
+        msgs = list(self.log.iter_messages(types='ATTITUDE'))
+        start = msgs[5]._timestamp
+        end = msgs[12]._timestamp
+        self.log.rewind()
+        it = list(self.log.iter_messages(types='ATTITUDE', start=start, end=end))
+        assert [m.time_boot_ms for m in it] == list(range(5, 13))
+        self.log.rewind()
+        it = self.log.iter_messages(types='ATTITUDE', start=start, condition='ATTITUDE.time_boot_ms % 2 == 0')
+        assert [m.time_boot_ms for m in it] == list(range(6, 20, 2))
+
+if __name__ == '__main__':
+    unittest.main()
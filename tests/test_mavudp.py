@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+
+"""
+Unit tests for receiving on mavutil UDP links
+"""
+
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+from pymavlink import mavparm
+
+from linktest import LinkTest
+
+
+class MavudpTest(LinkTest, unittest.TestCase):
+
+    """
+    Class to test recv_many() on the loopback interface
+    """
+
+    def setUp(self):
+        super(MavudpTest, self).setUp()
+        self.server = self.connect('udpin:127.0.0.1:0')
+        port = self.server.port.getsockname()[1]
+        self.clients = []
+        for sysid in [1, 2]:
+            self.clients.append(self.connect('udpout:127.0.0.1:%u' % port, source_system=sysid))
+
+    def recv_all(self, count):
+        '''call recv_many() until count messages have arrived'''
+        ret = []
+        for i in range(100):
+            ret.extend(self.server.recv_many())
+            if len(ret) >= count:
+                break
+            time.sleep(0.01)
+        return ret
+
+    def test_recv_many(self):
+        """Test all the messages in all waiting datagrams are returned"""
+        (client1, client2) = self.clients
+        for i in range(5):
+            client1.mav.ping_send(0, i, 0, 0)
+        # three frames in one datagram
+        pings = [client2.mav.ping_encode(0, i, 0, 0) for i in range(3)]
+        client2.mav.send_many(pings)
+        msgs = self.recv_all(8)
+        assert [(m.get_srcSystem(), m.seq) for m in msgs] == [(1, i) for i in range(5)] + [(2, i) for i in range(3)]
+        assert self.server.mav_count == 8
+        assert self.server.recv_many() == []
+
+        addresses = self.server.source_addresses
+        assert sorted(addresses.keys()) == [(1, 0), (2, 0)]
+        assert addresses[(1, 0)] == ('127.0.0.1', client1.port.getsockname()[1])
+        assert addresses[(2, 0)] == ('127.0.0.1', client2.port.getsockname()[1])
+
+    def test_leftover(self):
+        """Test frames left in the parser by recv_msg() are returned"""
+        pings = [self.clients[0].mav.ping_encode(0, i, 0, 0) for i in range(3)]
+        self.clients[0].mav.send_many(pings)
+        m = None
+        for i in range(100):
+            m = self.server.recv_msg()
+            if m is not None:
+                break
+            time.sleep(0.01)
+        assert m is not None and m.seq == 0
+        assert [m.seq for m in self.server.recv_many()] == [1, 2]
+
+
+class IterTest(LinkTest, unittest.TestCase):
+
+    """
+    Class to test iter_messages() on a UDP link
+    """
+
+    def setUp(self):
+        super(IterTest, self).setUp()
+        self.server = self.connect('udpin:127.0.0.1:0')
+        port = self.server.port.getsockname()[1]
+        self.client = self.connect('udpout:127.0.0.1:%u' % port)
+
+    def test_nonblocking(self):
+        """Test the iteration stops when no more data is waiting"""
+        assert list(self.server.iter_messages()) == []
+        for i in range(3):
+            self.client.mav.ping_send(0, i, 0, 0)
+        self.client.mav.heartbeat_send(2, 3, 0, 0, 0)
+        time.sleep(0.1)
+        assert [m.seq for m in self.server.iter_messages(types='PING')] == [0, 1, 2]
+        assert self.server.messages['HEARTBEAT'].type == 2
+
+    def test_timeout(self):
+        """Test a blocking iteration stops once nothing has matched for the timeout"""
+        idle = []
+        self.server.idle_hooks.append(lambda link: idle.append(link))
+        for i in range(3):
+            self.client.mav.ping_send(0, i, 0, 0)
+        t0 = time.time()
+        msgs = []
+        for m in self.server.iter_messages(types='PING', blocking=True, timeout=0.5):
+            msgs.append(m.seq)
+            # messages of other types don't restart the timeout
+            self.client.mav.heartbeat_send(2, 3, 0, 0, 0)
+        elapsed = time.time() - t0
+        assert msgs == [0, 1, 2]
+        assert 0.5 <= elapsed < 2
+        assert len(idle) > 0
+        assert self.server.messages['HEARTBEAT'].type == 2
+
+
+class ReaderTest(LinkTest, unittest.TestCase):
+
+    """
+    Class to test the reader thread and subscriptions
+    """
+
+    def setUp(self):
+        super(ReaderTest, self).setUp()
+        self.vehicle = self.connect('udpin:127.0.0.1:0', source_system=1)
+        port = self.vehicle.port.getsockname()[1]
+        self.gcs = self.connect('udpout:127.0.0.1:%u' % port)
+        # let the vehicle know where the GCS is
+        self.gcs.mav.heartbeat_send(6, 8, 0, 0, 0)
+        assert self.vehicle.wait_heartbeat(timeout=2) is not None
+        self.gcs.start_reader()
+
+    def tearDown(self):
+        self.gcs.stop_reader()
+        super(ReaderTest, self).tearDown()
+
+    def test_subscriptions(self):
+        """Test subscriptions each see the messages they match"""
+        pings = self.gcs.subscribe(type='PING')
+        armed = self.gcs.subscribe(type='HEARTBEAT', condition='HEARTBEAT.base_mode & 128')
+        small = self.gcs.subscribe(max_queue=2)
+        for i in range(3):
+            self.vehicle.mav.ping_send(0, i, 0, 0)
+        self.vehicle.mav.heartbeat_send(2, 3, 0, 0, 0)
+        self.vehicle.mav.heartbeat_send(2, 3, 128, 0, 0)
+
+        m = self.gcs.recv_match(type='HEARTBEAT', blocking=True, timeout=2)
+        assert m is not None and m.base_mode == 0
+        assert [pings.get(timeout=2).seq for i in range(3)] == [0, 1, 2]
+        assert armed.get(timeout=2).base_mode == 128
+        assert armed.get(blocking=False) is None
+        assert small.wait(2)
+        time.sleep(0.1)
+        assert small.dropped == 3 and len(small.queue) == 2
+
+        armed.close()
+        self.vehicle.mav.heartbeat_send(2, 3, 128, 0, 0)
+        assert self.gcs.recv_match(type='HEARTBEAT', blocking=True, timeout=2).base_mode == 128
+        assert armed.get(timeout=0.1) is None
+        self.gcs.stop_reader()
+        assert pings.closed and self.gcs.subscriptions == []
+        self.vehicle.mav.ping_send(0, 7, 0, 0)
+        assert self.gcs.recv_match(type='PING', blocking=True, timeout=2).seq == 7
+
+    def test_mavset(self):
+        """Test setting a parameter while another thread takes all the messages"""
+        def vehicle():
+            m = self.vehicle.recv_match(type='PARAM_SET', blocking=True, timeout=5)
+            self.vehicle.mav.param_value_send(m.param_id.encode('ascii'), m.param_value, m.param_type, 1, 0)
+        taken = []
+        def ui():
+            while len(taken) == 0:
+                m = self.gcs.recv_match(blocking=True, timeout=0.1)
+                if m is not None and m.get_type() == 'PARAM_VALUE':
+                    taken.append(m)
+        threads = [threading.Thread(target=vehicle), threading.Thread(target=ui)]
+        for t in threads:
+            t.start()
+        params = mavparm.MAVParmDict()
+        assert params.mavset(self.gcs, 'RALLY_TOTAL', 3, retries=2)
+        assert params['RALLY_TOTAL'] == 3
+        for t in threads:
+            t.join(5)
+        assert taken[0].param_id == 'RALLY_TOTAL'
+
+    def test_recv_match_threads(self):
+        """Test recv_match in two threads, each getting only its own messages"""
+        got = {'PING': [], 'SYSTEM_TIME': []}
+        def recv(type):
+            while len(got[type]) < 20:
+                m = self.gcs.recv_match(type=type, blocking=True, timeout=2)
+                if m is None:
+                    break
+                got[type].append(m)
+        threads = [threading.Thread(target=recv, args=(t,)) for t in got]
+        for t in threads:
+            t.start()
+        for i in range(20):
+            self.vehicle.mav.ping_send(0, i, 0, 0)
+            self.vehicle.mav.system_time_send(0, i)
+        for t in threads:
+            t.join(5)
+        assert [m.seq for m in got['PING']] == list(range(20))
+        assert [m.time_boot_ms for m in got['SYSTEM_TIME']] == list(range(20))
+        # they were taken from the queue recv_msg() reads, and nothing else was
+        types = []
+        while True:
+            m = self.gcs.recv_msg()
+            if m is None:
+                break
+            types.append(m.get_type())
+        assert 'PING' not in types and 'SYSTEM_TIME' not in types
+
+    def test_error(self):
+        """Test an error in the reader thread is raised to everything waiting"""
+        pings = self.gcs.subscribe(type='PING')
+        self.vehicle.mav.ping_send(0, 1, 0, 0)
+        assert pings.wait(2)
+        def recv(n=None):
+            raise IOError('link lost')
+        self.gcs.recv = recv
+        self.gcs.reader.join(2)
+        assert not self.gcs.reader.is_alive()
+
+        # queued messages come first
+        assert pings.get().seq == 1
+        self.assertRaises(IOError, pings.get)
+        self.assertRaises(IOError, self.gcs.recv_match, type='HEARTBEAT', blocking=True, timeout=1)
+        self.assertRaises(IOError, self.gcs.wait_match, 'HEARTBEAT')
+        self.assertRaises(IOError, self.gcs.subscribe().get)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,8 @@ parser.add_argument("--wire-protocol", choices=[mavparse.PROTOCOL_0_9, mavparse.
 parser.add_argument("--no-validate", action="store_false", dest="validate", default=mavgen.DEFAULT_VALIDATE, help="Do not perform XML validation. Can speed up code generation if XML files are known to be correct.")
 parser.add_argument("--error-limit", default=mavgen.DEFAULT_ERROR_LIMIT, help="maximum number of validation errors to display")
 parser.add_argument("--strict-units", action="store_true", dest="strict_units", default=mavgen.DEFAULT_STRICT_UNITS, help="Perform validation of units attributes.")
+parser.add_argument("--slots", action="store_true", dest="slots", default=mavgen.DEFAULT_SLOTS, help="Python: generate message classes with __slots__ to reduce per-message memory.")
+parser.add_argument("--lazy", action="store_true", dest="lazy", default=mavgen.DEFAULT_LAZY, help="Python: define message classes and enum tables on first use, for faster import. Needs python 3.7 or later.")
 parser.add_argument("definitions", metavar="XML", nargs="+", help="MAVLink definitions")
 args = parser.parse_args()
 
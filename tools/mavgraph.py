@@ -10,7 +10,6 @@ from builtins import range
 import datetime
 import matplotlib
 import os
-import re
 import sys
 import time
 from math import *
@@ -209,15 +208,26 @@ y = []
 modes = []
 axes = []
 first_only = []
-re_caps = re.compile('[A-Z_][A-Z0-9_]+')
+expressions = []
 for f in fields:
-    caps = set(re.findall(re_caps, f))
-    msg_types = msg_types.union(caps)
-    field_types.append(caps)
-    y.append([])
-    x.append([])
     axes.append(1)
     first_only.append(False)
+    if f.endswith(":2"):
+        axes[-1] = 2
+        f = f[:-2]
+    if f.endswith(":1"):
+        first_only[-1] = True
+        f = f[:-2]
+    # compile each field once, this also gives the message types it uses
+    expr = mavutil.compile_expression(f)
+    expressions.append(expr)
+    msg_types = msg_types.union(expr.message_types)
+    field_types.append(expr.message_types)
+    y.append([])
+    x.append([])
+xaxis = None
+if args.xaxis is not None:
+    xaxis = mavutil.compile_expression(args.xaxis)
 
 def add_data(t, msg, vars, flightmode):
     '''add some data'''
@@ -229,20 +239,13 @@ def add_data(t, msg, vars, flightmode):
     for i in range(0, len(fields)):
         if mtype not in field_types[i]:
             continue
-        f = fields[i]
-        if f.endswith(":2"):
-            axes[i] = 2
-            f = f[:-2]
-        if f.endswith(":1"):
-            first_only[i] = True
-            f = f[:-2]
-        v = mavutil.evaluate_expression(f, vars)
+        v = expressions[i].evaluate(vars)
         if v is None:
             continue
-        if args.xaxis is None:
+        if xaxis is None:
             xv = t
         else:
-            xv = mavutil.evaluate_expression(args.xaxis, vars)
+            xv = xaxis.evaluate(vars)
             if xv is None:
                 continue
         y[i].append(v)
@@ -254,6 +257,20 @@ def process_file(filename, timeshift):
     mlog = mavutil.mavlink_connection(filename, notimestamps=args.notimestamps, zero_time_base=args.zero_time_base, dialect=args.dialect)
     vars = {}
 
+    if hasattr(mlog, 'to_arrays') and args.condition is None and xaxis is None and args.flightmode is None and \
+       not any(['MAV' in e.message_types for e in expressions]):
+        # evaluate each field over whole columns rather than per message
+        for i in range(0, len(fields)):
+            (stamps, values) = expressions[i].evaluate_log(mlog)
+            for (t, v) in zip(stamps.tolist(), values.tolist()):
+                try:
+                    tdays = matplotlib.dates.date2num(datetime.datetime.fromtimestamp(t+timeshift))
+                except ValueError:
+                    break
+                x[i].append(tdays)
+                y[i].append(v)
+        return
+
     while True:
         msg = mlog.recv_match(args.condition)
         if msg is None: break
@@ -13,7 +13,6 @@ import simplekml
 from pymavlink.mavextra import *
 from pymavlink import mavutil
 import time
-import re
 import os
 
 mainstate_field = 'STAT.MainState'
@@ -132,10 +131,8 @@ def process_file(filename, source):
     field_types = []
 
     msg_types = set()
-    re_caps = re.compile('[A-Z_][A-Z0-9_]+')
-
     for f in fields:
-        caps = set(re.findall(re_caps, f))
+        caps = mavutil.compile_expression(f).message_types
         msg_types = msg_types.union(caps)
         field_types.append(caps)
     
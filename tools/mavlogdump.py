@@ -117,6 +117,11 @@ if isbin and args.format == 'csv': # need to accumulate columns from message
         print("Need exactly one type when dumping CSV from bin file")
         quit()
 
+# compile the condition once rather than for every message
+condition = None
+if args.condition is not None:
+    condition = mavutil.compile_expression(args.condition)
+
 # Track the last timestamp value. Used for compressing data for the CSV output format.
 last_timestamp = None
 
@@ -159,7 +164,7 @@ while True:
             output.write(struct.pack('>Q', int(timestamp*1.0e6)) + m.get_msgbuf())
             continue
 
-    if not mavutil.evaluate_condition(args.condition, mlog.messages):
+    if not mavutil.evaluate_condition(condition, mlog.messages):
         continue
     if args.source_system is not None and args.source_system != m.get_srcSystem():
         continue
@@ -20,6 +20,17 @@ args = parser.parse_args()
 def mavsearch(filename):
     print("Loading %s ..." % filename)
     mlog = mavutil.mavlink_connection(filename)
+    condition = None
+    if args.condition is not None:
+        condition = mavutil.compile_expression(args.condition)
+    if condition is not None and condition.vectorisable() and hasattr(mlog, 'to_arrays') and \
+       len(condition.message_types) > 0 and not 'MAV' in condition.message_types:
+        # a condition without state can only change when one of its
+        # message types arrives, so if it is never true at those times
+        # over the whole log there is nothing to find
+        (stamps, values) = condition.evaluate_log(mlog)
+        if not values.any():
+            return
     if args.types is not None:
         types = args.types.split(',')
     else:
@@ -28,7 +39,7 @@ def mavsearch(filename):
         m = mlog.recv_match(type=types)
         if m is None:
             break
-        if mlog.check_condition(args.condition):
+        if mlog.check_condition(condition):
             print(m)
             if args.stopcondition:
                 break